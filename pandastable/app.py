@@ -88,7 +88,7 @@ class DataExplore(Frame):
         self.createMenuBar()
         self.discoverPlugins()
         self.setupGUI()
-        self.clipboarddf = None
+        self.clipboardmodel = None
         self.projopen = False
 
         opts = {'layout':{'type':'checkbutton','default':'horizontal'}}
@@ -165,7 +165,8 @@ class DataExplore(Frame):
                          '05Correlation Matrix':{'cmd': lambda: self._call('corrMatrix')},
                          '06Concatenate Tables':{'cmd':self.concat},
                          '07Table to Text':{'cmd': lambda: self._call('showasText')},
-                         '08Table Info':{'cmd': lambda: self._call('showInfo')} }
+                         '08Table Info':{'cmd': lambda: self._call('showInfo')},
+                         '09Optimize Memory':{'cmd': lambda: self._call('optimizeMemory')} }
         self.table_menu=self.createPulldown(self.menu,self.table_menu)
         self.menu.add_cascade(label='Table',menu=self.table_menu['var'])
 
@@ -308,6 +309,8 @@ class DataExplore(Frame):
 
         #load table settings
         util.setAttributes(table, tablesettings)
+        if 'formulae' in meta:
+            table.getFormulaEngine().setMeta(meta['formulae'])
         util.setAttributes(table.rowheader, rowheadersettings)
         if childtable is not None:
             table.createChildTable(df=childtable)
@@ -316,6 +319,7 @@ class DataExplore(Frame):
         #redraw col selections
         if type(table.multiplecollist) is tuple:
             table.multiplecollist = list(table.multiplecollist)
+        table.selectionChanged()
         table.drawMultipleCols()
         return
 
@@ -332,6 +336,8 @@ class DataExplore(Frame):
         #save table selections
         meta['table'] = util.getAttributes(table)
         meta['rowheader'] = util.getAttributes(table.rowheader)
+        if hasattr(table, 'formulaengine'):
+            meta['formulae'] = table.formulaengine.getMeta()
         #save child table if present
         if table.child != None:
             meta['childtable'] = table.child.model.df
@@ -459,6 +465,8 @@ class DataExplore(Frame):
             pass
         for n in self.nb.tabs():
             self.nb.forget(n)
+        for name in self.sheets:
+            self.sheets[name].model.close()
         self.filename = None
         self.projopen = False
         self.main.title('DataExplore')
@@ -501,8 +509,9 @@ class DataExplore(Frame):
         self.load_dataframe(df, name)
         return
 
-    def addSheet(self, sheetname=None, df=None, meta=None, select=False):
-        """Add a sheet with new or existing data"""
+    def addSheet(self, sheetname=None, df=None, meta=None, select=False,
+                 model=None):
+        """Add a sheet with new or existing data or a table model"""
 
         names = [self.nb.tab(i, "text") for i in self.nb.tabs()]
         def checkName(name):
@@ -527,7 +536,7 @@ class DataExplore(Frame):
         self.nb.add(main, text=sheetname)
         f1 = Frame(main)
         main.add(f1)
-        table = Table(f1, dataframe=df, showtoolbar=1, showstatusbar=1)
+        table = Table(f1, dataframe=df, model=model, showtoolbar=1, showstatusbar=1)
         table.show()
         f2 = Frame(main)
         main.add(f2, weight=2)
@@ -563,6 +572,7 @@ class DataExplore(Frame):
         if w==False:
             return
         self.nb.forget(s)
+        self.sheets[name].model.close()
         del self.sheets[name]
         del self.sheetframes[name]
         return
@@ -571,9 +581,10 @@ class DataExplore(Frame):
         """Copy a sheet"""
 
         currenttable = self.getCurrentTable()
-        newdata = currenttable.model.df
+        #the new sheet shares column data until either sheet changes it
+        model = currenttable.model.copy()
         meta = self.saveMeta(currenttable)
-        self.addSheet(newname, df=newdata, meta=meta)
+        self.addSheet(newname, model=model, meta=meta)
         return
 
     def renameSheet(self):
@@ -678,21 +689,22 @@ class DataExplore(Frame):
 
         table = self.getCurrentTable()
         table.model.df.to_clipboard()
+        self.clipboardmodel = table.model.copy()
         return
 
     def pasteTable(self, subtable=False):
         """Paste copied dataframe into current table"""
 
         #add warning?
-        if self.clipboarddf is None:
+        if self.clipboardmodel is None:
             return
-        df = self.clipboarddf
+        model = self.clipboardmodel.copy()
         table = self.getCurrentTable()
         if subtable == True:
-            table.createChildTable(df)
+            table.createChildTable(model.df.copy())
         else:
-            model = TableModel(df)
             table.updateModel(model)
+            table.redraw()
         return
 
     def discoverPlugins(self):
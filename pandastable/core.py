@@ -32,18 +32,25 @@ except:
     import tkSimpleDialog as simpledialog
     import tkMessageBox as messagebox
     from tkFont import Font as font
-import os
+import os, time, re
 import string
 import platform
+import threading
+from contextlib import contextmanager
+try:
+    import queue
+except:
+    import Queue as queue
 import numpy as np
 import pandas as pd
 from pandas.util import clipboard
-from .data import TableModel
+from .data import TableModel, ViewTableModel
+from .formulae import FormulaEngine, FormulaCycleError, Evaluator
 from .headers import ColumnHeader, RowHeader, IndexHeader
 from .plotting import PlotViewer
 from .prefs import Preferences
 from .dialogs import ImportDialog, addButton, AutoScrollbar, MultipleValDialog
-from . import images, util
+from . import images, util, filtering, tasks, strings, dates
 
 askopenfilename = filedialog.askopenfilename
 asksaveasfilename = filedialog.asksaveasfilename
@@ -88,6 +95,22 @@ class Table(tk.Canvas):
         self.child = None
         self.queryrow = 4
         self.childrow = 5
+        self.batchlevel = 0
+        self.batchcalls = []
+        self.batchchanges = False
+        #cached summary of the selected cells for the status bar
+        self._summarykey = None
+        self._selectionversion = 0
+        self._summaryjob = None
+        self.summary = None
+        self.summarythreshold = 200000
+        #rows above which long operations run on a worker
+        self.taskthreshold = 100000
+        #estimated bytes above which pivot and melt avoid dense results
+        self.reshapelimit = 2**29
+        self.querycache = filtering.QueryCache()
+        self.stringcache = strings.StringCache()
+        self.dateparser = dates.DateParser()
         self.loadPrefs()
         self.currentdir = os.path.expanduser('~')
         # set any options passed in kwargs to overwrite defaults and prefs
@@ -309,9 +332,9 @@ Table is then redrawn."""
     def redrawVisible(self, event=None, callback=None):
         """Redraw the visible portion of the canvas"""
 
-#        model = self.model
-        self.rows = len(self.model.df.index)
-        self.cols = len(self.model.df.columns)
+        model = self.model
+        self.rows = model.getRowCount()
+        self.cols = model.getColumnCount()
         if self.cols == 0 or self.rows == 0:
             self.delete('entry')
             self.delete('rowrect', 'colrect')
@@ -347,12 +370,12 @@ Table is then redrawn."""
         align = self.align
         self.delete('fillrect')
 #        bgcolor = self.cellbackgr
-        df = self.model.df
-        for row in self.visiblerows:
-            cols = df.iloc[row, :].fillna('')
-            for col in self.visiblecols:
-                text = cols.iloc[col]
-                self.drawText(row, col, text, align)
+        # fetch only the visible block from the model
+        block = model.getDataBlock(self.visiblerows, self.visiblecols)
+        values = block.astype('object').fillna('').values
+        for r, row in enumerate(self.visiblerows):
+            for c, col in enumerate(self.visiblecols):
+                self.drawText(row, col, values[r, c], align)
 
         self.tablecolheader.redraw()
         self.rowheader.redraw(align=self.align)
@@ -368,9 +391,24 @@ Table is then redrawn."""
     def redraw(self, event=None, callback=None):
         """Redraw table"""
 
+        if self.deferCall('redraw'):
+            return
         self.redrawVisible(event, callback)
         if hasattr(self, 'statusbar'):
             self.statusbar.update()
+        self.refreshChild()
+        return
+
+    def refreshChild(self):
+        """Redraw a child table viewing this one if the data it shows
+           has changed"""
+
+        child = self.child
+        if child is None or not isinstance(child.model, ViewTableModel):
+            return
+        if child.model.dirty == True:
+            child.model.dirty = False
+            child.redraw()
         return
 
     def redrawCell(self, row=None, col=None, recname=None, colname=None):
@@ -426,13 +464,12 @@ Table is then redrawn."""
     def setColPositions(self):
         """Determine current column grid positions"""
 
-        df = self.model.df
         self.col_positions = []
         w = self.cellwidth
         x_pos = self.x_start
         self.col_positions.append(x_pos)
         for col in range(self.cols):
-            colname = str(df.columns[col])
+            colname = self.model.getColumnName(col)
             if colname in self.model.columnwidths:
                 x_pos = x_pos+self.model.columnwidths[colname]
             else:
@@ -444,22 +481,32 @@ Table is then redrawn."""
     def sortTable(self, columnIndex=None, ascending=1, index=False):
         """Set up sort order dict based on currently selected field"""
 
-        df = self.model.df
         if columnIndex is None:
             columnIndex = self.multiplecollist
         if isinstance(columnIndex, int):
             columnIndex = [columnIndex]
-        # assert len(columnIndex) < len(df.columns)
-        if index:
-            df.sort_index(inplace=True)
-        else:
-            colnames = list(df.columns[columnIndex])
+        labels = self.getSelectedRowLabels()
+        model = self.model
+        if not self.canRunTask():
             try:
-                df.sort_values(by=colnames, inplace=True, ascending=ascending)
+                model.sort(columnIndex, ascending=ascending, index=index)
             except Exception as e:
                 print('could not sort')
                 print(e)
-        self.redraw()
+            self.selectRowLabels(labels)
+            self.redraw()
+            return
+
+        df = model.df
+        colnames = list(df.columns[model.getPhysicalColumns(columnIndex)])
+        #only the keys are needed
+        keys = df[[]] if index == True else df[colnames]
+        def done(order):
+            model.df = model.df.take(order)
+            self.selectRowLabels(labels)
+            self.redraw()
+        self.runTask(tasks.sortPositions, (keys, colnames, ascending, index),
+                     done, 'Sorting', check=True, process=True)
         return
 
     def sortColumnIndex(self):
@@ -488,33 +535,33 @@ Table is then redrawn."""
         """Set indexes"""
 
         cols = self.multiplecollist
-        self.model.setindex(cols)
-        self.setSelectedCol(0)
-        self.redraw()
-        self.drawSelectedCol()
-        if hasattr(self, 'pf'):
-            self.pf.updateData()
+        with self.batch():
+            self.model.setindex(cols)
+            self.setSelectedCol(0)
+            self.redraw()
+            self.drawSelectedCol()
+            self.tableChanged()
         return
 
     def resetIndex(self):
         """Reset index and redraw row header"""
 
-        self.model.resetIndex()
-        self.redraw()
-        self.drawSelectedCol()
-        if hasattr(self, 'pf'):
-            self.pf.updateData()
+        with self.batch():
+            self.model.resetIndex()
+            self.redraw()
+            self.drawSelectedCol()
+            self.tableChanged()
         return
 
     def flattenIndex(self):
         """FLatten multiindex"""
 
-        df = self.model.df
-        df.columns = df.columns.get_level_values(0)
-        # self.model.df
-        self.redraw()
-        if hasattr(self, 'pf'):
-            self.pf.updateData()
+        with self.batch():
+            df = self.model.df
+            df.columns = df.columns.get_level_values(0)
+            self.model.columnChanged()
+            self.redraw()
+            self.tableChanged()
         return
 
     def copyIndex(self):
@@ -639,17 +686,80 @@ Table is then redrawn."""
         if not n:
             return
         cols = self.multiplecollist
-        self.model.deleteColumns(cols)
-        self.setSelectedCol(0)
-        self.redraw()
-        self.drawSelectedCol()
-        self.tableChanged()
+        with self.batch():
+            self.model.deleteColumns(cols)
+            self.setSelectedCol(0)
+            self.redraw()
+            self.drawSelectedCol()
+            self.tableChanged()
+        return
+
+    @contextmanager
+    def batch(self):
+        """Group a compound change, e.g. with table.batch(): ...
+           Redraws and change notifications made inside are collected
+           and done once when the outermost batch ends"""
+
+        self.batchlevel += 1
+        try:
+            with self.model.batch():
+                yield self
+        finally:
+            self.batchlevel -= 1
+            if self.batchlevel == 0:
+                self.flushBatch()
+        return
+
+    def deferCall(self, name):
+        """Queue a method to run when the batch ends, returns False
+           when not in a batch and the call should go ahead"""
+
+        if self.batchlevel == 0:
+            return False
+        if name not in self.batchcalls:
+            self.batchcalls.append(name)
+        return True
+
+    def modelChanged(self, changes):
+        """Listener for model changes. Outside of a batch the caller
+           updates the table itself, so only batched changes are kept"""
+
+        if self.batchlevel == 0:
+            return
+        if changes is None or self.batchchanges is None:
+            self.batchchanges = None
+        elif self.batchchanges is False:
+            self.batchchanges = set(changes)
+        else:
+            self.batchchanges.update(changes)
+        return
+
+    def flushBatch(self):
+        """Deliver the merged changes of a batch to the formulas, plot
+           and stats viewers then redraw once"""
+
+        changes, calls = self.batchchanges, self.batchcalls
+        if changes is not False:
+            #recalculation redraws are covered by the one below
+            self.batchlevel += 1
+            if len(getattr(self, 'formulae', {})) > 0:
+                self.recalculateFunctions(changed=changes)
+            self.batchlevel -= 1
+            calls = calls + ['tableChanged', 'redraw']
+            if getattr(self, 'sv', None) is not None:
+                self.sv.updateData()
+        self.batchchanges, self.batchcalls = False, []
+        for name in ['tableChanged', 'redraw', 'drawSelectedCol']:
+            if name in calls:
+                getattr(self, name)()
         return
 
     def tableChanged(self):
         """Callback to be used when dataframe changes so that other
             widgets and data can be updated"""
 
+        if self.deferCall('tableChanged'):
+            return
         self.updateFunctions()
         if hasattr(self, 'pf'):
             self.pf.updateData()
@@ -741,6 +851,7 @@ Are you sure?""", parent=self.parentframe)
             data = pd.Series(np.arange(low, high, step))
         col = df.columns[self.currentcol]
         df[col] = data
+        self.model.columnChanged([col])
         self.redraw()
         return
 
@@ -773,6 +884,7 @@ Are you sure?""", parent=self.parentframe)
         t = d.results[0]
         try:
             self.model.df[col] = df[col].astype(t)
+            self.model.columnChanged([col])
             self.redraw()
         except:
             print('failed')
@@ -807,22 +919,11 @@ Are you sure?""", parent=self.parentframe)
         droprows = d.results[4]
         how = d.results[5]
         dropdups = d.results[6]
-        if method == '':
-            pass
-        elif method == 'fill scalar':
-            df = df.fillna(symbol)
-        elif method == 'interpolate':
-            df = df.interpolate()
-        else:
-            df = df.fillna(method=method, limit=limit)
-        if dropcols == 1:
-            df = df.dropna(axis=1, how=how)
-        if droprows == 1:
-            df = df.dropna(axis=0, how=how)
-        if dropdups == 1:
-            df = df.drop_duplicates()
-        self.model.df = df
-        self.redraw()
+        def done(df):
+            self.model.df = df
+            self.redraw()
+        self.runTask(tasks.cleanData, (self.model, method, symbol, limit, dropcols,
+                     droprows, how, dropdups), done, 'Cleaning data', check=True)
         return
 
     def createCategorical(self):
@@ -874,6 +975,7 @@ Are you sure?""", parent=self.parentframe)
             df[name] = pd.cut(df[col], bins, labels=binlabels)
         else:
             df[name] = df[col].astype('category')
+        self.model.columnChanged([name])
         if name != col:
             self.placeColumn(name, col)
         else:
@@ -910,22 +1012,20 @@ Are you sure?""", parent=self.parentframe)
         funcname = d.results[0]
         newcol = d.results[1]
         inplace = d.results[2]
-#        suffix = d.results[3]
-
-        func = getattr(np, funcname)
+        suffix = d.results[3]
         if newcol == '':
-            newcol = funcname + '(%s)' % (', '.join(cols))
-        if funcname in ['subtract', 'divide', 'mod', 'remainder', 'convolve']:
-            newcol = cols[0] + ' ' + funcname + ' ' + cols[1]
-            df[newcol] = df[cols[0]].combine(df[cols[1]], func=func)
-        else:
-            if inplace:
-                newcol = cols[0]
-            df[newcol] = df[cols].apply(func, 1)
+            newcol = None
+        try:
+            names = self.model.applyColumnWise(cols, funcname, newcol, inplace,
+                                               suffix)
+        except Exception as e:
+            messagebox.showwarning("Apply error", e, parent=self.parentframe)
+            return
         if not inplace:
-            self.placeColumn(newcol, cols[-1])
-        else:
-            self.redraw()
+            for name in reversed(names):
+                if name not in cols:
+                    self.placeColumn(name, cols[-1])
+        self.redraw()
         return
 
     def applyFunction(self, evt=None):
@@ -1041,7 +1141,8 @@ Returns the new DataFrame"""
         return new
 
     def applyStringMethod(self):
-        """Apply string operation to column(s)"""
+        """Apply string operations to column(s). A pipeline of several
+           operations can be given, such as strip | lower | split(',')"""
 
         df = self.model.df
         cols = list(df.columns[self.multiplecollist])
@@ -1049,22 +1150,28 @@ Returns the new DataFrame"""
         funcs = ['', 'split', 'strip', 'lower', 'upper', 'title', 'swapcase',
                  'len', 'slice', 'replace', 'concat']
         d = MultipleValDialog(title='Apply Function',
-                              initialvalues=(funcs, ', ', 0, 1, '', '', 0),
+                              initialvalues=(funcs, ', ', 0, 1, '', '', '', 0, 1),
                               labels=('Function:',
                                       'Split sep:',
                                       'Slice start:',
                                       'Slice end:',
                                       'Pattern:',
                                       'Replace with:',
-                                      'Add as new column(s):'),
+                                      'Or pipeline:',
+                                      'Add as new column(s):',
+                                      'Preview first:'),
                               types=('combobox', 'string', 'int',
-                                     'int', 'string', 'string', 'checkbutton'),
+                                     'int', 'string', 'string', 'string',
+                                     'checkbutton', 'checkbutton'),
                               tooltips=(None, 'separator for split or concat',
                                         'start index for slice',
                                         'end index for slice',
                                         'characters or regular expression for replace',
                                         'characters to replace with',
-                                        'do not replace column'),
+                                        'operations separated by |, e.g. '
+                                        'strip | lower | replace(\'-\', \'_\') | split(\',\')',
+                                        'do not replace column',
+                                        'show the result for a sample of rows'),
                               parent=self.parentframe)
         if d.result is None:
             return
@@ -1074,93 +1181,165 @@ Returns the new DataFrame"""
         end = d.results[3]
         pat = d.results[4]
         repl = d.results[5]
-        newcol = d.results[6]
-        if func == 'split':
-            new = df[col].str.split(sep).apply(pd.Series)
-            new.columns = [col+'_'+str(i) for i in new.columns]
-            self.model.df = pd.concat([df, new], 1)
+        text = d.results[6]
+        newcol = d.results[7]
+        preview = d.results[8]
+        if func == 'concat' and text == '':
+            x = df[col].str.cat(df[cols[1]].astype(str), sep=sep)
+            if newcol == 1:
+                col = col+'_'+func
+            df[col] = x
+            self.model.columnChanged([col])
             self.redraw()
             return
-        elif func == 'strip':
-            x = df[col].str.strip()
-        elif func == 'upper':
-            x = df[col].str.upper()
-        elif func == 'lower':
-            x = df[col].str.lower()
-        elif func == 'title':
-            x = df[col].str.title()
-        elif func == 'swapcase':
-            x = df[col].str.swapcase()
-        elif func == 'len':
-            x = df[col].str.len()
-        elif func == 'slice':
-            x = df[col].str.slice(start, end)
-        elif func == 'replace':
-            x = df[col].replace(pat, repl, regex=True)
-        elif func == 'concat':
-            x = df[col].str.cat(df[cols[1]].astype(str), sep=sep)
-        if newcol == 1:
-            col = col+'_'+func
-        df[col] = x
+        try:
+            if text != '':
+                steps = strings.parseSteps(text)
+            elif func == 'split':
+                steps = [('split', (sep,))]
+            elif func == 'slice':
+                steps = [('slice', (start, end))]
+            elif func == 'replace':
+                steps = [('replace', (pat, repl))]
+            elif func == '':
+                return
+            else:
+                steps = [strings.makeStep(func)]
+            pipeline = strings.StringPipeline(steps)
+            if preview == 1:
+                p = pipeline.preview(df[col])
+                n = messagebox.askyesno("Preview",
+                                        "%s\n\nApply to %s column(s)?" %(p.to_string(), len(cols)),
+                                        parent=self.parentframe)
+                if not n:
+                    return
+            self.applyPipeline(pipeline, cols, newcol)
+        except Exception as e:
+            messagebox.showwarning("String error", e, parent=self.parentframe)
+            return
         self.redraw()
         return
 
+    def applyPipeline(self, pipeline, cols, newcol=False):
+        """Run a string pipeline on the columns. Results of each step
+           are cached by column version, so a changed pipeline only
+           redoes the steps after the ones it shares"""
+
+        model = self.model
+        df = model.df
+        name = pipeline.steps[-1][0] if pipeline.steps else 'str'
+        changed = []
+        with model.batch():
+            for col in cols:
+                key = (model.uid, col, model.getColumnVersion(col),
+                       model.getIndexVersion())
+                x = pipeline.apply(df[col], key, self.stringcache)
+                if isinstance(x, pd.DataFrame):
+                    x.columns = [str(col)+'_'+str(i) for i in x.columns]
+                    for c in x.columns:
+                        df[c] = x[c]
+                        changed.append(c)
+                    continue
+                c = str(col)+'_'+name if newcol == 1 else col
+                df[c] = x
+                changed.append(c)
+            model.columnChanged(changed)
+        return changed
+
     def convertDates(self):
-        """Convert single or multiple columns into datetime"""
+        """Convert single or multiple columns into datetime and extract
+           datetime fields. Formats are inferred from a sample of each
+           column and remembered for it"""
 
         df = self.model.df
         cols = list(df.columns[self.multiplecollist])
-        if len(cols) == 1:
-            colname = cols[0]
-            temp = df[colname]
-        else:
-            colname = '-'.join(cols)
-            temp = df[cols]
-
-        timeformats = ['infer', '%d%m%Y', '%Y%m%d']
-        props = ['day', 'month', 'minute', 'second', 'year',
-                 'dayofyear', 'weekofyear', 'quarter']
+        timeformats = ['infer'] + dates.dateformats
         d = MultipleValDialog(title='Data/time conversion',
-                              initialvalues=['', timeformats, props, True],
+                              initialvalues=['', timeformats, dates.fields, True],
                               labels=['Column name:', 'Convert to date:',
                                       'Extract from datetime:', 'In place:'],
-                              types=['string', 'combobox', 'combobox',
+                              types=['string', 'combobox', 'listbox',
                                      'checkbutton'],
+                              tooltips=['name of the new column',
+                                        'format of the dates, infer finds it from the values',
+                                        'one or more fields to add as columns',
+                                        'replace the column'],
                               parent=self.parentframe)
 
         if d.result is None:
             return
         newname = d.results[0]
-        if newname != '':
-            colname = newname
         fmt = d.results[1]
-        prop = d.results[2]
+        props = d.results[2]
         inplace = d.results[3]
         if fmt == 'infer':
             fmt = None
+        if props == '':
+            props = []
 
-        if len(cols) == 1 and temp.dtype == 'datetime64[ns]':
-            df[colname] = getattr(temp.dt, prop)
-            self.redraw()
-            return
+        units = ['year', 'month', 'day', 'hour', 'minute', 'second']
+        placed = []
         try:
-            df[colname] = pd.to_datetime(temp, format=fmt, errors='coerce')
+            if len(cols) > 1 and all(str(c).lower() in units for c in cols):
+                #assemble one date from columns of its parts
+                colname = newname or '-'.join(cols)
+                df[colname] = pd.to_datetime(df[cols], errors='coerce')
+                self.model.columnChanged([colname])
+                placed.append((colname, cols[-1]))
+                cols = [colname]
+            else:
+                for col in cols:
+                    if df[col].dtype.kind == 'M':
+                        continue
+                    colname = col
+                    if newname != '' and len(cols) == 1 and len(props) == 0:
+                        colname = newname
+                    d = self.dateparser.parse(df[col], fmt, key=col)
+                    lost = self.dateparser.lost
+                    if lost > 0 and colname == col:
+                        ok = messagebox.askyesno("Convert dates",
+                                    "%s values of %s could not be read as dates "
+                                    "and will be empty.\nReplace the column?" %(lost, col),
+                                    parent=self.parentframe)
+                        if not ok:
+                            continue
+                    df[colname] = d
+                    self.model.columnChanged([colname])
+                    if colname != col:
+                        placed.append((colname, col))
+            for col in cols:
+                if len(props) == 0:
+                    break
+                if len(props) == 1 and inplace:
+                    names = [newname or col]
+                elif len(props) == 1 and newname != '':
+                    names = [newname]
+                else:
+                    names = ['%s_%s' %(col, p) for p in props]
+                new = dates.extractFields(df[col], props)
+                for name, p in zip(names, props):
+                    df[name] = new[p]
+                    if name != col:
+                        placed.append((name, col))
+                self.model.columnChanged(names)
         except Exception as e:
             messagebox.showwarning("Convert error", e,
                                    parent=self.parentframe)
-        if not inplace or len(cols) > 1:
-            print(cols[-1])
-            self.placeColumn(colname, cols[-1])
-        else:
-            self.redraw()
+        for name, col in reversed(placed):
+            self.placeColumn(name, col)
+        self.redraw()
         return
 
     def showAll(self):
         """Re-show unfiltered"""
 
-        if hasattr(self, 'dataframe'):
-            self.model.df = self.dataframe
+        labels = self.getSelectedRowLabels()
+        if hasattr(self.model, 'setFilter') and not self.model.inMemory():
+            self.model.setFilter(None)
+        elif self.filtered and hasattr(self, 'dataframe'):
+            self.restoreUnfiltered()
         self.filtered = False
+        self.selectRowLabels(labels)
         self.redraw()
         return
 
@@ -1187,17 +1366,49 @@ Returns the new DataFrame"""
         if s == '':
             self.showAll()
             return
+        labels = self.getSelectedRowLabels()
+        if hasattr(self.model, 'setFilter') and not self.model.inMemory():
+            #filter where the data is kept, without loading it
+            try:
+                self.model.setFilter(s)
+            except ValueError as e:
+                messagebox.showwarning("Query error", e, parent=self.parentframe)
+                return
+            self.filtered = True
+            self.selectRowLabels(labels)
+            self.redraw()
+            return
         if self.filtered:
-            self.model.df = self.dataframe
+            self.restoreUnfiltered()
         df = self.model.df
-        filtdf = df.query(s)
-        # replace current dataframe but keep a copy!
-        self.dataframe = self.model.df.copy()
+        token = self.getQueryToken()
+        mask = self.querycache.getMask(df, s, token, self.model)
+        filtdf = df[mask]
+        # replace current dataframe but keep the original
+        self.dataframe = df
+        self.querytoken = token
         self.model.df = filtdf
         self.filtered = True
+        self.selectRowLabels(labels)
         self.redraw()
         return
 
+    def getQueryToken(self):
+        """Version of the table data that query masks are valid for"""
+
+        m = self.model
+        #versions start again for each model
+        return (m.uid, m.getRowCount(), m.getIndexVersion(), m.getColumnSetVersion(),
+                tuple(m.getColumnVersion(c) for c in m.getColumnLabels()))
+
+    def restoreUnfiltered(self):
+        """Put back the data a query was made from. It is unchanged so
+           cached query masks stay valid"""
+
+        self.model.df = self.dataframe
+        self.querycache.rebase(getattr(self, 'querytoken', None), self.getQueryToken())
+        return
+
     def queryBar(self, evt=None):
         """Use string query to filter. Will not work with spaces in column
         names, so these would need to be converted first."""
@@ -1225,12 +1436,11 @@ Returns the new DataFrame"""
     def _eval(self, df, ex):
         """Evaluate an expression using numexpr"""
 
-        # uses assignments to globals() - check this is ok
-        import numexpr as ne
-        for c in df:
-            globals()[c] = df[c].as_matrix()
-        a = ne.evaluate(ex)
-        return a
+        if not hasattr(self, 'evaluator'):
+            self.evaluator = Evaluator()
+        threads = self.prefs.get('evalthreads')
+        self.evaluator.threads = threads if threads > 0 else None
+        return self.evaluator.evaluate(df, ex)
 
     def evalFunction(self, evt=None):
         """Apply a string based function to create new columns"""
@@ -1249,23 +1459,32 @@ Returns the new DataFrame"""
             n, ex = vals
         if n == '':
             return
+        engine = self.getFormulaEngine()
+        try:
+            refs = engine.check(n, ex, list(df.columns))
+        except FormulaCycleError as e:
+            messagebox.showwarning("Formula", str(e), parent=self.parentframe)
+            self.functionentry.configure(style="Red.TCombobox")
+            return
         # evaluate
         try:
             df[n] = self._eval(df, ex)
+            self.model.columnChanged([n])
+            self.formulaversions[n] = self.getFormulaVersion(n, ex)
             self.functionentry.configure(style="White.TCombobox")
         except Exception as e:
             print('function parse error')
             print(e)
             self.functionentry.configure(style="Red.TCombobox")
             return
-        # keep track of which cols are functions?
-        self.formulae[n] = ex
+        # keep track of which cols are functions and what they use
+        engine.add(n, ex, refs)
 
         if self.placecolvar.get() == 1:
             cols = df.columns
             self.placeColumn(n, cols[0])
         if self.recalculatevar.get() == 1:
-            self.recalculateFunctions(omit=n)
+            self.recalculateFunctions(changed=[n])
         else:
             self.redraw()
         if hasattr(self, 'pf') and self.updateplotvar.get() == 1:
@@ -1275,33 +1494,62 @@ Returns the new DataFrame"""
         self.functionentry['values'] = funclist
         return
 
-    def recalculateFunctions(self, omit=None):
-        """Re evaluate any columns that were derived from functions
-        and dependent on other columns (except self derived?)"""
+    def getFormulaEngine(self):
+        """Formula columns and their dependencies"""
+
+        if not hasattr(self, 'formulaengine'):
+            self.formulaengine = FormulaEngine()
+            self.formulae = self.formulaengine.formulae
+            self.formulaversions = {}
+        return self.formulaengine
 
+    def recalculateFunctions(self, omit=None, changed=None):
+        """Re evaluate columns derived from functions, in dependency
+        order. If changed columns are given only the formulae that
+        use them, directly or through other formulae, are done"""
+
+        try:
+            order = self.getFormulaEngine().getOrder(changed)
+        except FormulaCycleError as e:
+            messagebox.showwarning("Formula error", e, parent=self.parentframe)
+            return
         df = self.model.df
-        for n in self.formulae:
+        for n in order:
             if n == omit:
                 continue
             ex = self.formulae[n]
+            #skip if none of the columns used have changed
+            version = self.getFormulaVersion(n, ex)
+            if self.formulaversions.get(n) == version:
+                continue
             # need to check if self calculation here...
             try:
                 df[n] = self._eval(df, ex)
+                self.model.columnChanged([n])
+                self.formulaversions[n] = version
             except:
                 print('could not calculate %s' % ex)
         self.redraw()
         return
 
+    def getFormulaVersion(self, n, ex):
+        """Versions of the rows and of the columns a formula uses"""
+
+        model = self.model
+        names = set(re.findall(r'[A-Za-z_]\w*', ex))
+        cols = [c for c in model.getColumnLabels() if c in names and c != n]
+        return (model.getIndexVersion(),
+                tuple((c, model.getColumnVersion(c)) for c in cols))
+
     def updateFunctions(self):
         """Remove functions if a column has been deleted"""
 
         if not hasattr(self, 'formulae'):
             return
-        df = self.model.df
-        cols = list(df.columns)
+        cols = list(self.model.getColumnLabels())
         for n in list(self.formulae.keys()):
             if n not in cols:
-                del(self.formulae[n])
+                self.formulaengine.remove(n)
         return
 
     def functionsBar(self, evt=None):
@@ -1356,7 +1604,8 @@ Proceed?""",
                                     parent=self.parentframe)
             if n is None:
                 return
-            self.formulae = {}
+            self.getFormulaEngine().clear()
+            self.formulaversions = {}
             self.functionentry['values'] = []
             return
 
@@ -1370,8 +1619,7 @@ Proceed?""",
 
         if hasattr(self, 'evalframe') and self.evalframe is not None:
             return
-        if not hasattr(self, 'formulae'):
-            self.formulae = {}
+        self.getFormulaEngine()
         ef = self.evalframe = ttk.Frame(self.parentframe)
         ef.grid(row=self.queryrow, column=0, columnspan=3, sticky='news')
         bf = ttk.Frame(ef)
@@ -1454,6 +1702,7 @@ Proceed?""",
         self.currentrow = row
         self.multiplerowlist = []
         self.multiplerowlist.append(row)
+        self.selectionChanged()
         return
 
     def setSelectedCol(self, col):
@@ -1462,6 +1711,7 @@ Proceed?""",
         self.currentcol = col
         self.multiplecollist = []
         self.multiplecollist.append(col)
+        self.selectionChanged()
         return
 
     def setSelectedCells(self, startrow, endrow, startcol, endcol):
@@ -1477,6 +1727,20 @@ Proceed?""",
             self.multiplerowlist.append(r)
         for c in range(startcol, endcol):
             self.multiplecollist.append(c)
+        self.selectionChanged()
+        return
+
+    def selectionChanged(self):
+        """Note a change to the selected rows or columns. The selection
+           summary is keyed on this count rather than on the rows and is
+           updated once the events that changed it are handled"""
+
+        self._selectionversion += 1
+        if self._summaryjob is None:
+            def update():
+                self._summaryjob = None
+                self.updateSelectionSummary()
+            self._summaryjob = self.after_idle(update)
         return
 
     def getSelectedRow(self):
@@ -1498,6 +1762,30 @@ Proceed?""",
         self.endcol = self.cols
         self.multiplecollist = list(range(self.startcol, self.endcol))
         self.drawMultipleCells()
+        self.selectionChanged()
+        return
+
+    def getSelectedRowLabels(self):
+        """Index labels of the selected rows, current row first"""
+
+        index = self.model.getIndex()
+        n = len(index)
+        rows = [r for r in self.multiplerowlist if r < n and r != self.currentrow]
+        if self.currentrow < n:
+            rows.insert(0, self.currentrow)
+        return list(index[rows])
+
+    def selectRowLabels(self, labels):
+        """Select rows by index label, used to keep the selection when
+           rows are sorted or filtered"""
+
+        rows = self.model.getRowPositions(labels)
+        if len(rows) == 0:
+            self.setSelectedRow(0)
+            return
+        self.currentrow = rows[0]
+        self.multiplerowlist = sorted(rows)
+        self.selectionChanged()
         return
 
     def selectNone(self):
@@ -1506,6 +1794,7 @@ Proceed?""",
 
         self.multiplecollist = []
         self.multiplerowlist = []
+        self.selectionChanged()
         self.startrow = self.endrow = 0
         self.delete('multicellrect', 'multiplesel', 'colrect')
         return
@@ -1575,6 +1864,7 @@ Proceed?""",
         # reset multiple selection list
         self.multiplerowlist = []
         self.multiplerowlist.append(self.currentrow)
+        self.selectionChanged()
         self.drawSelectedRect(self.currentrow, self.currentcol)
         self.drawSelectedRow()
         coltype = self.model.getColumnType(self.currentcol)
@@ -1593,6 +1883,7 @@ Proceed?""",
         # reset multiple selection list
         self.multiplerowlist = []
         self.multiplerowlist.append(self.currentrow)
+        self.selectionChanged()
         self.drawSelectedRect(self.currentrow, self.currentcol)
         self.drawSelectedRow()
         coltype = self.model.getColumnType(self.currentcol)
@@ -1627,6 +1918,7 @@ Proceed?""",
         # reset multiple selection list
         self.multiplerowlist = []
         self.multiplerowlist.append(rowclicked)
+        self.selectionChanged()
         if 0 <= rowclicked < self.rows and 0 <= colclicked < self.cols:
             self.setSelectedRow(rowclicked)
             self.setSelectedCol(colclicked)
@@ -1655,6 +1947,7 @@ Proceed?""",
             self.drawMultipleRows(self.multiplerowlist)
             if colclicked not in self.multiplecollist:
                 self.multiplecollist.append(colclicked)
+            self.selectionChanged()
             self.drawMultipleCells()
         return
 
@@ -1708,6 +2001,7 @@ Proceed?""",
             if len(self.multiplecollist) >= 1:
                 self.drawMultipleCells()
             self.delete('multiplesel')
+        self.selectionChanged()
         return
 
     def handle_arrow_keys(self, event):
@@ -1726,7 +2020,7 @@ Proceed?""",
             else:
                 # self.yview('moveto', y)
                 # self.rowheader.yview('moveto', y)
-                self.currentrow = self.currentrows-1
+                self.currentrow = self.currentrow-1
         elif event.keysym == 'Down':
             if self.currentrow >= self.rows-1:
                 return
@@ -1744,7 +2038,11 @@ Proceed?""",
             else:
                 self.currentcol = self.currentcol+1
         elif event.keysym == 'Left':
+            if self.currentcol == 0:
+                return
             self.currentcol = self.currentcol-1
+        self.setSelectedRow(self.currentrow)
+        self.setSelectedCol(self.currentcol)
         self.drawSelectedRect(self.currentrow, self.currentcol)
 #        coltype = self.model.getColumnType(self.currentcol)
 #        if coltype == 'text' or coltype == 'number':
@@ -1798,8 +2096,9 @@ Proceed?""",
         """Move col2 next to col1, useful for placing a new column
         made from the first one next to it so user can see it easily"""
 
-        ind1 = self.model.df.columns.get_loc(col1)
-        ind2 = self.model.df.columns.get_loc(col2)
+        columns = self.model.getColumnLabels()
+        ind1 = columns.get_loc(col1)
+        ind2 = columns.get_loc(col2)
         self.model.moveColumn(ind1, ind2+1)
         self.redraw()
         return
@@ -1818,14 +2117,34 @@ Proceed?""",
     def movetoSelectedRow(self, row=None, recname=None):
         """Move to selected row, updating table"""
 
-        row = self.model.getRecordIndex(recname)
+        if recname is not None:
+            row = self.model.getRecordIndex(recname)
+        if row is None:
+            return
         self.setSelectedRow(row)
         self.drawSelectedRow()
         x, y = self.getCanvasPos(row, 0)
         self.yview('moveto', y-0.01)
+        self.rowheader.yview('moveto', y-0.01)
         self.tablecolheader.yview('moveto', y)
         return
 
+    def gotoRow(self):
+        """Go to the row with a given index label"""
+
+        key = simpledialog.askstring("Go to row", "Index label:",
+                                     parent=self.parentframe)
+        if key is None or key == '':
+            return
+        row = self.model.findRecord(key)
+        if row is None:
+            messagebox.showwarning("Not found", "No row with index %s" %key,
+                                   parent=self.parentframe)
+            return
+        self.movetoSelectedRow(row)
+        self.redraw()
+        return
+
     def copyTable(self, event=None):
         """Copy from the clipboard"""
 
@@ -1862,8 +2181,7 @@ Proceed?""",
         if len(rows) < 1:
             rows = list(range(self.rows))
         cols = self.multiplecollist
-        df = self.model.df
-        data = df.iloc[rows, cols]
+        data = self.model.getDataBlock(rows, cols)
         try:
             if len(cols) > 1:
                 data.to_clipboard()
@@ -1886,78 +2204,191 @@ Proceed?""",
     def aggregate(self):
         """Show aggregate dialog"""
 
-#        df = self.model.df
         from .dialogs import AggregateDialog
-        dlg = AggregateDialog(self, df=self.model.df)
-        g = dlg.result
-        if g is None:
-            return
-        replace = False
-        # replace or make new table
-        if replace:
-            self.model.df = g
-            self.showIndex()
-            self.redraw()
+        model = self.model
+        rows = self.multiplerowlist
+        if hasattr(model, 'inMemory') and not model.inMemory() and len(rows) > 1:
+            #only read the selected rows of data that isn't loaded
+            df = model.getDataBlock(rows, slice(None))
         else:
+            df = model.df
+        dlg = AggregateDialog(self, df=df, compute=False)
+        if dlg.aggdict is None:
+            return
+        grp, aggdict = dlg.grp, dlg.aggdict
+        def done(g):
             self.createChildTable(g, 'aggregated', index=True)
+        data = model if df is model.df else df
+        def aggregate(grouping=None):
+            self.runTask(tasks.aggregate, (data, grp, aggdict, grouping), done,
+                         'Aggregating', process=True)
+        if df is not model.df or len(grp) == 0:
+            aggregate()
+            return
+        #group codes are kept by the model so other aggregations reuse them
+        grouping = model.getGrouping(grp, build=False)
+        if grouping is not None:
+            aggregate(grouping)
+            return
+        version = model.getGroupingVersion(grp)
+        def grouped(grouping):
+            model.addGrouping(grp, version, grouping)
+            aggregate(grouping)
+        self.runTask(tasks.makeGrouping, (model, grp), grouped, 'Grouping',
+                     process=True)
         return
 
+    def getGrouping(self, keys, data=None):
+        """Groups of the model for keys, restricted to the selected rows
+           when data is the selection. None if they can't be used for
+           data, such as when it doesn't come from the model"""
+
+        model = self.model
+        if hasattr(model, 'inMemory') and not model.inMemory():
+            return None
+        if getattr(model, 'transposed', False) == True:
+            return None
+        if any(k not in model.df.columns for k in keys):
+            return None
+        grouping = model.getGrouping(keys)
+        rows = self.multiplerowlist
+        if data is not None and len(data) != model.getRowCount():
+            if len(rows) != len(data):
+                return None
+            grouping = grouping.take(rows)
+        return grouping
+
+    def getReshapeEstimate(self, kind, key, variable, values):
+        """Predicted size of a pivot (key is the index, variable the
+           column) or a melt (key is the id variable), from the column
+           stats. values None means all other numeric columns"""
+
+        model = self.model
+        df = model.df
+        n = model.getRowCount()
+        if values is None or values == '':
+            numeric = df.select_dtypes(include=[np.number]).columns
+            values = [c for c in numeric if c not in [key, variable]]
+        elif not isinstance(values, list):
+            values = [values]
+        if kind == 'pivot':
+            nindex = model.getColumnStats(key)['distinct']
+            ncolumns = model.getColumnStats(variable)['distinct']
+            est = tasks.pivotEstimate(n, nindex, ncolumns, len(values))
+        else:
+            ids = [] if key in [None, ''] else [key]
+            sizes = [df[c].dtype.itemsize for c in ids]
+            est = tasks.meltEstimate(n, sizes, len(values))
+        return est
+
+    def getReshapeMethod(self, est, method, sparse=True):
+        """Execution method for a reshape, auto avoids dense results
+           above the reshape limit"""
+
+        if method != 'auto':
+            return method
+        if est['bytes'] <= self.reshapelimit:
+            return 'dense'
+        if sparse == True and est['sparsebytes'] < est['bytes']/2:
+            return 'sparse'
+        return 'chunked'
+
+    def reshapeInfo(self, kind, key, variable, values):
+        est = self.getReshapeEstimate(kind, key, variable, values)
+        text = 'Result: ' + tasks.estimateText(est)
+        if est['bytes'] > self.reshapelimit:
+            text += '\nabove the limit of %s, auto uses %s' %(util.formatBytes(self.reshapelimit),
+                    self.getReshapeMethod(est, 'auto', kind=='pivot'))
+        return text
+
+    def confirmReshape(self, est, method):
+        """Ask before making a dense result above the limit"""
+
+        if method != 'dense' or est['bytes'] <= self.reshapelimit:
+            return True
+        return messagebox.askyesno("Large result",
+                                   "The result will use about %s.\nContinue?"
+                                   %util.formatBytes(est['bytes']),
+                                   parent=self.parentframe)
+
     def melt(self):
         """Melt table"""
 
         df = self.model.df
         cols = list(df.columns)
         valcols = list(df.select_dtypes(include=[np.float64, np.int32]))
-        d = MultipleValDialog(title='Pivot',
-                              initialvalues=(cols, valcols, 'var'),
-                              labels=('ID vars:', 'Value vars:', 'var name:'),
-                              types=('combobox', 'listbox', 'entry'),
+        methods = ['auto', 'dense', 'chunked']
+        info = lambda v: self.reshapeInfo('melt', v[0], None, v[1])
+        d = MultipleValDialog(title='Melt',
+                              initialvalues=(cols, valcols, 'var', methods),
+                              labels=('ID vars:', 'Value vars:', 'var name:',
+                                      'Method:'),
+                              types=('combobox', 'listbox', 'entry', 'combobox'),
                               tooltips=('Column(s) to use as identifier variables',
                                         'Column(s) to unpivot',
-                                        'name of variable column'),
-                              parent=self.parentframe)
+                                        'name of variable column',
+                                        'chunked fills the result a column at a time'),
+                              parent=self.parentframe, info=info)
+        if d.result is None:
+            return
         idvars = d.results[0]
         valuevars = d.results[1]
         varname = d.results[2]
+        est = self.getReshapeEstimate('melt', idvars, None, valuevars)
+        method = self.getReshapeMethod(est, d.results[3], sparse=False)
+        if not self.confirmReshape(est, method):
+            return
         if valuevars == '':
             valuevars = None
         elif len(valuevars) == 1:
             valuevars = valuevars[0]
-        t = pd.melt(df, id_vars=idvars, value_vars=valuevars,
-                    var_name=varname, value_name='value')
-#        print(t)
-        self.createChildTable(t, '', index=True)
+        def done(t):
+            self.createChildTable(t, '', index=True)
+        self.runTask(tasks.melt, (self.model, idvars, valuevars, varname, 'value',
+                     method), done, 'Melting', process=method=='dense')
         return
 
     def pivot(self):
         """Pivot table"""
 
-        self.convertNumeric()
+        self.convertNumeric(callback=self.pivotDialog)
+        return
+
+    def pivotDialog(self):
+        """Get the pivot options and make the pivot table"""
+
         df = self.model.df
         cols = list(df.columns)
         valcols = list(df.select_dtypes(include=[np.float64, np.int32]))
+        methods = ['auto', 'dense', 'chunked', 'sparse']
+        info = lambda v: self.reshapeInfo('pivot', v[0], v[1], v[2])
         d = MultipleValDialog(title='Pivot',
-                              initialvalues=(cols, cols, valcols),
-                              labels=('Index:', 'Column:', 'Values:'),
-                              types=('combobox', 'combobox', 'listbox'),
+                              initialvalues=(cols, cols, valcols, methods),
+                              labels=('Index:', 'Column:', 'Values:', 'Method:'),
+                              types=('combobox', 'combobox', 'listbox', 'combobox'),
                               tooltips=('a unique index to reshape on', 'column with variables',
-                                        'selecting no values uses all remaining cols'),
-                              parent=self.parentframe)
+                                        'selecting no values uses all remaining cols',
+                                        'chunked aggregates parts of the rows, '
+                                        'sparse also makes sparse columns'),
+                              parent=self.parentframe, info=info)
         if d.result is None:
             return
         index = d.results[0]
         column = d.results[1]
         values = d.results[2]
+        est = self.getReshapeEstimate('pivot', index, column, values)
+        method = self.getReshapeMethod(est, d.results[3])
+        if not self.confirmReshape(est, method):
+            return
         if values == '':
             values = None
         elif len(values) == 1:
             values = values[0]
 
-        p = pd.pivot_table(df, index=index, columns=column, values=values)
-        print(p)
-        if type(p) is pd.Series:
-            p = pd.DataFrame(p)
-        self.createChildTable(p, 'pivot-%s-%s' % (index, column), index=True)
+        def done(p):
+            self.createChildTable(p, 'pivot-%s-%s' % (index, column), index=True)
+        self.runTask(tasks.pivot, (self.model, index, column, values, method),
+                     done, 'Pivoting', process=method=='dense')
         return
 
     def doCombine(self):
@@ -1966,13 +2397,57 @@ Proceed?""",
         if self.child is None:
             return
         from .dialogs import CombineDialog
-        cdlg = CombineDialog(self, df1=self.model.df, df2=self.child.model.df)
-        df = cdlg.merged
-        if df is None:
+        df1 = self.model.df
+        df2 = self.child.model.df
+        cdlg = CombineDialog(self, df1=df1, df2=df2, compute=False)
+        if cdlg.method is None:
             return
-        model = TableModel(dataframe=df)
-        self.updateModel(model)
-        self.redraw()
+        method, kwds = cdlg.method, cdlg.kwds
+        def done(df):
+            if len(df) == 0:
+                return
+            n = messagebox.askyesno("Join done",
+                                    "Merge/concat success.\nReplace table with new data?",
+                                    parent=self.parentframe)
+            if n == True:
+                self.updateModel(TableModel(dataframe=df))
+                self.redraw()
+        models = [self.model, self.child.model]
+        def combine(plan=None):
+            self.runTask(tasks.combine, (models[0], models[1], method, kwds, plan),
+                         done, 'Combining', size=len(df1)+len(df2), process=True)
+        if method != 'merge':
+            combine()
+            return
+
+        #key indexes are kept by each table model for later merges
+        keys = [kwds.get('left_on'), kwds.get('right_on')]
+        indexes = [None, None]
+        versions = [None, None]
+        for i in range(2):
+            m = models[i]
+            if keys[i] and hasattr(m, 'getGrouping') and \
+                    (not hasattr(m, 'inMemory') or m.inMemory()):
+                versions[i] = m.getGroupingVersion(keys[i])
+                indexes[i] = m.getGrouping(keys[i], build=False)
+        def planned(plan):
+            for i, name in enumerate(['lindex', 'rindex']):
+                if versions[i] is not None and indexes[i] is None and plan[name] is not None:
+                    models[i].addGrouping(keys[i], versions[i], plan[name])
+            rows = plan['rows']
+            if rows is not None:
+                size = rows*(len(df1.columns)+len(df2.columns))*8
+                if plan['manytomany'] == True or size > self.reshapelimit:
+                    msg = 'The merge will give %s rows, about %s.' %(rows, util.formatBytes(size))
+                    if plan['manytomany'] == True:
+                        msg += '\nSome keys match several rows in both tables (many to many).'
+                    if not messagebox.askyesno("Merge size", msg+'\nContinue?',
+                                               parent=self.parentframe):
+                        return
+            combine(plan)
+        self.runTask(tasks.planMerge, (models[0], models[1], kwds, indexes[0],
+                     indexes[1]), planned, 'Planning merge', size=len(df1)+len(df2),
+                     process=True)
         return
 
     def merge(self, table):
@@ -1989,8 +2464,8 @@ Proceed?""",
     def describe(self):
         """Create table summary"""
 
-        g = self.model.df.describe()
-        self.createChildTable(g)
+        g = self.model.describe()
+        self.createChildTable(g, 'summary', index=True)
         return
 
     def convertColumnNames(self, s='_'):
@@ -2020,27 +2495,83 @@ Proceed?""",
             df.columns = df.columns.str.lower()
         elif upper == 1:
             df.columns = df.columns.str.upper()
+        self.model.columnChanged()
         self.redraw()
         return
 
-    def convertNumeric(self):
-        """Convert cols to numeric if possible"""
+    def convertNumeric(self, callback=None):
+        """Convert cols to numeric if possible, then call callback"""
 
-        df = self.model.df
-        self.model.df = df.convert_objects(convert_numeric='force')
+        model = self.model
+        if not self.canRunTask():
+            model.convertNumeric()
+            self.redraw()
+            if callback is not None:
+                callback()
+            return
+
+        def done(new):
+            with model.batch():
+                for c in new:
+                    model.df[c] = new[c]
+                    model.columnChanged([c])
+            self.redraw()
+            if callback is not None:
+                callback()
+        self.runTask(tasks.convertNumeric, (model,), done,
+                     'Converting columns', check=True)
+        return
+
+    def optimizeMemory(self):
+        """Reduce memory used by the table and show what was saved"""
+
+        d = MultipleValDialog(title='Optimize Memory',
+                              initialvalues=(1, 1, 0.5, 1000, 0, 0.9),
+                              labels=('Downcast numeric:',
+                                      'Convert to categorical:',
+                                      'Max unique ratio:',
+                                      'Max categories:',
+                                      'Make sparse:',
+                                      'Sparse fill ratio:'),
+                              types=('checkbutton', 'checkbutton', 'float',
+                                     'int', 'checkbutton', 'float'),
+                              tooltips=('use smallest numeric type that keeps all values',
+                                        'store repeated strings as categories',
+                                        'unique values/rows below which to convert',
+                                        'most categories allowed for a column',
+                                        'store mostly constant columns as sparse',
+                                        'fraction of rows with the same value'),
+                              parent=self.parentframe)
+        if d.result is None:
+            return
+        try:
+            report = self.model.optimizeMemory(downcast=d.results[0],
+                                               categories=d.results[1],
+                                               catratio=float(d.results[2]),
+                                               maxcategories=int(d.results[3]),
+                                               sparse=d.results[4],
+                                               sparseratio=float(d.results[5]))
+        except ValueError as e:
+            messagebox.showwarning("Optimize error", e,
+                                   parent=self.parentframe)
+            return
         self.redraw()
+        self.tableChanged()
+        self.createChildTable(report, 'memory', index=True)
         return
 
     def corrMatrix(self):
         """Correlation matrix"""
 
-        df = self.model.df
-        corr = df.corr()
-        self.createChildTable(corr)
+        self.runTask(tasks.corrMatrix, (self.model,), self.createChildTable,
+                     'Correlation matrix')
         return
 
-    def createChildTable(self, df, title=None, index=False, out=False):
-        """Add the child table"""
+    def createChildTable(self, df=None, title=None, index=False, out=False,
+                         view=None):
+        """Add the child table. Instead of a dataframe a view can be
+           given as a dict with the parent model, rows and columns keys,
+           the child then reads from the parent until it is edited"""
 
         self.closeChildTable()
         if out:
@@ -2053,7 +2584,11 @@ Proceed?""",
             win = ttk.Frame(self.parentframe)
             win.grid(row=self.childrow, column=0, columnspan=2, sticky='news')
         self.childframe = win
-        newtable = self.__class__(win, dataframe=df, showtoolbar=0,
+        if view is not None:
+            model = ViewTableModel(**view)
+        else:
+            model = TableModel(dataframe=df)
+        newtable = self.__class__(win, model=model, showtoolbar=0,
                                   showstatusbar=1)
         newtable.parenttable = self
         newtable.show()
@@ -2070,7 +2605,10 @@ Proceed?""",
         """Close the child table"""
 
         if self.child is not None:
+            if isinstance(self.child.model, ViewTableModel):
+                self.child.model.detach()
             self.child.destroy()
+            self.child = None
         if hasattr(self, 'childframe'):
             self.childframe.destroy()
         return
@@ -2078,10 +2616,18 @@ Proceed?""",
     def tableFromSelection(self):
         """Create a new table from the selected cells"""
 
-        df = self.getSelectedDataFrame()
-        if len(df) <= 1:
+        rows = self.multiplerowlist
+        if len(rows) < 1 or self.allrows:
+            rows = slice(None)
+        cols = self.model.getColumnLabels()[self.multiplecollist]
+        if isinstance(rows, slice):
+            n = self.model.getRowCount()
+        else:
+            n = len(rows)
+        if n <= 1:
             return
-        self.createChildTable(df, 'selection')
+        view = {'parent': self.model, 'rows': rows, 'columns': list(cols)}
+        self.createChildTable(title='selection', view=view)
         return
 
     '''def pasteChildTable(self):
@@ -2105,6 +2651,10 @@ Proceed?""",
         import io
         buf = io.StringIO()
         df.info(verbose=True, buf=buf, memory_usage=True)
+        usage = self.model.memoryUsage()
+        shared = usage.bytes[usage.shared].sum()
+        buf.write('shared with copies: %s, owned: %s\n'
+                  %(util.formatBytes(shared), util.formatBytes(usage.bytes.sum()-shared)))
         from .dialogs import SimpleEditor
         w = tk.Toplevel(self.parentframe)
         w.grab_set()
@@ -2166,6 +2716,7 @@ Proceed?""",
                         "Delete Column(s)": lambda: self.deleteColumn(),
                         "Clear Data": lambda: self.deleteCells(rows, cols),
                         "Select All": self.selectAll,
+                        "Go to Row": self.gotoRow,
                         # "Auto Fit Columns": self.autoResizeColumns,
                         "Table Info": self.showInfo,
                         "Show as Text": self.showasText,
@@ -2175,6 +2726,8 @@ Proceed?""",
                         "Save": self.save,
                         "Save as": self.saveAs,
                         "Import csv": lambda: self.importCSV(dialog=True),
+                        "Import large csv": self.importLargeCSV,
+                        "Open SQLite": self.openSQLite,
                         "Export": self.doExport,
                         "Plot Selected": self.plotSelected,
                         "Hide plot": self.hidePlot,
@@ -2183,11 +2736,11 @@ Proceed?""",
 
         main = ["Copy",  # "Fill Down", "Fill Right",
                 "Clear Data"]  # , "Delete Column(s)"]
-        general = ["Select All", "Filter Rows",
+        general = ["Select All", "Go to Row", "Filter Rows",
                    "Show as Text", "Table Info", "Preferences"]
 
-        filecommands = ['New', 'Load', 'Import csv',
-                        'Save', 'Save as', 'Export']
+        filecommands = ['New', 'Load', 'Import csv', 'Import large csv',
+                        'Open SQLite', 'Save', 'Save as', 'Export']
         plotcommands = ['Plot Selected', 'Hide plot', 'Show plot']
 
         def createSubMenu(parent, label, commands):
@@ -2277,20 +2830,71 @@ Proceed?""",
             return None
 #        if only one row selected we plot whole col
         if len(rows) == 1:
-            rows = self.rowrange
+            rows = slice(None)
         lists = []
-
-        for c in cols:
-            x = []
-            for r in rows:
-                # absr = self.get_AbsoluteRow(r)
-                val = model.getValueAt(r, c)
-                if val is None or val == '':
-                    continue
-                x.append(val)
-            lists.append(x)
+        for a in model.getColumnArrays(rows, cols):
+            mask = pd.notnull(a)
+            if a.dtype.kind == 'O':
+                mask &= (a != '')
+            lists.append(list(a[mask]))
         return lists
 
+    def getSelectedArrays(self):
+        """Values of the selected cells as one numpy array per column"""
+
+        rows = self.multiplerowlist
+        cols = self.multiplecollist
+        if self.allrows:
+            rows = slice(None)
+        if len(cols) == 0:
+            return []
+        return self.model.getColumnArrays(rows, cols)
+
+    def updateSelectionSummary(self):
+        """Show count, sum, mean, min and max of the selected numbers in
+           the status bar. Large selections are summed on a worker thread.
+           The result is kept until the selection or its data changes"""
+
+        if not hasattr(self, 'statusbar'):
+            return
+        model = self.model
+        rows = self.multiplerowlist
+        cols = self.multiplecollist
+        if len(cols) == 0 or (len(rows) == 0 and not self.allrows):
+            self.statusbar.showSummary(None)
+            return
+        labels = model.getColumnLabels()[cols]
+        key = (id(model), self._selectionversion, self.allrows,
+               model.getIndexVersion(), model.getColumnSetVersion(),
+               tuple(model.getColumnVersion(c) for c in labels))
+        if key == self._summarykey:
+            if self.summary is not None:
+                self.statusbar.showSummary(self.summary)
+            return
+        self._summarykey = key
+        self.summary = None
+        arrays = self.getSelectedArrays()
+        if sum(len(a) for a in arrays) < self.summarythreshold:
+            self.summary = util.summarizeArrays(arrays)
+            self.statusbar.showSummary(self.summary)
+            return
+
+        result = {}
+        def work():
+            result.update(util.summarizeArrays(arrays))
+        t = threading.Thread(target=work)
+        t.daemon = True
+        t.start()
+        self.statusbar.showSummary('calculating..')
+        def poll():
+            if t.is_alive():
+                self.after(100, poll)
+            elif self._summarykey == key:
+                self.summary = result
+                self.statusbar.showSummary(result)
+        self.after(100, poll)
+        return
+
     def showPlotViewer(self, parent=None, layout='horizontal'):
         """Create plot frame"""
 
@@ -2316,12 +2920,11 @@ Proceed?""",
     def getSelectedDataFrame(self):
         """Return a sub-dataframe of the selected cells"""
 
-        df = self.model.df
         rows = self.multiplerowlist
         if len(rows) < 1 or self.allrows:
-            rows = list(range(self.rows))
+            rows = slice(None)
         cols = self.multiplecollist
-        data = df.iloc[rows, cols]
+        data = self.model.getDataBlock(rows, cols)
         return data
 
     def getPlotData(self):
@@ -2457,6 +3060,11 @@ Proceed?""",
         self.model.setValueAt(value, row, col)
         self.drawText(row, col, value, align=self.align)
         self.delete('entry')
+        if getattr(self, 'recalculatevar', None) is not None and \
+                self.recalculatevar.get() == 1:
+            #update the formulae that use the edited column
+            colname = self.model.getColumnLabels()[col]
+            self.recalculateFunctions(changed=[colname])
         self.gotonextCell()
         return
 
@@ -2512,7 +3120,7 @@ Proceed?""",
         w = x2-x1
 #        wrap = False
         pad = 5
-        if type(celltxt) is np.float64:
+        if isinstance(celltxt, (float, np.floating)):
             celltxt = np.round(celltxt, 3)
         celltxt = str(celltxt)
         length = len(celltxt)
@@ -2565,9 +3173,11 @@ Proceed?""",
     def drawSelectedCol(self, col=None, delete=1):
         """Draw a highlight rect for the current column selection"""
 
+        if self.deferCall('drawSelectedCol'):
+            return
         if delete == 1:
             self.delete('colrect')
-        if len(self.model.df.columns) == 0:
+        if self.model.getColumnCount() == 0:
             return
         if col is None:
             col = self.currentcol
@@ -2721,6 +3331,13 @@ Proceed?""",
         rowhdrentry.grid(row=row, column=1)
         row += 1
 
+        lbl = ttk.Label(frame1, text='Formula threads (0=auto):')
+        lbl.grid(row=row, column=0, padx=3, pady=2)
+        threadsentry = tk.Spinbox(frame1, from_=0, to=64, width=4,
+                                  textvariable=self.evalthreadsvar)
+        threadsentry.grid(row=row, column=1)
+        row += 1
+
         # fonts
         fts = self.getFonts()
         ttk.Label(frame2, text='font').grid(row=row, column=0)
@@ -2812,7 +3429,8 @@ Proceed?""",
                         'grid_color': self.grid_color,
                         'linewidth': self.linewidth,
                         'rowselectedcolor': self.rowselectedcolor,
-                        'rowheaderwidth': self.rowheaderwidth}
+                        'rowheaderwidth': self.rowheaderwidth,
+                        'evalthreads': 0}
 
         for prop in list(defaultprefs.keys()):
             try:
@@ -2852,6 +3470,8 @@ Proceed?""",
         self.rowheaderwidthvar = tk.IntVar()
         self.rowheaderwidthvar.set(self.prefs.get('rowheaderwidth'))
         self.rowheaderwidth = self.rowheaderwidthvar.get()
+        self.evalthreadsvar = tk.IntVar()
+        self.evalthreadsvar.set(self.prefs.get('evalthreads'))
         return
 
     def savePrefs(self):
@@ -2878,6 +3498,7 @@ Proceed?""",
             self.prefs.set('rowselectedcolor', self.rowselectedcolor)
             self.prefs.set('rowheaderwidth', self.rowheaderwidth)
             self.rowheaderwidth = self.rowheaderwidthvar.get()
+            self.prefs.set('evalthreads', self.evalthreadsvar.get())
             self.thefont = (self.prefs.get('celltextfont'),
                             self.prefs.get('celltextsize'))
             self.fontsize = self.prefs.get('celltextsize')
@@ -2895,12 +3516,11 @@ Proceed?""",
         self.redraw()
         return
 
-    def show_progressbar(self, message=None):
-        """Show progress bar window for loading of data"""
+    def show_progressbar(self, message=None, task=None):
+        """Show progress bar window, with a cancel button for a task"""
 
         progress_win = tk.Toplevel()  # Open a new window
         progress_win.title("Please Wait")
-#        progress_win.geometry('+%d+%d' %(self.parentframe.rootx+200, self.parentframe.rooty+200))
         # force on top
         progress_win.grab_set()
         progress_win.transient(self.parentframe)
@@ -2911,17 +3531,120 @@ Proceed?""",
         lbl.grid(row=0, column=0, columnspan=2, sticky='news', padx=6, pady=4)
         progrlbl = ttk.Label(progress_win, text='Progress:')
         progrlbl.grid(row=1, column=0, sticky='news', padx=2, pady=4)
-        import ProgressBar
-        self.bar = ProgressBar.ProgressBar(progress_win)
-        self.bar.frame.grid(row=1, column=1, columnspan=2, padx=2, pady=4)
-
+        self.bar = ttk.Progressbar(progress_win, mode='indeterminate',
+                                   length=200, maximum=100)
+        self.bar.grid(row=1, column=1, columnspan=2, padx=2, pady=4)
+        self.bar.start(20)
+        progress_win.bar = self.bar
+        progress_win.msgvar = tk.StringVar()
+        ttk.Label(progress_win, textvariable=progress_win.msgvar).grid(row=2,
+                  column=0, columnspan=3, sticky='w', padx=2)
+        if task is not None:
+            def cancel():
+                task.cancel()
+                progress_win.destroy()
+            b = ttk.Button(progress_win, text='Cancel', command=cancel)
+            b.grid(row=3, column=0, columnspan=3, pady=4)
+            progress_win.protocol("WM_DELETE_WINDOW", cancel)
         return progress_win
 
+    def canRunTask(self):
+        """Whether operations can run as tasks on a copy of the data, the
+           model must be in memory and not transposed"""
+
+        model = self.model
+        if hasattr(model, 'inMemory') and not model.inMemory():
+            return False
+        return getattr(model, 'transposed', False) == False
+
+    def getDataStamp(self):
+        """Changes whenever the data of the model changes"""
+
+        m = self.model
+        return (m, m.getIndexVersion(), m.getColumnSetVersion(), m.lastversion)
+
+    def runTask(self, func, args=(), callback=None, message=None, size=None,
+                check=False, process=False):
+        """Run a function from the tasks module with the table data and
+           give its result to callback. Table models in args are passed
+           to it as their dataframe. Small data is done straight away.
+           Otherwise it runs on a thread while a progress window with a
+           cancel button is shown, and the thread is given a copy on
+           write snapshot of each model so edits made meanwhile don't
+           reach it. With process it runs in a process instead, which
+           has its own copy, and cancel ends it straight away. Functions
+           that never check for cancelling should use a process. The
+           result is passed back in the Tk loop. With check the result
+           is dropped if the table was changed while the task ran."""
+
+        def frame(a):
+            return a.df if isinstance(a, TableModel) else a
+        if size is None:
+            size = max([len(frame(a)) for a in args
+                        if isinstance(a, (pd.DataFrame, TableModel))] or [0])
+        if size < self.taskthreshold:
+            task = tasks.Task(func, [frame(a) for a in args])
+            try:
+                result = task.run()
+            except Exception as e:
+                self.taskError(e)
+                return task
+            if callback is not None:
+                callback(result)
+            return task
+
+        if process == False:
+            args = [a.copy() if isinstance(a, TableModel) else a for a in args]
+        snapshots = [a for a in args if isinstance(a, TableModel)]
+        task = tasks.Task(func, [frame(a) for a in args], process=process)
+        stamp = self.getDataStamp()
+        task.start()
+        win = self.show_progressbar(message, task)
+
+        def poll():
+            done = task.poll()
+            if task.status == 'cancelled':
+                return
+            if task.progress is not None and win.winfo_exists():
+                if str(win.bar.cget('mode')) == 'indeterminate':
+                    win.bar.stop()
+                    win.bar.configure(mode='determinate')
+                win.bar['value'] = task.progress*100
+                if task.message is not None:
+                    win.msgvar.set(str(task.message))
+            if not done:
+                self.after(100, poll)
+                return
+            #edits no longer need to copy the columns shared with these
+            del snapshots[:]
+            win.destroy()
+            if task.status == 'error':
+                self.taskError(task.error)
+            elif check == True and self.getDataStamp() != stamp:
+                messagebox.showwarning("Task", "The table changed while %s, "
+                                       "the result was not applied." %str(message).lower(),
+                                       parent=self.parentframe)
+            elif callback is not None:
+                callback(task.result)
+            return
+        self.after(100, poll)
+        return task
+
+    def taskError(self, e):
+        messagebox.showwarning("Error", str(e), parent=self.parentframe)
+        return
+
     def updateModel(self, model):
         """Should call this method when a new table model is loaded.
            Recreates widghets and redraws the table."""
 
+        if hasattr(self, 'model') and self.model is not model:
+            self.model.removeListener(self.modelChanged)
+            self.model.close()
+            self.querycache = filtering.QueryCache()
+            self.stringcache = strings.StringCache()
         self.model = model
+        model.addListener(self.modelChanged)
         self.rows = self.model.getRowCount()
         self.cols = self.model.getColumnCount()
         self.tablewidth = (self.cellwidth)*self.cols
@@ -2992,7 +3715,7 @@ Proceed?""",
         self.saveAs(self.filename)
         return
 
-    def importCSV(self, filename=None, dialog=False):
+    def importCSV(self, filename=None, dialog=False, progressive=False):
         """Import from csv file"""
 
         if self.importpath is None:
@@ -3009,9 +3732,15 @@ Proceed?""",
             return
         if dialog:
             impdialog = ImportDialog(self, filename=filename)
+            if impdialog.progressive == True:
+                self.importCSVProgressive(filename, **impdialog.kwds)
+                return
             df = impdialog.df
             if df is None:
                 return
+        elif progressive == True:
+            self.importCSVProgressive(filename)
+            return
         else:
             df = pd.read_csv(filename)
         model = TableModel(dataframe=df)
@@ -3020,6 +3749,148 @@ Proceed?""",
         self.importpath = os.path.dirname(filename)
         return
 
+    def importCSVProgressive(self, filename, chunksize=20000, **kwargs):
+        """Load a csv file in chunks on a worker thread. The first chunk
+           is shown straight away and later ones are appended as they
+           arrive, so the table stays usable while loading"""
+
+        self.stopLoading()
+        q = queue.Queue()
+        stop = self.loading = threading.Event()
+        total = os.path.getsize(filename)
+        start = time.time()
+
+        def read():
+            try:
+                with open(filename, 'rb') as f:
+                    reader = pd.read_csv(f, chunksize=chunksize, **kwargs)
+                    for chunk in reader:
+                        if stop.is_set():
+                            break
+                        q.put((chunk, f.tell()))
+            except Exception as e:
+                q.put((e, None))
+            q.put((None, total))
+            return
+
+        def poll():
+            model = loaded['model']
+            if stop.is_set():
+                #rows read so far are already shown
+                return
+            chunks = []
+            done = False
+            error = None
+            nbytes = None
+            while not q.empty():
+                chunk, pos = q.get()
+                if chunk is None or isinstance(chunk, Exception):
+                    error = chunk
+                    done = True
+                    break
+                chunks.append(chunk)
+                nbytes = pos
+            if len(chunks) > 0:
+                loaded['rows'] += sum(len(c) for c in chunks)
+                if model is None:
+                    model = loaded['model'] = TableModel(dataframe=pd.concat(chunks))
+                    self.updateModel(model)
+                elif self.model is not model:
+                    #table was replaced while loading
+                    stop.set()
+                    return
+                else:
+                    #joined once per poll so the table and status agree
+                    for c in chunks:
+                        model.appendData(c, flush=False)
+                    model.flushAppended()
+                self.redraw()
+            if nbytes is not None and hasattr(self, 'statusbar'):
+                rate = nbytes/max(time.time()-start, 1e-6)
+                self.statusbar.showProgress(loaded['rows'], rate, done)
+            if done:
+                self.loading = None
+                if model is not None and self.model is model:
+                    self.tableChanged()
+                if error is not None:
+                    messagebox.showwarning("Import error", error,
+                                           parent=self.parentframe)
+            else:
+                self.after(100, poll)
+            return
+
+        loaded = {'model': None, 'rows': 0}
+        t = threading.Thread(target=read)
+        t.daemon = True
+        t.start()
+        self.after(50, poll)
+        self.importpath = os.path.dirname(filename)
+        return
+
+    def stopLoading(self):
+        """Stop any background csv load"""
+
+        if getattr(self, 'loading', None) is not None:
+            self.loading.set()
+        self.loading = None
+        return
+
+    def importLargeCSV(self, filename=None, path=None, chunksize=100000):
+        """Import a large csv file into an on disk store so that only
+           the visible rows are held in memory"""
+
+        from .storage import MemMapTableModel
+        if self.importpath is None:
+            self.importpath = os.getcwd()
+        if filename is None:
+            filename = askopenfilename(parent=self.master,
+                                       defaultextension='.csv',
+                                       initialdir=self.importpath,
+                                       filetypes=[("csv", "*.csv"),
+                                                  ("tsv", "*.tsv"),
+                                                  ("txt", "*.txt"),
+                                                  ("All files", "*.*")])
+        if not filename:
+            return
+        model = MemMapTableModel.fromCSV(filename, path=path, chunksize=chunksize)
+        self.updateModel(model)
+        self.redraw()
+        self.importpath = os.path.dirname(filename)
+        return
+
+    def openSQLite(self, filename=None, table=None, query=None):
+        """Show a table or query from a SQLite file. Rows are fetched from
+           the database as they are shown rather than loaded"""
+
+        from .storage import SQLiteTableModel
+        if self.importpath is None:
+            self.importpath = os.getcwd()
+        if filename is None:
+            filename = askopenfilename(parent=self.master,
+                                       defaultextension='.db',
+                                       initialdir=self.importpath,
+                                       filetypes=[("sqlite", "*.db *.sqlite *.sqlite3"),
+                                                  ("All files", "*.*")])
+        if not filename:
+            return
+        if table is None and query is None:
+            tables = SQLiteTableModel.getTables(filename)
+            d = MultipleValDialog(title='Open SQLite',
+                                  initialvalues=(tables, ''),
+                                  labels=('table:', 'or query:'),
+                                  types=('combobox', 'entry'),
+                                  parent=self.parentframe)
+            if d.result == None:
+                return
+            table, query = d.results
+            if query != '':
+                table = None
+        model = SQLiteTableModel(filename, table=table, query=query)
+        self.updateModel(model)
+        self.redraw()
+        self.importpath = os.path.dirname(filename)
+        return
+
     def loadExcel(self, filename=None):
         """Load excel file"""
 
@@ -3174,7 +4045,7 @@ class statusBar(tk.Frame):
         tk.Label(self, text='rows x', font=sfont,
                  foreground=clr).pack(side=tk.LEFT)
         self.colsvar = tk.StringVar()
-        self.colsvar.set(len(self.parentapp.model.df))
+        self.colsvar.set(self.parentapp.model.getColumnCount())
         l = tk.Label(self, textvariable=self.colsvar, font=sfont,
                      foreground=clr)
         l.pack(fill=tk.X, side=tk.LEFT)
@@ -3183,14 +4054,42 @@ class statusBar(tk.Frame):
         self.filenamevar = tk.StringVar()
         l = tk.Label(self, textvariable=self.filenamevar, font=sfont)
         l.pack(fill=tk.X, side=tk.RIGHT)
+        self.progressvar = tk.StringVar()
+        l = tk.Label(self, textvariable=self.progressvar, font=sfont)
+        l.pack(fill=tk.X, side=tk.RIGHT)
+        self.summaryvar = tk.StringVar()
+        l = tk.Label(self, textvariable=self.summaryvar, font=sfont)
+        l.pack(fill=tk.X, side=tk.RIGHT)
         return
 
     def update(self):
         """Update status bar"""
 
         model = self.parentapp.model
-        self.rowsvar.set(len(model.df))
-        self.colsvar.set(len(model.df.columns))
+        self.rowsvar.set(model.getRowCount())
+        self.colsvar.set(model.getColumnCount())
         if self.parentapp.filename is not None:
             self.filenamevar.set(self.parentapp.filename)
+        self.parentapp.updateSelectionSummary()
+        return
+
+    def showSummary(self, st):
+        """Show the selection summary, st is a dict or a message"""
+
+        if st is None or (isinstance(st, dict) and st['count'] == 0):
+            self.summaryvar.set('')
+        elif isinstance(st, dict):
+            self.summaryvar.set('count: %s sum: %g mean: %g min: %g max: %g'
+                    %(st['count'], st['sum'], st['mean'], st['min'], st['max']))
+        else:
+            self.summaryvar.set(st)
+        return
+
+    def showProgress(self, rows, rate, done=False):
+        """Show rows loaded and read rate in bytes per second"""
+
+        if done:
+            self.progressvar.set('')
+            return
+        self.progressvar.set('loading: %s rows, %s/s' %(rows, util.formatBytes(rate)))
         return
@@ -24,10 +24,25 @@
 from types import *
 import operator
 import os, string, types, copy
+import itertools, weakref
+from contextlib import contextmanager
 import pickle
+from collections import OrderedDict
+import warnings
 import numpy as np
 import pandas as pd
-from . import util
+from . import util, filtering
+
+#row reductions done with the axis argument, missing values are skipped
+reductions = {'mean': np.nanmean, 'std': np.nanstd, 'max': np.nanmax,
+              'min': np.nanmin, 'sum': np.nansum, 'var': np.nanvar,
+              'median': np.nanmedian, 'prod': np.nanprod}
+#numpy functions that are not ufuncs but take whole arrays
+vectorfuncs = ['round', 'around']
+binaryfuncs = ['convolve']
+
+#unique numbers for models, unlike id() they are never reused
+modelids = itertools.count(1)
 
 class TableModel(object):
     """A data model for the Table class that uses pandas"""
@@ -46,7 +61,7 @@ class TableModel(object):
             self.df = dataframe
         else:
             colnames = list(string.ascii_lowercase[:columns])
-            self.df = pd.DataFrame(index=range(rows),columns=colnames)
+            self.df = self.getBlankData(rows, colnames)
             #self.df = self.getSampleData()
         self.reclist = self.df.index # not needed now?
         return
@@ -67,6 +82,15 @@ class TableModel(object):
         df['date'] = pd.date_range('1/1/2014', periods=rows, freq='H')
         return df
 
+    @classmethod
+    def getBlankData(self, rows, columns):
+        """Empty dataframe with sparse columns so that unset cells take
+           no memory. Column types follow the first values entered and
+           columns become dense once they are mostly filled"""
+
+        data = dict((c, util.blankColumn(rows)) for c in columns)
+        return pd.DataFrame(data, index=range(rows), columns=columns)
+
     @classmethod
     def getIrisData(self):
         """Get iris dataset"""
@@ -90,8 +114,266 @@ class TableModel(object):
 
     def initialiseFields(self):
         """Create meta data fields"""
+        self.uid = next(modelids)
         self.meta = {}
         self.columnwidths = {} #used to store col widths
+        self.colorder = None
+        self.transposed = False
+        self.cowgroup = None
+        #versions all come from one counter so they only increase
+        self.lastversion = 0
+        self.version = 0
+        #version of changes to all columns of the current frame in place
+        self.dataversion = 0
+        self.colversions = {}
+        self.versions = {}
+        self.versionkeys = {}
+        self.stats = {}
+        self.indexes = {}
+        self.groupings = OrderedDict()
+        self.maxgroupings = 10
+        #fill above which sparse columns are made dense
+        self.sparsedensity = 0.5
+        self.listeners = []
+        self.batchlevel = 0
+        self.pending = False
+        #chunks waiting to be joined to the data, see appendData
+        self.appended = []
+        return
+
+    def _getdf(self):
+        #code using the frame directly expects it as displayed
+        self.applyColumnOrder()
+        self.applyTranspose()
+        return self._df
+
+    def _setdf(self, df):
+        """Replacing the dataframe invalidates all column caches"""
+
+        dataversion = self.dataversion
+        self._df = df
+        self.colorder = None
+        self.transposed = False
+        self.columnChanged()
+        #column indexes check the frame itself, see getIndexKey
+        self.dataversion = dataversion
+        return
+
+    df = property(lambda self: self._getdf(), lambda self, df: self._setdf(df))
+
+    def columnChanged(self, cols=None):
+        """Mark columns as changed so cached values for them are
+           recomputed, all columns if cols is None"""
+
+        v = self.newVersion()
+        if cols is None:
+            self.version = v
+            self.dataversion = v
+            self.stats = {}
+        else:
+            for c in cols:
+                self.colversions[c] = v
+                self.stats.pop(c, None)
+        self.notify(cols)
+        return
+
+    def addListener(self, func):
+        """Register a function called with the changed columns, or None
+           when the whole table changed, after each change or batch"""
+
+        if func not in self.listeners:
+            self.listeners.append(func)
+        return
+
+    def removeListener(self, func):
+        if func in self.listeners:
+            self.listeners.remove(func)
+        return
+
+    def notify(self, cols=None):
+        """Send a change to the listeners, or merge it with the pending
+           changes when inside a batch"""
+
+        if self.batchlevel > 0:
+            if cols is None or self.pending is None:
+                self.pending = None
+            elif self.pending is False:
+                self.pending = set(cols)
+            else:
+                self.pending.update(cols)
+            return
+        changes = None if cols is None else set(cols)
+        for func in list(self.listeners):
+            func(changes)
+        return
+
+    @contextmanager
+    def batch(self):
+        """Group changes so listeners are notified once, with all the
+           changed columns, when the outermost batch ends"""
+
+        self.batchlevel += 1
+        try:
+            yield self
+        finally:
+            self.batchlevel -= 1
+            if self.batchlevel == 0 and self.pending is not False:
+                changes = self.pending
+                self.pending = False
+                self.notify(changes)
+        return
+
+    def newVersion(self):
+        """Next value of the version counter"""
+
+        self.lastversion += 1
+        return self.lastversion
+
+    def getColumnVersion(self, colname):
+        """Version of a column, increases whenever the column changes"""
+
+        return max(self.version, self.colversions.get(colname, 0))
+
+    def checkVersion(self, name, keys):
+        """Get the named version, increased if any of the key objects
+           have been replaced since it was last asked for"""
+
+        last = self.versionkeys.get(name)
+        if last is None or len(last) != len(keys) or \
+            any(a is not b for a,b in zip(last, keys)):
+            self.versionkeys[name] = keys
+            self.versions[name] = self.newVersion()
+        return self.versions[name]
+
+    def getIndexVersion(self):
+        """Version of the rows. pandas replaces the index object on any
+           sort, filter, row insert or delete, so only identities are
+           compared"""
+
+        df = self._df
+        keys = [df.index, self.transposed]
+        if self.transposed == True:
+            keys += [df.columns, self.colorder]
+        return self.checkVersion('index', keys)
+
+    def getColumnSetVersion(self):
+        """Version of the column labels and their order"""
+
+        df = self._df
+        keys = [df.columns, self.colorder, self.transposed]
+        if self.transposed == True:
+            keys.append(df.index)
+        return self.checkVersion('columns', keys)
+
+    def getColumn(self, colname):
+        """Get the data for a column"""
+
+        if self.transposed == True:
+            s = self._df.loc[colname]
+            if isinstance(s, pd.DataFrame):
+                s = s.iloc[0]
+            return s.infer_objects()
+        return self._df[colname]
+
+    def getColumnStats(self, colname):
+        """Cached summary values for a column, see util.columnStats"""
+
+        version = self.getColumnVersion(colname)
+        st = self.stats.get(colname)
+        if st is None or st['version'] != version:
+            st = util.columnStats(self.getColumn(colname))
+            st['version'] = version
+            st['quantiles'] = None
+            self.stats[colname] = st
+        elif st['distinct'] is None:
+            st['distinct'] = util.countDistinct(self.getColumn(colname))
+        return st
+
+    def getColumnQuantiles(self, colname):
+        """Quartiles of a numeric column, kept with its stats"""
+
+        st = self.getColumnStats(colname)
+        if st['quantiles'] is None:
+            q = [None]*3
+            if st['numeric'] == True and st['count'] > 0:
+                s = self.getColumn(colname)
+                if util.check_sparse(s):
+                    s = util.to_dense(s)
+                q = list(s.quantile([.25, .5, .75]).values)
+            st['quantiles'] = q
+        return st['quantiles']
+
+    def getColumnMaxLength(self, colname):
+        """Longest formatted entry of a column, kept with its stats"""
+
+        st = self.getColumnStats(colname)
+        if st['maxlen'] is None:
+            st['maxlen'] = util.longestEntry(self.getColumn(colname))
+        return st['maxlen']
+
+    def describe(self):
+        """Summary of all columns from the stats cache, with the same
+           rows as df.describe and a few more"""
+
+        fields = ['count','mean','std','min','25%','50%','75%','max',
+                  'nulls','distinct','maxlen']
+        cols = self.getColumnLabels()
+        data = []
+        for c in cols:
+            self.getColumnMaxLength(c)
+            st = dict(self.getColumnStats(c))
+            st['25%'], st['50%'], st['75%'] = self.getColumnQuantiles(c)
+            data.append([st[f] for f in fields])
+        return pd.DataFrame(data, index=cols, columns=fields).T
+
+    def _updateStats(self, colname, old, new):
+        """Update cached stats for a single cell edit, they are dropped
+           if the change can't be applied incrementally"""
+
+        st = self.stats.get(colname)
+        valid = st is not None and st['version'] == self.getColumnVersion(colname)
+        self.columnChanged([colname])
+        if not valid:
+            return
+        oldnull = pd.isnull(old)
+        newnull = pd.isnull(new)
+        lo, hi = st['min'], st['max']
+        try:
+            if not oldnull and (old == lo or old == hi):
+                #removed a boundary value, only known if new goes further
+                if newnull or not ((old == lo and new <= lo) or (old == hi and new >= hi)):
+                    return
+            if not newnull:
+                if st['count'] - int(not oldnull) == 0:
+                    lo = hi = new
+                elif lo is not None:
+                    lo, hi = min(lo, new), max(hi, new)
+            if st['numeric'] == True:
+                n, mean, m2 = st['count'], st['mean'] or 0.0, st['m2'] or 0.0
+                if not oldnull:
+                    st['sum'] -= old
+                    n, mean, m2 = util.removeMoment(n, mean, m2, old)
+                if not newnull:
+                    st['sum'] += new
+                    n, mean, m2 = util.addMoment(n, mean, m2, new)
+                st['mean'], st['m2'] = (mean, m2) if n > 0 else (None, None)
+        except TypeError:
+            return
+        oldlen = len(str(np.round(old, 3) if isinstance(old, float) else old))
+        newlen = len(str(np.round(new, 3) if isinstance(new, float) else new))
+        if st['maxlen'] is not None:
+            if oldlen == st['maxlen'] and newlen < oldlen:
+                return
+            st['maxlen'] = max(st['maxlen'], newlen)
+        st['count'] += int(oldnull) - int(newnull)
+        st['nulls'] -= int(oldnull) - int(newnull)
+        st['min'], st['max'] = lo, hi
+        #these need the whole column again, found when next asked for
+        st['distinct'] = None
+        st['quantiles'] = None
+        util.updateMoments(st)
+        st['version'] = self.getColumnVersion(colname)
+        self.stats[colname] = st
         return
 
     def save(self, filename):
@@ -123,33 +405,157 @@ class TableModel(object):
     def getlongestEntry(self, colindex):
         """Get the longest string in the column for determining width"""
 
-        df = self.df
-        col = df.columns[colindex]
-        if df.dtypes[col] == 'float64':
-            c = df[col].round(3)
-        else:
-            c = df[col]
-        longest = c.astype('object').astype('str').str.len().max()
-        if np.isnan(longest):
-            return 1
-        return longest
+        col = self._getColumnLabel(colindex)
+        return self.getColumnMaxLength(col)
 
     def getRecordAtRow(self, rowIndex):
         """Get the entire record at the specifed row"""
 
-        name = self.getRecName(rowIndex)
-        record = self.df.ix[name]
+        record = self.df.iloc[rowIndex]
         return record
 
+    def getRecName(self, rowIndex):
+        """Get the index label of the specified row"""
+
+        return self.getIndex()[rowIndex]
+
+    def getRecordIndex(self, recname):
+        """Get the row position of an index label, None if not found"""
+
+        try:
+            pos = self.getLabelIndexer([recname])[0]
+        except (TypeError, ValueError):
+            return
+        if pos < 0:
+            return
+        return int(pos)
+
+    def getLabelIndexer(self, labels):
+        """Row positions of index labels as an array, -1 where missing.
+           Duplicate labels give their first row. Only the labels asked
+           for are looked up, using the hash table pandas keeps on the
+           index"""
+
+        index = self.getIndex()
+        if len(labels) == 0:
+            return np.zeros(0, dtype=int)
+        if index.is_unique:
+            return index.get_indexer(labels)
+        first = ~index.duplicated()
+        pos = index[first].get_indexer(labels)
+        return np.where(pos >= 0, np.flatnonzero(first)[pos], -1)
+
+    def getRowPositions(self, labels):
+        """Row positions for a list of index labels, missing ones are dropped"""
+
+        pos = self.getLabelIndexer(labels)
+        return [int(i) for i in pos if i >= 0]
+
+    def findRecord(self, key):
+        """Row position for a label entered as text. Tries the text and
+           numeric or date forms of it, comma separated for a MultiIndex"""
+
+        def forms(v):
+            v = v.strip()
+            f = [v]
+            for func in (int, float, pd.Timestamp):
+                try:
+                    f.append(func(v))
+                except (ValueError, TypeError):
+                    pass
+            return f
+
+        if util.check_multiindex(self.getIndex()) == 1:
+            candidates = itertools.product(*[forms(v) for v in key.split(',')])
+        else:
+            candidates = forms(key)
+        for c in candidates:
+            pos = self.getRecordIndex(c)
+            if pos is not None:
+                return pos
+        return
+
     def moveColumn(self, oldindex, newindex):
         """Changes the order of columns"""
 
-        df = self.df
-        cols = list(df.columns)
-        name = cols[oldindex]
-        del cols[oldindex]
-        cols.insert(newindex, name)
-        self.df = df[cols]
+        self.applyTranspose()
+        n = self.getColumnCount()
+        if self.colorder is None:
+            order = list(range(n))
+        else:
+            order = list(self.colorder)
+        pos = order[oldindex]
+        del order[oldindex]
+        order.insert(newindex, pos)
+        #only the displayed order changes, the frame is reordered on use
+        if order == list(range(n)):
+            self.colorder = None
+        else:
+            self.colorder = np.array(order)
+        return
+
+    def copy(self):
+        """Copy of the model that shares its column data with this one.
+           A column is only copied when one of the models changes it in
+           place (copy on write)"""
+
+        new = TableModel(self.df.copy(deep=False))
+        new.columnwidths = dict(self.columnwidths)
+        new.meta = copy.deepcopy(self.meta)
+        if self.cowgroup is None:
+            self.cowgroup = weakref.WeakSet([self])
+        new.cowgroup = self.cowgroup
+        self.cowgroup.add(new)
+        return new
+
+    def _getSharedBuffers(self):
+        """Buffers of the columns of models sharing data with this one"""
+
+        if self.cowgroup is None:
+            return []
+        return [util.getBuffer(m._df[c]) for m in list(self.cowgroup)
+                if m is not self and m._df is not None
+                for c in m._df.columns]
+
+    def ownColumns(self, cols):
+        """Copy any of the columns still shared with another model, called
+           before changing them in place"""
+
+        others = self._getSharedBuffers()
+        if len(others) == 0:
+            return
+        df = self._df
+        for c in cols:
+            b = util.getBuffer(df[c])
+            if any(np.may_share_memory(b, o) for o in others):
+                df[c] = df[c].copy()
+        return
+
+    def memoryUsage(self):
+        """Bytes used by each column and whether they are shared with
+           a copy of the model or owned by it"""
+
+        df = self._df
+        others = self._getSharedBuffers()
+        usage = df.memory_usage(deep=True, index=False)
+        shared = [any(np.may_share_memory(util.getBuffer(df[c]), o) for o in others)
+                  for c in df.columns]
+        return pd.DataFrame({'bytes': usage.values, 'shared': shared},
+                            index=df.columns, columns=['bytes','shared'])
+
+    def getPhysicalColumns(self, cols):
+        """Map displayed column positions to positions in the dataframe"""
+
+        if self.colorder is None:
+            return cols
+        return self.colorder[cols]
+
+    def applyColumnOrder(self):
+        """Rebuild the dataframe in the displayed column order"""
+
+        if self.colorder is not None:
+            self._df = self._df.iloc[:, self.colorder]
+            self.colorder = None
         return
 
     def autoAddRows(self, num):
@@ -169,6 +575,27 @@ class TableModel(object):
             self.addRow(i+ind)
         return
 
+    def appendData(self, df, flush=True):
+        """Append rows from another dataframe with the same columns. With
+           flush False the rows are collected and only joined once there
+           are as many waiting as the table holds, so adding many chunks
+           copies the data a few times rather than once per chunk"""
+
+        self.appended.append(df)
+        waiting = sum(len(d) for d in self.appended)
+        if flush == True or waiting >= len(self._df):
+            self.flushAppended()
+        return
+
+    def flushAppended(self):
+        """Join any rows collected by appendData to the data"""
+
+        if len(self.appended) == 0:
+            return
+        self.df = pd.concat([self.df] + self.appended)
+        self.appended = []
+        return
+
     def addRow(self, rowindex):
         """Inserts a row at the required index by append/concat"""
 
@@ -183,6 +610,7 @@ class TableModel(object):
 
         df = self.df
         df.drop(df.index[rowindex],inplace=True)
+        self.columnChanged()
         return
 
     def deleteRows(self, rowlist=None):
@@ -190,6 +618,7 @@ class TableModel(object):
 
         df = self.df
         df.drop(df.index[rowlist],inplace=True)
+        self.columnChanged()
         return
 
     def addColumn(self, colname=None, dtype=None, data=None):
@@ -198,6 +627,7 @@ class TableModel(object):
         if data is None:
             data = pd.Series(dtype=dtype)
         self.df[colname] = data
+        self.columnChanged([colname])
         return
 
     def deleteColumn(self, colindex):
@@ -206,6 +636,7 @@ class TableModel(object):
         df = self.df
         colname = df.columns[colindex]
         df.drop([colname], axis=1, inplace=True)
+        self.columnChanged([colname])
         return
 
     def deleteColumns(self, cols=None):
@@ -214,10 +645,13 @@ class TableModel(object):
         df = self.df
         colnames = df.columns[cols]
         df.drop(colnames, axis=1, inplace=True)
+        self.columnChanged(colnames)
         return
 
     def deleteCells(self, rows, cols):
+        self.ownColumns(self.df.columns[cols])
         self.df.iloc[rows,cols] = np.nan
+        self.columnChanged(self.df.columns[cols])
         return
 
     def resetIndex(self):
@@ -229,6 +663,7 @@ class TableModel(object):
         else:
             drop = True
         df.reset_index(drop=drop,inplace=True)
+        self.columnChanged()
         return
 
     def setindex(self, colindex):
@@ -240,6 +675,7 @@ class TableModel(object):
         if indnames[0] != None:
             df.reset_index(inplace=True)
         df.set_index(colnames, inplace=True)
+        self.columnChanged()
         return
 
     def copyIndex(self):
@@ -249,38 +685,81 @@ class TableModel(object):
         name = df.index.name
         if name == None: name='index'
         df[name] = df.index#.astype('object')
+        self.columnChanged([name])
         return
 
     def groupby(self, cols):
         """Group by cols"""
 
         df = self.df
-        colnames = df.columns[cols]
-        grps = df.groupby(colnames)
-        return grps
+        colnames = list(df.columns[cols])
+        return self.getGrouping(colnames).groupby(df)
+
+    def getGroupingVersion(self, cols):
+        return (self.getIndexVersion(),
+                tuple(self.getColumnVersion(c) for c in cols))
+
+    def getGrouping(self, cols, build=True):
+        """Group codes for key columns, kept until the keys or the row
+           order change. Returns None if not made yet and build is False"""
+
+        key = tuple(cols)
+        version = self.getGroupingVersion(cols)
+        g = self.groupings.get(key)
+        if g is not None and g[0] == version:
+            self.groupings.move_to_end(key)
+            return g[1]
+        if build == False:
+            return None
+        grouping = filtering.Grouping(self.df, cols)
+        self.addGrouping(cols, version, grouping)
+        return grouping
+
+    def addGrouping(self, cols, version, grouping):
+        """Keep a grouping made elsewhere, such as on a worker"""
+
+        self.groupings[tuple(cols)] = (version, grouping)
+        self.groupings.move_to_end(tuple(cols))
+        if len(self.groupings) > self.maxgroupings:
+            self.groupings.popitem(last=False)
+        return
 
     def getColumnType(self, columnIndex):
         """Get the column type"""
-        coltype = self.df.dtypes[columnIndex]
+        if self.transposed == True:
+            #a row of the frame, only typed if all columns share a type
+            dtypes = self._df.dtypes.unique()
+            if len(dtypes) == 1:
+                return dtypes[0]
+            return np.dtype('O')
+        coltype = self._df.dtypes.iloc[self.getPhysicalColumns(columnIndex)]
         return coltype
 
     def getColumnCount(self):
          """Returns the number of columns in the data model"""
-         return len(self.df.columns)
+         if self.transposed == True:
+             return len(self._df)
+         return len(self._df.columns)
 
     def getColumnName(self, columnIndex):
          """Returns the name of the given column by columnIndex"""
-         return str(self.df.columns[columnIndex])
+         return str(self._getColumnLabel(columnIndex))
+
+    def _getColumnLabel(self, columnIndex):
+        if self.transposed == True:
+            return self._df.index[columnIndex]
+        return self._df.columns[self.getPhysicalColumns(columnIndex)]
 
     def getColumnData(self, columnIndex=None, columnName=None,
                         filters=None):
         """Return the data in a list for this col,
             filters is a tuple of the form (key,value,operator,bool)"""
-        if columnIndex != None and columnIndex < len(self.columnNames):
-            columnName = self.getColumnName(columnIndex)
-        names = Filtering.doFiltering(searchfunc=self.filterBy,
-                                         filters=filters)
-        coldata = [self.data[n][columnName] for n in names]
+        if columnIndex != None and columnIndex < self.getColumnCount():
+            columnName = self._getColumnLabel(columnIndex)
+        s = self.getColumn(columnName)
+        if filters:
+            s = s.iloc[self.filterby(filters)]
+        coldata = list(s)
         return coldata
 
     def getColumns(self, colnames, filters=None, allowempty=True):
@@ -306,15 +785,67 @@ class TableModel(object):
 
     def getRowCount(self):
          """Returns the number of rows in the table model."""
-         return len(self.reclist)
+         if self.transposed == True:
+             return len(self._df.columns)
+         return len(self._df)
+
+    def getColumnLabels(self):
+        """Returns the column labels in display order"""
+        if self.transposed == True:
+            return self._df.index
+        return self._getColumnLabels()
+
+    def _getColumnLabels(self):
+        if self.colorder is None:
+            return self._df.columns
+        return self._df.columns[self.colorder]
+
+    def getIndex(self):
+        """Returns the row index"""
+        if self.transposed == True:
+            return self._getColumnLabels()
+        return self._df.index
+
+    def getDataBlock(self, rows, cols):
+        """Get a block of data for the given row and column positions.
+           rows and cols may be lists or slices. The table uses this for
+           drawing and selections so other models only need to provide
+           the rows asked for."""
+
+        if self.transposed == True:
+            block = self._df.iloc[cols, self.getPhysicalColumns(rows)].T
+        else:
+            block = self._df.iloc[rows, self.getPhysicalColumns(cols)]
+        return util.denseBlock(block)
+
+    def getColumnArrays(self, rows, cols):
+        """Values for the given row and column positions as one numpy
+           array per column, read as a single block"""
+
+        block = self.getDataBlock(util.positionsToSlice(rows), cols)
+        return [block.iloc[:,i].values for i in range(len(block.columns))]
+
+    def sort(self, colindex=None, ascending=True, index=False):
+        """Sort rows by the given column positions or by the index"""
+
+        self.applyTranspose()
+        df = self._df
+        if index == True:
+            df.sort_index(inplace=True)
+        else:
+            colnames = list(df.columns[self.getPhysicalColumns(colindex)])
+            df.sort_values(by=colnames, inplace=True, ascending=ascending)
+        return
 
     def getValueAt(self, rowindex, colindex):
          """Returns the cell value at location specified
              by columnIndex and rowIndex."""
 
-         df = self.df
-         value = self.df.iloc[rowindex,colindex]
-         if type(value) is float and np.isnan(value):
+         if self.transposed == True:
+             rowindex, colindex = colindex, rowindex
+         colindex = self.getPhysicalColumns(colindex)
+         value = self._df.iloc[rowindex,colindex]
+         if isinstance(value, (float, np.floating)) and np.isnan(value):
              return ''
          return value
 
@@ -322,47 +853,487 @@ class TableModel(object):
         """Changed the dictionary when cell is updated by user"""
         if value == '':
             value = np.nan
-        dtype = self.df.dtypes[colindex]
+        df = self._df
+        if self.transposed == True:
+            rowindex, colindex = colindex, rowindex
+        colindex = self.getPhysicalColumns(colindex)
+        colname = df.columns[colindex]
+        if util.check_sparse(df[colname]) and pd.isnull(df[colname].sparse.fill_value):
+            self._setSparseValue(colname, rowindex, value)
+            if self.transposed == True:
+                self.columnChanged()
+            return
+        dtype = df.dtypes.iloc[colindex]
         #try to cast to column type
         try:
-            if dtype == 'float64':
+            if dtype.kind == 'f':
                 value = float(value)
-            elif dtype == 'int':
+            elif dtype.kind in 'iu':
                 value = int(value)
             elif dtype == 'datetime64[ns]':
                 value = pd.to_datetime(value)
         except Exception as e:
             print (e)
-        self.df.iloc[rowindex,colindex] = value
+        colname = df.columns[colindex]
+        self.ownColumns([colname])
+        old = df.iloc[rowindex,colindex]
+        try:
+            df.iloc[rowindex,colindex] = value
+        except (TypeError, ValueError):
+            #column type can't hold the value, e.g. after optimizeMemory
+            self._upcastColumn(colname, value)
+            df.iloc[rowindex,colindex] = value
+        if self.transposed == True:
+            self.columnChanged()
+        elif df.dtypes.iloc[colindex] != dtype:
+            self.columnChanged([colname])
+        else:
+            self._updateStats(colname, old, df.iloc[rowindex,colindex])
         return
 
-    def transpose(self):
-        """Transpose dataframe"""
+    def _setSparseValue(self, col, row, value):
+        """Set a value in a sparse column by rebuilding only its stored
+           values. The stored values keep a float type while they are all
+           numbers, otherwise they become objects"""
+
+        df = self._df
+        arr = df[col].array
+        n = len(arr)
+        idx = arr.sp_index.to_int_index().indices
+        vals = arr.sp_values
+        pos = np.searchsorted(idx, row)
+        if pos < len(idx) and idx[pos] == row:
+            idx = np.delete(idx, pos)
+            vals = np.delete(vals, pos)
+        try:
+            isnull = bool(pd.isnull(value))
+        except (TypeError, ValueError):
+            isnull = False
+        if not isnull:
+            if vals.dtype.kind == 'f':
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    vals = vals.astype('object')
+            idx = np.insert(idx, pos, row)
+            vals = np.insert(vals, pos, value)
+        if len(idx) > n * self.sparsedensity:
+            s = pd.Series(np.nan, index=df.index, dtype=vals.dtype)
+            s.iloc[idx] = vals
+        else:
+            s = util.sparseColumn(n, idx, vals)
+        df[col] = s
+        self.columnChanged([col])
+        return
+
+    def _upcastColumn(self, col, value):
+        """Change a column type so that it can store value"""
+
+        df = self._df
+        s = df[col]
+        if util.check_categorical(s):
+            s = s.cat.add_categories([value])
+        else:
+            if util.check_sparse(s):
+                s = util.to_dense(s)
+            if s.dtype.kind in 'iuf' and isinstance(value, (int, float)):
+                s = s.astype('float64')
+            else:
+                s = s.astype('object')
+        df[col] = s
+        return
+
+    def optimizeMemory(self, cols=None, downcast=True, categories=True,
+                       catratio=0.5, maxcategories=1000, sparse=False,
+                       sparseratio=0.9):
+        """Reduce memory used by the dataframe. Numeric columns are downcast
+           where no values would change, object columns with few unique
+           values relative to their length (catratio) and no more than
+           maxcategories become categoricals. If sparse is set, numeric
+           columns where one value fills at least sparseratio of the rows
+           become sparse. Returns a dataframe reporting memory before
+           and after for each column."""
+
+        df = self.df
+        if cols is None:
+            cols = range(len(df.columns))
+        before = df.memory_usage(deep=True, index=False)
+        olddtypes = df.dtypes
+        for i in cols:
+            col = df.columns[i]
+            s = df[col]
+            if util.check_sparse(s) or util.check_categorical(s):
+                continue
+            kind = s.dtype.kind
+            new = s
+            if kind in 'iuf' and downcast == True:
+                new = self._downcast(s)
+            if kind in 'iufb' and sparse == True and len(s) > 0:
+                counts = new.value_counts(dropna=False)
+                if counts.iloc[0] >= sparseratio * len(s):
+                    fill = counts.index[0]
+                    new = pd.Series(util.to_sparse(new.values, fill_value=fill),
+                                    index=s.index, name=col)
+            elif kind == 'O' and categories == True and len(s) > 0:
+                n = s.nunique()
+                if n <= maxcategories and n <= catratio * len(s):
+                    new = s.astype('category')
+            if new is not s:
+                df[col] = new
+                self.columnChanged([col])
+        after = df.memory_usage(deep=True, index=False)
+        report = pd.DataFrame({'dtype': olddtypes.astype(str),
+                               'new dtype': df.dtypes.astype(str),
+                               'before': before, 'after': after},
+                              columns=['dtype','new dtype','before','after'])
+        report.loc['total'] = ['', '', before.sum(), after.sum()]
+        report['saved %'] = np.round((1-report.after/report.before)*100, 1)
+        return report
+
+    def _downcast(self, s):
+        """Return the smallest numeric type version of a series that holds
+           exactly the same values, or the series itself"""
+
+        vals = s.values
+        if s.dtype.kind in 'iu':
+            if len(vals) == 0:
+                return s
+            mn, mx = vals.min(), vals.max()
+            for t in [np.int8, np.int16, np.int32]:
+                info = np.iinfo(t)
+                if mn >= info.min and mx <= info.max:
+                    if np.dtype(t).itemsize < s.dtype.itemsize:
+                        return s.astype(t)
+                    break
+        elif s.dtype == np.float64:
+            new = vals.astype(np.float32)
+            mask = ~np.isnan(vals)
+            if np.array_equal(new[mask].astype(np.float64), vals[mask]):
+                return s.astype(np.float32)
+        return s
+
+    def convertNumeric(self):
+        """Convert object columns to numbers where possible. Values that
+           can't be converted become NaN unless none of them could be"""
+
+        df = self.df
+        for c in df.columns:
+            s = df[c]
+            if s.dtype.kind != 'O' or util.check_categorical(s) == 1:
+                continue
+            new = pd.to_numeric(s, errors='coerce')
+            if new.isnull().all():
+                continue
+            df[c] = new
+            self.columnChanged([c])
+        return
+
+    def applyColumnWise(self, cols, funcname, newcol=None, inplace=False,
+                        suffix='_x'):
+        """Apply a numpy function to columns and return the names of the
+           columns set. Reductions such as mean work across the columns
+           of each row, binary functions take the first two columns and
+           other functions apply to each column. Numpy ufuncs work on
+           whole arrays, other functions are called per row or value."""
 
         df = self.df
-        rows = df.index
-        df = df.transpose()
-        df.reset_index()
+        func = getattr(np, funcname)
+        arrays = [np.asarray(df[c].values) for c in cols]
+        numeric = all(a.dtype.kind in 'biuf' for a in arrays)
+        vectorized = numeric and (isinstance(func, np.ufunc) or funcname in vectorfuncs)
+        if funcname in reductions:
+            name = cols[0] if inplace else newcol or '%s(%s)' %(funcname, ', '.join(cols))
+            if numeric:
+                with np.errstate(all='ignore'), warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    result = reductions[funcname](np.column_stack(arrays), axis=1)
+            else:
+                result = df[cols].apply(func, 1)
+            df[name] = result
+            names = [name]
+        elif (isinstance(func, np.ufunc) and func.nin == 2) or funcname in binaryfuncs:
+            name = newcol or cols[0] + ' ' + funcname + ' ' + cols[1]
+            if vectorized:
+                with np.errstate(all='ignore'):
+                    df[name] = func(arrays[0], arrays[1])
+            else:
+                df[name] = df[cols[0]].combine(df[cols[1]], func=func)
+            names = [name]
+        else:
+            if inplace:
+                names = cols
+            elif len(cols) == 1:
+                names = [newcol or '%s(%s)' %(funcname, cols[0])]
+            else:
+                names = [c + suffix for c in cols]
+            for c, a, name in zip(cols, arrays, names):
+                if vectorized:
+                    with np.errstate(all='ignore'):
+                        df[name] = func(a)
+                else:
+                    df[name] = df[c].apply(func)
+        self.columnChanged(names)
+        return names
+
+    def transpose(self):
+        """Transpose the table. This only swaps the axes the model
+           serves, the transposed dataframe is made when needed"""
+
+        self.transposed = not self.transposed
+        self.columnwidths = {}
+        self.columnChanged()
+        return
+
+    def applyTranspose(self):
+        """Make the transposed dataframe if the model is transposed"""
+
+        if self.transposed == False:
+            return
+        self.applyColumnOrder()
+        df = self._df.transpose()
         if util.check_multiindex(df.columns) != 1:
             try:
                 df.columns = df.columns.astype(str)
             except:
                 pass
-        self.df = df.convert_objects()
-        self.columnwidths = {}
+        self._df = df.infer_objects()
+        self.transposed = False
+        self.columnChanged()
         return
 
     def query(self):
 
         return
 
-    def filterby(self):
-        import filtering
-        funcs = filtering.operatornames
-        floatops = ['=','>','<']
-        func = funcs[op]
-
+    def getIndexKey(self, colname):
+        """What a column index depends on. For a frame in memory these
+           are the frame and row index objects themselves rather than
+           versions, so a frame that is put back unchanged, as when a
+           query is cleared, keeps its indexes"""
+
+        df = self._df
+        if df is None:
+            return (self.getIndexVersion(), self.getColumnVersion(colname))
+        return (weakref.ref(df), weakref.ref(df.index), self.transposed,
+                self.dataversion, self.colversions.get(colname, 0))
+
+    def getColumnIndex(self, colname):
+        """Index of a column used for filtering, built when first needed
+           and rebuilt only when the column or the row order changes"""
+
+        def same(a, b):
+            if isinstance(a, weakref.ref):
+                return isinstance(b, weakref.ref) and a() is b()
+            return a == b
+        key = self.getIndexKey(colname)
+        ix = self.indexes.get(colname)
+        if ix is None or len(ix[0]) != len(key) or \
+            not all(same(a, b) for a, b in zip(ix[0], key)):
+            ix = self.indexes[colname] = (key, filtering.ColumnIndex(self.getColumn(colname)))
+        return ix[1]
+
+    def filterby(self, filters):
+        """Row positions matching a list of filter tuples of the form
+           (column, value, operator, boolean), see filtering.operatornames"""
+
+        mask = filtering.compileFilters(filters)(self)
+        if mask is None:
+            raise ValueError('filter values do not fit the column types')
+        return np.nonzero(mask)[0]
+
+    def close(self):
+        """Release anything the model holds outside memory, called when
+           a table no longer uses it"""
         return
 
     def __repr__(self):
         return 'Table Model with %s rows' %len(self.df)
+
+class ViewTableModel(TableModel):
+    """A table model showing some rows and columns of a parent model
+       without copying them. Values are read from the parent so its
+       edits show up on the next redraw. The data is copied from the
+       parent the first time the view itself is changed, or anything
+       needs the whole dataframe, after which it is a normal model."""
+
+    def __init__(self, parent, rows=None, columns=None):
+        """rows may be positions, a slice or a list of (start, stop)
+           intervals and columns a list of labels, None for all"""
+
+        self.initialiseFields()
+        self.parent = parent
+        self._df = None
+        n = parent.getRowCount()
+        if rows is None:
+            rows = np.arange(n)
+        elif isinstance(rows, slice):
+            rows = np.arange(n)[rows]
+        elif len(rows) > 0 and isinstance(rows[0], tuple):
+            rows = np.concatenate([np.arange(a, b) for a, b in rows])
+        self.rows = np.asarray(rows, dtype=int)
+        #all the labels the view was made with, rows the parent is not
+        #showing for now are left out of rowlabels until they come back
+        self.labels = self.rowlabels = parent.getIndex()[self.rows]
+        if columns is None:
+            columns = list(parent.getColumnLabels())
+        self.columns = pd.Index(columns)
+        self.parentcols = None
+        self.parentversion = None
+        self.dirty = False
+        parent.addListener(self.parentChanged)
+        return
+
+    def _getdf(self):
+        if self._df is None:
+            self._df = self.getDataBlock(slice(None), None).copy()
+            self.colorder = None
+            self.detach()
+        return TableModel._getdf(self)
+
+    def inMemory(self):
+        """Whether the data has been copied from the parent"""
+        return self._df is not None
+
+    def detach(self):
+        """Stop following changes to the parent"""
+
+        self.parent.removeListener(self.parentChanged)
+        return
+
+    def close(self):
+        self.detach()
+        return
+
+    def parentChanged(self, changes):
+        """Listener for the parent, marks the view as needing a redraw
+           when any of its columns changed"""
+
+        if changes is not None:
+            changes = [c for c in changes if c in self.columns]
+            if len(changes) == 0:
+                return
+        self.dirty = True
+        self.columnChanged(changes)
+        return
+
+    def getParentPositions(self):
+        """Row and column positions in the parent. If the parent rows or
+           columns were rearranged they are found again by label,
+           duplicate row labels resolve to their first row"""
+
+        p = self.parent
+        version = (p.getIndexVersion(), p.getColumnSetVersion())
+        last = self.parentversion
+        if last is not None and version[0] != last[0]:
+            pos = p.getLabelIndexer(self.labels)
+            self.rowlabels = self.labels[pos >= 0]
+            self.rows = np.asarray(pos[pos >= 0], dtype=int)
+        if version != self.parentversion:
+            cols = p.getColumnLabels().get_indexer(self.columns)
+            self.columns = self.columns[cols >= 0]
+            self.parentcols = cols[cols >= 0]
+            self.parentversion = version
+        return self.rows, self.parentcols
+
+    def getDataBlock(self, rows, cols):
+        """Read a block from the parent"""
+
+        if self.inMemory():
+            return TableModel.getDataBlock(self, rows, cols)
+        prows, pcols = self.getParentPositions()
+        if cols is None:
+            cols = slice(None)
+        if isinstance(cols, slice):
+            cols = list(range(len(pcols)))[cols]
+        cols = self.getPhysicalColumns(cols)
+        return self.parent.getDataBlock(prows[rows], pcols[cols])
+
+    def getColumn(self, colname):
+        if self.inMemory():
+            return TableModel.getColumn(self, colname)
+        i = self.columns.get_loc(colname)
+        prows, pcols = self.getParentPositions()
+        return self.parent.getDataBlock(prows, [pcols[i]]).iloc[:,0]
+
+    def transpose(self):
+        self.df
+        return TableModel.transpose(self)
+
+    def getRowCount(self):
+        if self.inMemory():
+            return TableModel.getRowCount(self)
+        return len(self.getParentPositions()[0])
+
+    def getColumnCount(self):
+        if self.inMemory():
+            return TableModel.getColumnCount(self)
+        return len(self.getParentPositions()[1])
+
+    def getColumnName(self, columnIndex):
+        return str(self.getColumnLabels()[columnIndex])
+
+    def _getColumnLabel(self, columnIndex):
+        return self.getColumnLabels()[columnIndex]
+
+    def getColumnLabels(self):
+        if self.inMemory():
+            return TableModel.getColumnLabels(self)
+        self.getParentPositions()
+        if self.colorder is None:
+            return self.columns
+        return self.columns[self.colorder]
+
+    def getColumnType(self, columnIndex):
+        if self.inMemory():
+            return TableModel.getColumnType(self, columnIndex)
+        return self.getDataBlock([], [columnIndex]).dtypes.iloc[0]
+
+    def getIndex(self):
+        if self.inMemory():
+            return TableModel.getIndex(self)
+        self.getParentPositions()
+        return self.rowlabels
+
+    def getIndexVersion(self):
+        if self.inMemory():
+            return TableModel.getIndexVersion(self)
+        return self.checkVersion('index', [self.getIndex()])
+
+    def getColumnSetVersion(self):
+        if self.inMemory():
+            return TableModel.getColumnSetVersion(self)
+        return self.checkVersion('columns', [self.getColumnLabels()])
+
+    def sort(self, colindex=None, ascending=True, index=False):
+        self.df
+        return TableModel.sort(self, colindex, ascending, index)
+
+    def getValueAt(self, rowindex, colindex):
+        if self.inMemory():
+            return TableModel.getValueAt(self, rowindex, colindex)
+        value = self.getDataBlock([rowindex], [colindex]).iloc[0,0]
+        if isinstance(value, (float, np.floating)) and np.isnan(value):
+            return ''
+        return value
+
+    def setValueAt(self, value, rowindex, colindex):
+        """Editing the view copies it from the parent first"""
+
+        self.df
+        return TableModel.setValueAt(self, value, rowindex, colindex)
+
+    def getlongestEntry(self, colindex, n=1000):
+        """Longest entry from the first n rows"""
+
+        if self.inMemory():
+            return TableModel.getlongestEntry(self, colindex)
+        c = self.getDataBlock(slice(0, n), [colindex]).iloc[:,0]
+        if c.dtype.kind == 'f':
+            c = c.round(3)
+        longest = c.astype('object').astype('str').str.len().max()
+        if longest is None or np.isnan(longest):
+            return 1
+        return longest
+
+    def __repr__(self):
+        return 'Table Model viewing %s rows of its parent' %self.getRowCount()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+    Date parsing and datetime fields for table columns.
+
+    Created Oct 2016
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import pandas as pd
+try:
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+except ImportError:
+    guess_datetime_format = None
+
+#tried in order when guessing from the values fails, month first is
+#preferred when both orders fit, as in pandas
+dateformats = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M',
+               '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S.%f',
+               '%m/%d/%Y', '%m/%d/%Y %H:%M', '%m/%d/%Y %H:%M:%S',
+               '%d/%m/%Y', '%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S',
+               '%d-%m-%Y', '%d.%m.%Y', '%Y/%m/%d', '%m/%d/%y', '%d/%m/%y',
+               '%d %b %Y', '%d-%b-%Y', '%b %d %Y', '%b %d, %Y', '%d %B %Y',
+               '%B %d, %Y', '%Y%m%d', '%d%m%Y', '%H:%M:%S', '%H:%M']
+#format pandas uses to parse each value on its own, pandas before 2.0
+#does that without one
+mixedformat = 'mixed' if int(pd.__version__.split('.')[0]) >= 2 else None
+#datetime fields that can be extracted and how
+fields = ['year', 'month', 'day', 'hour', 'minute', 'second', 'quarter',
+          'dayofyear', 'weekofyear', 'dayofweek', 'day_name', 'month_name',
+          'date']
+
+def getSample(s, n=200):
+    """Distinct non null strings of a column to test formats on"""
+
+    s = s.dropna()
+    #spread over the column as sorted data may vary little at the start
+    pos = np.unique(np.linspace(0, len(s)-1, min(len(s), n*5)).astype(int))
+    u = pd.unique(s.values[pos])
+    return pd.Series(u[:n]).astype(str)
+
+def checkFormat(sample, fmt):
+    """Whether every value in the sample parses with a format"""
+
+    if len(sample) == 0:
+        return False
+    try:
+        d = pd.to_datetime(sample, format=fmt, errors='coerce')
+    except (ValueError, TypeError):
+        return False
+    return d.notnull().all()
+
+def isYearDayMonth(fmt):
+    """Formats such as %Y-%d-%m are almost never meant"""
+
+    i, j, k = fmt.find('%Y'), fmt.find('%d'), fmt.find('%m')
+    return 0 <= i < j < k
+
+def inferFormat(s, n=200):
+    """Find a format that parses a sample of the column, None if there
+       is none. Ambiguous dates are read month first like pd.to_datetime,
+       day first is only used when the sample rules that out"""
+
+    sample = getSample(s, n)
+    tried = []
+    if guess_datetime_format is not None:
+        for dayfirst in [False, True]:
+            for v in sample[:5]:
+                try:
+                    fmt = guess_datetime_format(v, dayfirst=dayfirst)
+                except (ValueError, TypeError):
+                    fmt = None
+                if fmt is not None and fmt not in tried and not isYearDayMonth(fmt):
+                    tried.append(fmt)
+    tried.extend(f for f in dateformats if f not in tried)
+    for fmt in tried:
+        if checkFormat(sample, fmt):
+            return fmt
+    return None
+
+class DateParser(object):
+    """Converts columns to datetimes with an explicit format, inferred
+       from a sample and kept per column so the next conversion of that
+       column only has to check it. Repeated values are parsed once."""
+
+    def __init__(self, uniqueratio=0.5):
+        self.formats = {}
+        self.uniqueratio = uniqueratio
+        #values that could not be read in the last parse
+        self.lost = 0
+        return
+
+    def getFormat(self, s, key=None):
+        fmt = self.formats.get(key)
+        if fmt is not None and checkFormat(getSample(s, 50), fmt):
+            return fmt
+        fmt = inferFormat(s)
+        if key is not None and fmt is not None:
+            self.formats[key] = fmt
+        return fmt
+
+    def parse(self, s, fmt=None, key=None):
+        """Datetime series from a column. fmt None infers the format.
+           Values that don't fit it are parsed on their own, those that
+           still can't be read become NaT and are counted in lost"""
+
+        self.lost = 0
+        if s.dtype.kind == 'M':
+            return s
+        if fmt is None:
+            fmt = self.getFormat(s, key)
+        codes, uniques = pd.factorize(s)
+        if len(uniques) <= len(s)*self.uniqueratio:
+            d = self.toDatetime(pd.Series(uniques), fmt)
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            self.lost = int(counts[d.isnull().values].sum())
+            #missing values have code -1, which takes the added NaT
+            values = np.append(d.values, np.datetime64('NaT', 'ns'))
+            return pd.Series(values[codes], index=s.index, name=s.name)
+        d = self.toDatetime(s, fmt)
+        self.lost = int((d.isnull() & s.notnull()).sum())
+        return d
+
+    def toDatetime(self, s, fmt):
+        if fmt is None:
+            return pd.to_datetime(s, errors='coerce')
+        if s.dtype.kind in 'iuf':
+            s = s.astype('Int64').astype(str)
+        d = pd.to_datetime(s, format=fmt, errors='coerce')
+        #the format was only checked on a sample, try others for the rest
+        failed = (d.isnull() & s.notnull()).values
+        if failed.any():
+            d[failed] = pd.to_datetime(s[failed], format=mixedformat, errors='coerce')
+        return d
+
+def extractFields(s, names):
+    """Dataframe of several datetime fields. They are found for the
+       distinct dates, then all taken for the rows together"""
+
+    codes, uniques = pd.factorize(s)
+    idx = pd.DatetimeIndex(uniques)
+    hasnull = (codes < 0).any()
+    out = {}
+    for name in names:
+        if name == 'weekofyear':
+            v = idx.isocalendar().week.values.astype('int64')
+        elif name in ['day_name', 'month_name']:
+            v = getattr(idx, name)()
+        else:
+            v = getattr(idx, name)
+        v = np.asarray(v)
+        if v.dtype.kind not in 'iuf':
+            v = v.astype(object)
+            missing = None
+        elif hasnull:
+            v = v.astype(float)
+            missing = np.nan
+        else:
+            missing = 0
+        #missing dates have code -1, which takes the added value
+        out[name] = np.append(v, np.array([missing], dtype=v.dtype))[codes]
+    return pd.DataFrame(out, index=s.index, columns=names)
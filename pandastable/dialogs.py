@@ -43,6 +43,7 @@ from collections import OrderedDict
 import webbrowser
 import pandas as pd
 from .data import TableModel
+from . import tasks
 
 def getParentGeometry(parent):
     x = parent.winfo_rootx()
@@ -183,12 +184,16 @@ class MultipleValDialog(Dialog):
     """Simple dialog to get multiple values"""
 
     def __init__(self, parent, title=None, initialvalues=None, labels=None,
-                    types=None, tooltips=None):
+                    types=None, tooltips=None, info=None):
+        """info is an optional function of the current values returning
+           text shown under the fields, updated as they change"""
+
         if labels != None and types is not None:
             self.initialvalues = initialvalues
             self.labels = labels
             self.types = types
             self.tooltips = tooltips
+            self.info = info
         Dialog.__init__(self, parent, title)
         #super(MultipleValDialog, self).__init__(parent, title)
         return
@@ -232,16 +237,40 @@ class MultipleValDialog(Dialog):
                 ToolTip.createToolTip(self.entries[i], self.tooltips[i])
             r+=1
 
+        if getattr(self, 'info', None) is not None:
+            self.infovar = StringVar()
+            Label(master, textvariable=self.infovar, wraplength=250,
+                  justify=LEFT).grid(row=r, column=0, columnspan=2, sticky='w')
+            for i in range(len(self.labels)):
+                if self.types[i] == 'listbox':
+                    self.vrs[i].bind('<<ListboxSelect>>', self.updateInfo, add='+')
+                else:
+                    self.vrs[i].trace('w', self.updateInfo)
+            self.updateInfo()
         return self.entries[0] # initial focus
 
-    def apply(self):
-        self.result = True
-        self.results = []
+    def getValues(self):
+        values = []
         for i in range(len(self.labels)):
             if self.types[i] == 'listbox':
-                self.results.append(self.vrs[i].getSelectedItem())
+                values.append(self.vrs[i].getSelectedItem())
             else:
-                self.results.append(self.vrs[i].get())
+                values.append(self.vrs[i].get())
+        return values
+
+    def updateInfo(self, *args):
+        """Show the info text for the current values"""
+
+        try:
+            text = self.info(self.getValues())
+        except Exception:
+            text = ''
+        self.infovar.set(text)
+        return
+
+    def apply(self):
+        self.result = True
+        self.results = self.getValues()
         return
 
     def getResults(self, null=None):
@@ -325,6 +354,7 @@ class ImportDialog(Frame):
         self.parent = parent
         self.filename = filename
         self.df = None
+        self.progressive = False
         self.main = Toplevel()
         self.master = self.main
         self.main.title('Text Import')
@@ -337,7 +367,7 @@ class ImportDialog(Frame):
         grps = {'formats':['delimiter','decimal','comment'],
                 'data':['header','skiprows','index_col','skipinitialspace',
                         'skip_blank_lines','parse_dates','encoding','names'],
-                'other':['rowsperfile']}
+                'other':['rowsperfile','progressive']}
         grps = OrderedDict(sorted(grps.items()))
         opts = self.opts = {'delimiter':{'type':'combobox','default':',',
                         'items':delimiters, 'tooltip':'seperator'},
@@ -365,6 +395,8 @@ class ImportDialog(Frame):
                                 'tooltip':'rows to read'},
                      'names':{'type':'entry','default':'','label':'column names',
                                 'tooltip':'col labels'},
+                     'progressive':{'type':'checkbutton','default':0,'label':'load in background',
+                                'tooltip':'show the first rows and keep loading in chunks'},
                      }
         bf = Frame(self.main)
         bf.pack(side=LEFT,fill=BOTH)
@@ -404,7 +436,7 @@ class ImportDialog(Frame):
         """Reload previews"""
 
         kwds = {}
-        other = ['rowsperfile']
+        other = ['rowsperfile','progressive']
         for i in self.opts:
             if i in other:
                 continue
@@ -446,6 +478,11 @@ class ImportDialog(Frame):
         pb = Progressbar(pw, orient='horizontal', mode='indeterminate')
         pb.pack(expand=True, fill=BOTH, side=TOP)
         pb.start(500)'''
+        if self.tkvars['progressive'].get() == 1:
+            #the table reads the file in chunks
+            self.progressive = True
+            self.quit()
+            return
         self.df = pd.read_csv(self.filename, **self.kwds)
         self.quit()
         return
@@ -457,7 +494,7 @@ class ImportDialog(Frame):
 class CombineDialog(Frame):
     """Provides a frame for setting up combine operations"""
 
-    def __init__(self, parent=None, df1=None, df2=None):
+    def __init__(self, parent=None, df1=None, df2=None, compute=True):
 
         self.parent = parent
         self.main = Toplevel()
@@ -469,6 +506,9 @@ class CombineDialog(Frame):
         self.df1 = df1
         self.df2 = df2
         self.merged = None
+        self.compute = compute
+        self.method = None
+        self.kwds = None
 
         f = Frame(self.main)
         f.pack(side=TOP,fill=BOTH)
@@ -532,15 +572,13 @@ class CombineDialog(Frame):
             if val == '':
                 val=None
             kwds[i] = val
-        print (kwds)
-        if method == 'merge':
-            s=(kwds['suffix1'],kwds['suffix2'])
-            del kwds['suffix1']
-            del kwds['suffix2']
-            m = pd.merge(self.df1,self.df2,on=None,suffixes=s, **kwds)
-        elif method == 'concat':
-            m = pd.concat([self.df1,self.df2], **kwds)
-        print (m)
+        if self.compute == False:
+            #the caller does the operation
+            self.method = method
+            self.kwds = kwds
+            self.quit()
+            return
+        m = tasks.combine(tasks.TaskState(), self.df1, self.df2, method, kwds)
         #if successful ask user to replace table and close
         if len(m) > 0:
             n = messagebox.askyesno("Join done",
@@ -565,7 +603,7 @@ class CombineDialog(Frame):
 class AggregateDialog(Frame):
     """Provides a frame for split-apply-combine operations"""
 
-    def __init__(self, parent=None, df=None):
+    def __init__(self, parent=None, df=None, compute=True):
 
         self.parent = parent
         self.main = Toplevel()
@@ -576,6 +614,9 @@ class AggregateDialog(Frame):
         self.main.transient(parent)
         self.df = df
         self.result = None
+        self.compute = compute
+        self.grp = None
+        self.aggdict = None
         cols = list(self.df.columns)
 
         m = Frame(self.main)
@@ -627,8 +668,16 @@ class AggregateDialog(Frame):
             funcs = self.vars[i][1].getSelectedItem()
             if agg != '' and agg not in grp:
                 aggdict[agg] = funcs
-        #print (aggdict)
-        self.result = self.df.groupby(grp).agg(aggdict)
+        self.grp = grp
+        self.aggdict = aggdict
+        if self.compute == True:
+            #reuse the group codes of the table model when grouping all of it
+            grouping = None
+            model = getattr(self.parent, 'model', None)
+            if len(grp) > 0 and hasattr(model, 'getGrouping') and model.df is self.df:
+                grouping = model.getGrouping(grp)
+            self.result = tasks.aggregate(tasks.TaskState(), self.df, grp,
+                                          aggdict, grouping)
         self.quit()
         return
 
@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+"""
+    Column indexes, groupings and filter evaluation for table models.
+
+    Created Oct 2016
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+from __future__ import absolute_import, division, print_function
+import ast
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+try:
+    import numexpr
+except:
+    numexpr = None
+
+def contains(a, b):
+    return a.str.contains(b, regex=False)
+
+def notContains(a, b):
+    return ~a.str.contains(b, regex=False)
+
+def startsWith(a, b):
+    return a.str.startswith(b)
+
+def endsWith(a, b):
+    return a.str.endswith(b)
+
+#operators for filter tuples, comparisons take the column type
+operatornames = {'=': 'eq', '!=': 'ne', '>': 'gt', '<': 'lt',
+                 '>=': 'ge', '<=': 'le', 'contains': contains,
+                 'not contains': notContains, 'starts with': startsWith,
+                 'ends with': endsWith}
+rangeops = ['=', '!=', '>', '<', '>=', '<=']
+booleanops = ['AND', 'OR', 'NOT']
+
+class ColumnIndex(object):
+    """Index of one column for fast filtering. Numeric and date columns
+       keep their row positions sorted by value so a range is found by
+       binary search. Other columns keep the row positions of each
+       distinct value (an inverted index)."""
+
+    def __init__(self, s):
+        self.n = n = len(s)
+        self.kind = s.dtype.kind
+        self.categorical = str(s.dtype) == 'category'
+        if self.kind in 'iufM' and str(s.dtype) != 'category':
+            values = s.values
+            if self.kind in 'fM':
+                valid = np.nonzero(pd.notnull(values))[0]
+            else:
+                valid = np.arange(n)
+            self.order = valid[np.argsort(values[valid], kind='mergesort')]
+            self.sorted = values[self.order]
+            self.sortedindex = True
+        else:
+            codes, uniques = pd.factorize(s)
+            self.uniques = np.asarray(uniques, dtype=object)
+            valid = np.nonzero(codes >= 0)[0]
+            self.order = valid[np.argsort(codes[valid], kind='mergesort')]
+            self.bounds = np.searchsorted(codes[self.order], np.arange(len(uniques)+1))
+            self.sortedindex = False
+        return
+
+    def castValue(self, value):
+        """Convert a filter value to the column type. Only values pandas
+           would compare with the column are converted, TypeError for
+           the rest"""
+
+        if self.kind == 'M':
+            return np.datetime64(pd.Timestamp(value), 'ns')
+        if self.kind in 'iuf':
+            if not isinstance(value, (int, float, np.number)):
+                raise TypeError('not a number')
+            return float(value)
+        return value
+
+    def positionsToMask(self, positions):
+        mask = np.zeros(self.n, dtype=bool)
+        mask[positions] = True
+        return mask
+
+    def getPositions(self, op, value):
+        """Row positions matching, None if the operator can't use
+           this index"""
+
+        if op == '!=':
+            return None
+        if self.sortedindex == True:
+            if op not in rangeops:
+                return None
+            try:
+                value = self.castValue(value)
+            except (TypeError, ValueError):
+                return None
+            s = self.sorted
+            lo, hi = 0, len(s)
+            if op in ['=', '>=']:
+                lo = np.searchsorted(s, value, 'left')
+            elif op == '>':
+                lo = np.searchsorted(s, value, 'right')
+            if op in ['=', '<=']:
+                hi = np.searchsorted(s, value, 'right')
+            elif op == '<':
+                hi = np.searchsorted(s, value, 'left')
+            return self.order[lo:hi]
+        match = self.matchValues(op, value)
+        if match is None:
+            return None
+        codes = np.nonzero(match)[0]
+        b = self.bounds
+        if len(codes) == 1:
+            return self.order[b[codes[0]]:b[codes[0]+1]]
+        return np.concatenate([self.order[b[c]:b[c+1]] for c in codes] or [[]]).astype(int)
+
+    def matchValues(self, op, value):
+        """Which distinct values match, so each is only tested once.
+           Comparisons are done as pandas does them, None if the value
+           can't be compared with the column"""
+
+        u = pd.Series(self.uniques)
+        func = operatornames.get(op)
+        if func is None:
+            return None
+        if callable(func):
+            return func(u.astype(str), str(value)).values
+        if self.categorical and op != '=':
+            #order of categories, not of the values
+            return None
+        try:
+            return np.asarray(getattr(u, func)(value), dtype=bool)
+        except TypeError:
+            return None
+
+    def query(self, op, value):
+        """Boolean mask of the rows matching"""
+
+        if op == '!=':
+            #missing values are not equal to anything, as in pandas
+            mask = self.query('=', value)
+            return None if mask is None else ~mask
+        positions = self.getPositions(op, value)
+        if positions is None:
+            return None
+        return self.positionsToMask(positions)
+
+class Grouping(object):
+    """Group codes of rows for one or more key columns, found once and
+       reused for any aggregation or plot on the same keys. Groups are
+       numbered in sorted key order and rows with a missing key have
+       code -1, as pandas groupby leaves them out."""
+
+    def __init__(self, df=None, keys=None):
+        if df is None:
+            return
+        self.keys = list(keys)
+        codes = None
+        levels = []
+        for k in self.keys:
+            c, u = pd.factorize(df[k], sort=True)
+            levels.append(u)
+            if codes is None:
+                codes = c.astype(np.int64)
+            else:
+                #combined codes keep the sorted order of the keys
+                codes = np.where((codes < 0) | (c < 0), -1, codes*len(u)+c)
+        if len(self.keys) == 1:
+            labels = pd.Index(levels[0], name=self.keys[0])
+        else:
+            #renumber the combinations that occur
+            valid = codes >= 0
+            combined = codes[valid]
+            codes = np.full(len(codes), -1, dtype=np.int64)
+            codes[valid], combined = pd.factorize(combined, sort=True)
+            #unpack the combined codes into the codes of each key
+            sizes = [len(u) for u in levels]
+            parts = []
+            rest = np.asarray(combined)
+            for size in reversed(sizes[1:]):
+                parts.insert(0, rest % size)
+                rest = rest // size
+            parts.insert(0, rest)
+            labels = pd.MultiIndex(levels=levels, codes=parts, names=self.keys)
+        self.setCodes(codes, labels)
+        return
+
+    def setCodes(self, codes, labels):
+        self.codes = codes
+        self.labels = labels
+        self.ngroups = len(labels)
+        valid = np.nonzero(codes >= 0)[0]
+        self.order = valid[np.argsort(codes[valid], kind='mergesort')]
+        self.bounds = np.searchsorted(codes[self.order], np.arange(self.ngroups+1))
+        return
+
+    def __len__(self):
+        return self.ngroups
+
+    def take(self, positions):
+        """Grouping of some of the rows, without empty groups"""
+
+        codes = self.codes[positions]
+        present = np.unique(codes[codes >= 0])
+        lookup = np.full(self.ngroups+1, -1, dtype=np.int64)
+        lookup[present] = np.arange(len(present))
+        g = Grouping()
+        g.keys = self.keys
+        g.setCodes(lookup[codes], self.labels[present])
+        return g
+
+    def groups(self):
+        """Name and row positions of each group"""
+
+        b = self.bounds
+        for i, name in enumerate(self.labels):
+            yield name, self.order[b[i]:b[i+1]]
+        return
+
+    def frames(self, df):
+        """Name and rows of df for each group, df having the rows the
+           codes were made from"""
+
+        for name, pos in self.groups():
+            yield name, df.iloc[pos]
+        return
+
+    def getCategorical(self):
+        """The codes as a categorical of the group names, which pandas
+           groups on without hashing the keys again"""
+
+        names = pd.Index(list(self.labels), tupleize_cols=False)
+        return pd.Categorical.from_codes(self.codes, categories=names, ordered=True)
+
+    def groupby(self, df):
+        """A pandas groupby of df using these groups"""
+
+        return df.groupby(self.getCategorical(), observed=True, sort=True)
+
+    def aggregate(self, df, func):
+        """Aggregate the columns of df not used as keys, as
+           df.groupby(keys).agg(func)"""
+
+        if not isinstance(func, dict):
+            df = df[[c for c in df.columns if c not in self.keys]]
+        cat = pd.Categorical.from_codes(self.codes, categories=np.arange(self.ngroups),
+                                        ordered=True)
+        result = df.groupby(cat, observed=True, sort=True).agg(func)
+        result.index = self.labels[np.asarray(result.index)]
+        return result
+
+def scanColumn(s, op, value):
+    """Boolean mask from testing every value, when no index applies.
+       None if pandas can't compare the value with the column"""
+
+    func = operatornames[op]
+    if callable(func):
+        return func(s.astype(str), str(value)).fillna(False).values
+    try:
+        return np.asarray(getattr(s, func)(value), dtype=bool)
+    except (TypeError, ValueError):
+        return None
+
+def compileFilters(filters):
+    """Check a list of (column, value, operator, boolean) filter tuples
+       once and return a function of a model giving the matching rows
+       mask. The boolean of each filter after the first is AND, OR or
+       NOT (and not) to combine it with those before. The function gives
+       None if a value can't be compared with its column"""
+
+    steps = []
+    for f in filters:
+        col, value, op = f[:3]
+        b = f[3] if len(f) > 3 else 'AND'
+        if op not in operatornames:
+            raise ValueError('unknown operator %s' %op)
+        if b not in booleanops:
+            raise ValueError('unknown boolean %s' %b)
+        steps.append((col, value, op, b))
+
+    def evaluate(model):
+        mask = None
+        for col, value, op, b in steps:
+            m = model.getColumnIndex(col).query(op, value)
+            if m is None:
+                m = scanColumn(model.getColumn(col), op, value)
+            if m is None:
+                return None
+            if mask is None:
+                mask = m
+            elif b == 'AND':
+                mask = mask & m
+            elif b == 'OR':
+                mask = mask | m
+            else:
+                mask = mask & ~m
+        if mask is None:
+            mask = np.ones(model.getRowCount(), dtype=bool)
+        return mask
+    return evaluate
+
+def parseQuery(expr):
+    """Convert a simple query string such as a > 1 and b == 'x' to filter
+       tuples. Returns None for anything else, which should be left to
+       pandas"""
+
+    cmpops = {ast.Eq: '=', ast.NotEq: '!=', ast.Gt: '>', ast.Lt: '<',
+              ast.GtE: '>=', ast.LtE: '<='}
+    try:
+        tree = ast.parse(expr.strip(), mode='eval').body
+    except SyntaxError:
+        return None
+
+    def literal(node):
+        try:
+            return True, ast.literal_eval(node)
+        except (ValueError, TypeError, SyntaxError):
+            return False, None
+
+    def compare(node, b):
+        if not isinstance(node, ast.Compare) or len(node.ops) != 1:
+            return None
+        op = cmpops.get(type(node.ops[0]))
+        if op is None or not isinstance(node.left, ast.Name):
+            return None
+        ok, value = literal(node.comparators[0])
+        if not ok:
+            return None
+        return (node.left.id, value, op, b)
+
+    if isinstance(tree, ast.BoolOp):
+        b = 'AND' if isinstance(tree.op, ast.And) else 'OR'
+        nodes = tree.values
+    else:
+        b = 'AND'
+        nodes = [tree]
+    filters = []
+    for node in nodes:
+        f = compare(node, b)
+        if f is None:
+            return None
+        filters.append(f)
+    return filters
+
+def splitTerms(expr):
+    """Split a query into the normalized terms joined by 'and' or &, so
+       that queries can be compared whatever their spacing"""
+
+    try:
+        tree = ast.parse(expr.strip(), mode='eval').body
+    except SyntaxError:
+        return [' '.join(expr.split())]
+    terms = []
+    def split(node):
+        if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+            for v in node.values:
+                split(v)
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+            split(node.left)
+            split(node.right)
+        elif hasattr(ast, 'unparse'):
+            terms.append(ast.unparse(node))
+        else:
+            terms.append(ast.dump(node))
+    split(tree)
+    return terms
+
+def evaluateQuery(df, expr, model=None, largesize=10000):
+    """Boolean mask for a query. Simple comparisons use the column
+       indexes of the model if given, otherwise the expression is
+       evaluated by pandas, with numexpr for large frames"""
+
+    filters = parseQuery(expr)
+    if model is not None and filters is not None and \
+            all(f[0] in df.columns for f in filters):
+        mask = compileFilters(filters)(model)
+        if mask is not None:
+            return mask
+    engine = 'python'
+    if numexpr is not None and len(df) > largesize:
+        engine = 'numexpr'
+    return np.asarray(df.eval(expr, engine=engine), dtype=bool)
+
+class QueryCache(object):
+    """Row masks of recent queries on a table. A repeated query is a
+       lookup and a query that adds terms with 'and' to an earlier one
+       only tests the new terms on the rows that one kept. Masks are
+       stored with a token for the data version they were made from."""
+
+    def __init__(self, size=20):
+        self.size = size
+        self.masks = OrderedDict()
+        return
+
+    def rebase(self, old, new):
+        """Keep masks valid when the same data gets a new version token"""
+
+        for key, (token, terms, mask) in self.masks.items():
+            if token == old:
+                self.masks[key] = (new, terms, mask)
+        return
+
+    def getMask(self, df, expr, token, model=None):
+        """Boolean mask of the rows of df matching expr"""
+
+        terms = splitTerms(expr)
+        key = ' and '.join(terms)
+        hit = self.masks.get(key)
+        if hit is not None and hit[0] == token:
+            self.masks.move_to_end(key)
+            return hit[2]
+        base = None
+        for t, ts, m in self.masks.values():
+            if t == token and set(ts) < set(terms):
+                if base is None or len(ts) > len(base[0]):
+                    base = (ts, m)
+        if base is None:
+            mask = evaluateQuery(df, ' and '.join('(%s)' %t for t in terms), model)
+        else:
+            extra = ' and '.join('(%s)' %t for t in terms if t not in base[0])
+            rows = np.nonzero(base[1])[0]
+            mask = np.zeros(len(df), dtype=bool)
+            if len(rows) > 0:
+                mask[rows] = evaluateQuery(df.iloc[rows], extra)
+        self.masks[key] = (token, terms, mask)
+        if len(self.masks) > self.size:
+            self.masks.popitem(last=False)
+        return mask
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+    Formula columns, their dependencies and evaluation.
+
+    Created Oct 2016
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+from __future__ import absolute_import, division, print_function
+import re
+from collections import OrderedDict
+import numpy as np
+try:
+    import numexpr as ne
+except:
+    ne = None
+
+#numexpr functions that reduce the whole array to one value
+reductions = re.compile(r'\b(sum|prod)\s*\(')
+
+def getArgumentType(a):
+    """Type numexpr uses for an array argument, found from its dtype"""
+
+    kind, size = a.dtype.kind, a.dtype.itemsize
+    if kind == 'b':
+        return bool
+    if kind in 'iu':
+        #unsigned 32 bit values don't fit an int
+        if size > 4 or (kind == 'u' and size == 4):
+            return np.int64
+        return np.int32
+    if kind == 'f':
+        #numexpr takes float as single precision
+        return np.float64 if size > 4 else float
+    if kind == 'c':
+        return complex
+    if kind == 'S':
+        return bytes
+    raise ValueError('numexpr can not use %s columns' %a.dtype.name)
+
+def getReferences(ex, columns):
+    """Column names used in an expression"""
+
+    names = set(re.findall(r'[A-Za-z_]\w*', ex))
+    return [c for c in columns if c in names]
+
+class FormulaCycleError(ValueError):
+    """A formula would depend on itself through other formulae"""
+    pass
+
+class FormulaEngine(object):
+    """Formula columns and the columns each one uses, kept as a graph so
+       that after a change only the formulae downstream of it are
+       recalculated, each after any formula it uses"""
+
+    def __init__(self):
+        self.formulae = {}
+        self.depends = {}
+        return
+
+    def findCycle(self, name, refs):
+        """Path from name back to itself if it used refs, or None"""
+
+        stack = [(r, [name, r]) for r in refs]
+        seen = set()
+        while stack:
+            col, path = stack.pop()
+            if col == name:
+                return path
+            if col in seen:
+                continue
+            seen.add(col)
+            for r in self.depends.get(col, []):
+                stack.append((r, path+[r]))
+        return None
+
+    def check(self, name, ex, columns):
+        """Columns used by a formula, raises FormulaCycleError if it
+           would make a cycle. Using its own column is not a dependency,
+           so a = a*2 is applied once"""
+
+        refs = [c for c in getReferences(ex, columns) if c != name]
+        path = self.findCycle(name, refs)
+        if path is not None:
+            raise FormulaCycleError('formula cycle: %s' %' -> '.join(path))
+        return refs
+
+    def add(self, name, ex, refs):
+        self.formulae[name] = ex
+        self.depends[name] = list(refs)
+        return
+
+    def remove(self, name):
+        self.formulae.pop(name, None)
+        self.depends.pop(name, None)
+        return
+
+    def clear(self):
+        self.formulae.clear()
+        self.depends.clear()
+        return
+
+    def getOrder(self, changed=None):
+        """Formulae to recalculate in dependency order. Only those
+           downstream of the changed columns, all if changed is None"""
+
+        names = list(self.formulae.keys())
+        if changed is not None:
+            users = {}
+            for n in names:
+                for r in self.depends[n]:
+                    users.setdefault(r, []).append(n)
+            found = set()
+            stack = list(changed)
+            while stack:
+                for n in users.get(stack.pop(), []):
+                    if n not in found:
+                        found.add(n)
+                        stack.append(n)
+            names = [n for n in names if n in found]
+        #topological sort of the selected formulae
+        wanted = set(names)
+        order = []
+        done = set()
+        def visit(n, path):
+            if n in done:
+                return
+            if n in path:
+                raise FormulaCycleError('formula cycle: %s' %' -> '.join(path+[n]))
+            for r in self.depends.get(n, []):
+                if r in wanted:
+                    visit(r, path+[n])
+            done.add(n)
+            order.append(n)
+        for n in names:
+            visit(n, [])
+        return order
+
+    def getMeta(self):
+        """Formulae and dependencies for saving in project meta data"""
+
+        return {'formulae': dict(self.formulae),
+                'depends': dict((k, list(v)) for k, v in self.depends.items())}
+
+    def setMeta(self, meta):
+        self.clear()
+        self.formulae.update(meta.get('formulae', {}))
+        self.depends.update(meta.get('depends', {}))
+        for n in self.formulae:
+            self.depends.setdefault(n, [])
+        return
+
+class Evaluator(object):
+    """Evaluates numexpr expressions on the columns of a dataframe. Only
+       the columns used are passed, as their arrays without copying, and
+       compiled expressions are kept for reuse. Long frames are done in
+       row chunks so temporaries stay small, except for reductions such
+       as sum(a) which are done in one pass."""
+
+    def __init__(self, threads=None, chunksize=1000000, cachesize=100):
+        self.threads = threads
+        self.chunksize = chunksize
+        self.cachesize = cachesize
+        self.compiled = OrderedDict()
+        return
+
+    def compile(self, ex, names, arrays):
+        """Get the compiled expression for these argument types"""
+
+        signature = tuple((n, getArgumentType(a)) for n, a in zip(names, arrays))
+        key = (ex, signature)
+        if key in self.compiled:
+            self.compiled.move_to_end(key)
+            return self.compiled[key]
+        func = ne.NumExpr(ex, signature=signature)
+        self.compiled[key] = func
+        if len(self.compiled) > self.cachesize:
+            self.compiled.popitem(last=False)
+        return func
+
+    def evaluate(self, df, ex):
+        """Evaluate an expression using the columns of df"""
+
+        if ne is None:
+            raise ImportError('numexpr is not installed')
+        names = getReferences(ex, [c for c in df.columns if isinstance(c, str)])
+        arrays = [np.asarray(df[c].values) for c in names]
+        if self.threads is not None:
+            old = ne.set_num_threads(self.threads)
+        try:
+            if len(names) == 0:
+                return ne.evaluate(ex, local_dict={})
+            func = self.compile(ex, names, arrays)
+            n = len(df)
+            size = self.chunksize
+            #a reduction needs all rows at once
+            if n <= size or reductions.search(ex):
+                return func(*arrays)
+            out = None
+            for start in range(0, n, size):
+                part = func(*[a[start:start+size] for a in arrays])
+                if out is None:
+                    out = np.empty(n, dtype=part.dtype)
+                out[start:start+size] = part
+            return out
+        finally:
+            if self.threads is not None:
+                ne.set_num_threads(old)
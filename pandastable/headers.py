@@ -67,11 +67,11 @@ class ColumnHeader(Canvas):
         if model is None:
             model = self.table.model
         self.model = self.table.model
-        if util.check_multiindex(self.model.df.columns) == 1:
+        self.columnlabels = self.model.getColumnLabels()
+        if util.check_multiindex(self.columnlabels) == 1:
             self.height = 40
         else:
             self.height = 20
-        self.columnlabels = self.model.df.columns
 
     def setDefaults(self):
         self.colselectedcolor = '#0099CC'
@@ -80,8 +80,8 @@ class ColumnHeader(Canvas):
     def redraw(self):
         """Redraw column header"""
 
-        df = self.model.df
-        cols = self.model.getColumnCount()
+        columns = self.model.getColumnLabels()
+        cols = len(columns)
         self.tablewidth=self.table.tablewidth
         self.configure(scrollregion=(0,0,
                                      self.table.tablewidth+self.table.x_start,
@@ -100,8 +100,9 @@ class ColumnHeader(Canvas):
         if cols == 0:
             return
 
+        ismulti = util.check_multiindex(columns)
         for col in self.table.visiblecols:
-            colname = df.columns[col]
+            colname = columns[col]
             colstr = str(colname)
             if colstr in self.model.columnwidths:
                 w = self.model.columnwidths[colstr]
@@ -117,7 +118,7 @@ class ColumnHeader(Canvas):
             elif align == 'center':
                 xt = x-w/2
 
-            if util.check_multiindex(self.model.df.columns) == 1:
+            if ismulti == 1:
                 if isinstance(colname, tuple):
                     lens = [util.getTextLength(c, w-pad, font=font)[1] for c in colname]
                     colname = [str(c)[:l] for c,l in zip(colname,lens)]
@@ -256,7 +257,7 @@ class ColumnHeader(Canvas):
     def handle_mouse_move(self, event):
         """Handle mouse moved in header, if near divider draw resize symbol"""
 
-        if len(self.model.df.columns) == 0:
+        if self.model.getColumnCount() == 0:
             return
         self.delete('resizesymbol')
         w=self.table.cellwidth
@@ -294,6 +295,7 @@ class ColumnHeader(Canvas):
             self.table.multiplecollist = list(range(colclicked, currcol+1))
         else:
             return
+        self.table.selectionChanged()
         for c in self.table.multiplecollist:
             self.drawRect(c, delete=0)
             self.table.drawSelectedCol(c, delete=0)
@@ -327,14 +329,14 @@ class ColumnHeader(Canvas):
     def popupMenu(self, event):
         """Add left and right click behaviour for column header"""
 
-        df = self.table.model.df
-        if len(df.columns)==0:
+        columns = self.table.model.getColumnLabels()
+        if len(columns)==0:
             return
-        ismulti = util.check_multiindex(df.columns)
-        colname = str(df.columns[self.table.currentcol])
+        ismulti = util.check_multiindex(columns)
+        colname = str(columns[self.table.currentcol])
         currcol = self.table.currentcol
         multicols = self.table.multiplecollist
-        colnames = list(df.columns[multicols])[:4]
+        colnames = list(columns[multicols])[:4]
         colnames = [str(i) for i in colnames]
         colnames = ','.join(colnames)
         popupmenu = Menu(self, tearoff = 0)
@@ -378,6 +380,7 @@ class ColumnHeader(Canvas):
             else:
 
                 df.rename(columns={df.columns[col]: new}, inplace=True)
+                self.model.columnChanged()
                 self.redraw()
         return
 
@@ -468,7 +471,7 @@ class RowHeader(Canvas):
             return
         scale = self.table.getScale()
         h = self.table.rowheight
-        index = self.model.df.index
+        index = self.model.getIndex()
         names = index.names
 
         if self.showindex == True:
@@ -561,6 +564,7 @@ class RowHeader(Canvas):
                 multirowlist.append(rowclicked)
             else:
                 multirowlist.remove(rowclicked)
+            self.table.selectionChanged()
             self.table.drawMultipleRows(multirowlist)
             self.drawSelectedRows(multirowlist)
         return
@@ -611,6 +615,7 @@ class RowHeader(Canvas):
             self.table.multiplerowlist.append(rowover)
             self.drawSelectedRows(rowover)
             self.table.drawMultipleRows(self.table.multiplerowlist)
+        self.table.selectionChanged()
         return
 
     def toggleIndex(self):
@@ -714,7 +719,7 @@ class IndexHeader(Canvas):
         pad = 5
         scale = self.table.getScale()
         h = self.table.rowheight
-        index = self.model.df.index
+        index = self.table.model.getIndex()
         names = index.names
         if names[0] == None:
             widths = [self.width]
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""
+    Merging tables using indexes on their join keys.
+
+    Created Oct 2016
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+from __future__ import absolute_import, division, print_function
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from .filtering import Grouping
+
+#pandas before 2.2 gives the rows of an inner join grouped by key, in
+#the order each key first appears on the left, later ones keep the
+#order of the left rows
+groupedinner = tuple(int(x) for x in pd.__version__.split('.')[:2]) < (2, 2)
+
+def isSortedKey(s):
+    """Whether a key column can be merged by binary search"""
+
+    return s.dtype.kind in 'iufM' and s.notnull().all() and \
+        s.is_monotonic_increasing
+
+def planJoin(left, right, left_on, right_on, how='inner', lindex=None,
+             rindex=None):
+    """Work out how to merge and how many rows it gives, before making
+       anything the size of the result. Sorted single keys are matched
+       by binary search, otherwise the key groupings (hash indexes) of
+       each side are matched on their distinct values only. lindex and
+       rindex are groupings of the keys if already made. The plan says
+       if any key matches several rows on both sides (many to many).
+       Joins this can't do, such as outer joins, are left to pandas
+       but still get the estimate."""
+
+    plan = {'how': how, 'left_on': left_on, 'right_on': right_on,
+            'engine': 'pandas', 'rows': None, 'manytomany': None,
+            'lindex': lindex, 'rindex': rindex}
+    if left_on is None or right_on is None or len(left_on) != len(right_on):
+        return plan
+    nl, nr = len(left), len(right)
+    if len(left_on) == 1 and isSortedKey(left[left_on[0]]) and \
+            isSortedKey(right[right_on[0]]) and \
+            left[left_on[0]].dtype.kind == right[right_on[0]].dtype.kind:
+        lk = left[left_on[0]].values
+        rk = right[right_on[0]].values
+        lo = np.searchsorted(rk, lk, 'left')
+        counts = np.searchsorted(rk, lk, 'right') - lo
+        rcounts = np.searchsorted(lk, rk, 'right') - np.searchsorted(lk, rk, 'left')
+        dup = np.zeros(nl, dtype=bool)
+        dup[1:] = lk[1:] == lk[:-1]
+        dup[:-1] |= lk[:-1] == lk[1:]
+        plan['manytomany'] = bool((dup & (counts > 1)).any())
+        inner = int(counts.sum())
+        lmissed = int((counts == 0).sum())
+        rmissed = int((rcounts == 0).sum())
+        plan.update({'engine': 'sorted', 'lo': lo, 'counts': counts})
+    else:
+        if lindex is None:
+            lindex = Grouping(left, left_on)
+        if rindex is None:
+            rindex = Grouping(right, right_on)
+        plan['lindex'], plan['rindex'] = lindex, rindex
+        try:
+            m = rindex.labels.get_indexer(lindex.labels)
+        except (TypeError, ValueError):
+            return plan
+        lcount = np.diff(lindex.bounds)
+        rcount = np.diff(rindex.bounds)
+        matched = m >= 0
+        both = lcount[matched]*rcount[m[matched]]
+        plan['manytomany'] = bool(((lcount[matched] > 1) & (rcount[m[matched]] > 1)).any())
+        inner = int(both.sum())
+        lmissed = nl - int(lcount[matched].sum())
+        rmissed = nr - int(rcount[m[matched]].sum())
+        plan['match'] = m
+        #pandas matches missing keys to each other, these indexes don't
+        if not ((lindex.codes < 0).any() and (rindex.codes < 0).any()):
+            plan['engine'] = 'hash'
+    rows = {'inner': inner, 'left': inner+lmissed, 'right': inner+rmissed,
+            'outer': inner+lmissed+rmissed}
+    plan['rows'] = rows.get(how)
+    if how not in ['inner', 'left', 'right']:
+        plan['engine'] = 'pandas'
+    return plan
+
+def expand(n, starts, counts, order=None, keepall=False):
+    """Row positions pairing each of n rows with its counts matching
+       rows, found from starts in order. With keepall rows without a
+       match are kept once, paired with -1"""
+
+    nout = np.where(counts > 0, counts, 1 if keepall else 0)
+    ltake = np.repeat(np.arange(n), nout)
+    offsets = np.arange(len(ltake)) - np.repeat(np.cumsum(nout)-nout, nout)
+    matched = np.repeat(counts > 0, nout)
+    pos = np.repeat(starts, nout) + offsets
+    rtake = np.full(len(ltake), -1, dtype=np.int64)
+    rtake[matched] = pos[matched] if order is None else order[pos[matched]]
+    return ltake, rtake
+
+def getIndexers(plan, left, right):
+    """Positions of the left and right rows of each result row, in the
+       order pd.merge gives them"""
+
+    how = plan['how']
+    if plan['engine'] == 'sorted':
+        lk = left[plan['left_on'][0]].values
+        rk = right[plan['right_on'][0]].values
+        if how == 'right':
+            lo = np.searchsorted(lk, rk, 'left')
+            counts = np.searchsorted(lk, rk, 'right') - lo
+            rtake, ltake = expand(len(right), lo, counts, keepall=True)
+            return ltake, rtake
+        return expand(len(left), plan['lo'], plan['counts'], keepall=how=='left')
+    lindex, rindex = plan['lindex'], plan['rindex']
+    if how == 'right':
+        lindex, rindex = rindex, lindex
+        m = rindex.labels.get_indexer(lindex.labels)
+    else:
+        m = plan['match']
+    codes = lindex.codes
+    if rindex.ngroups == 0:
+        #no keys on the other side, empty or all missing
+        counts = starts = np.zeros(len(codes), dtype=np.int64)
+    else:
+        j = np.where(codes >= 0, m[np.maximum(codes, 0)] if len(m) else -1, -1)
+        counts = np.where(j >= 0, np.diff(rindex.bounds)[np.maximum(j, 0)], 0)
+        starts = np.where(j >= 0, rindex.bounds[np.maximum(j, 0)], 0)
+    a, b = expand(len(codes), starts, counts, rindex.order, how!='inner')
+    if how == 'inner' and groupedinner:
+        first = lindex.order[lindex.bounds[:-1]]
+        s = np.argsort(first[codes[a]], kind='mergesort')
+        a, b = a[s], b[s]
+    if how == 'right':
+        return b, a
+    return a, b
+
+def takeColumn(s, take):
+    values = s.values
+    if (take < 0).any():
+        return pd.api.extensions.take(values, take, allow_fill=True)
+    return values.take(take)
+
+def merge(left, right, left_on, right_on, how='inner', suffixes=('_x', '_y'),
+          plan=None):
+    """Merge two frames on key columns like pd.merge(left, right,
+       left_on=left_on, right_on=right_on), using a plan from planJoin"""
+
+    if plan is None:
+        plan = planJoin(left, right, left_on, right_on, how)
+    if plan['engine'] == 'pandas':
+        return pd.merge(left, right, left_on=left_on, right_on=right_on,
+                        how=how, suffixes=suffixes)
+    suffixes = [x or '' for x in suffixes]
+    ltake, rtake = getIndexers(plan, left, right)
+    samekeys = [l for l, r in zip(left_on, right_on) if l == r]
+    rcols = [c for c in right.columns if c not in samekeys]
+    overlap = set(left.columns) & set(rcols)
+    out = OrderedDict()
+    for c in left.columns:
+        v = takeColumn(left[c], ltake)
+        if c in samekeys and (ltake < 0).any():
+            #rows only from the right take its key
+            if (rtake >= 0).all():
+                v = takeColumn(right[c], rtake)
+            else:
+                v = pd.Series(v).where(ltake >= 0, takeColumn(right[c], rtake)).values
+        out[c + suffixes[0] if c in overlap else c] = v
+    for c in rcols:
+        out[c + suffixes[1] if c in overlap else c] = takeColumn(right[c], rtake)
+    return pd.DataFrame(out)
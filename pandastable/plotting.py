@@ -40,6 +40,7 @@ from collections import OrderedDict
 import operator
 from .dialogs import *
 from . import util, images
+from .filtering import Grouping
 
 colormaps = sorted(m for m in plt.cm.datad if not m.endswith("_r"))
 
@@ -214,14 +215,27 @@ class PlotViewer(Frame):
             self.plot2D()
         return
 
+    def getGrouping(self, data, by):
+        """Groups of the data, reusing the group codes kept by the table
+           model when the data is from it"""
+
+        keys = by if isinstance(by, list) else [by]
+        grouping = None
+        if hasattr(self.table, 'getGrouping'):
+            grouping = self.table.getGrouping(keys, data)
+        if grouping is None:
+            grouping = Grouping(data, keys)
+        return grouping
+
     def _checkNumeric(self, df):
         """Get only numeric data that can be plotted"""
 
-        x = df.convert_objects()._get_numeric_data()
-        #x = df.apply(pd.to_numeric, args=('coerce',))
-        #x = df.select_dtypes(include=['int','float','int64'])
-        if x.empty==True:
-            return False
+        for c in df.columns:
+            s = df[c]
+            if s.dtype.kind in 'iuf' and util.check_categorical(s) == 0 \
+                    and s.notnull().any():
+                return True
+        return False
 
     def _initFigure(self):
         """Clear figure or add a new axis to existing layout"""
@@ -351,7 +365,7 @@ class PlotViewer(Frame):
                 return
             if by2 != '' and by2 in data.columns:
                 by = [by,by2]
-            g = data.groupby(by)
+            g = self.getGrouping(data, by)
             i=1
 
             if kwargs['subplots'] == True:
@@ -362,7 +376,7 @@ class PlotViewer(Frame):
                 nrows = round(np.sqrt(size),0)
                 ncols = np.ceil(size/nrows)
                 self.ax.set_visible(False)
-                for n,df in g:
+                for n,df in g.frames(data):
                     ax = self.fig.add_subplot(nrows,ncols,i)
                     kwargs['legend'] = False #remove axis legends
                     d = df.drop(by,1) #remove grouping columns
@@ -380,7 +394,7 @@ class PlotViewer(Frame):
                 labels = []; handles=[]
                 cmap = plt.cm.get_cmap(kwargs['colormap'])
                 kwargs['legend'] = False
-                for n,df in g:
+                for n,df in g.frames(data):
                     d = df.drop(by,1) #remove grouping columns
                     kwargs['color'] = cmap(float(i)/(len(g)))
                     kwargs['colormap'] = None
@@ -812,8 +826,14 @@ class PlotViewer(Frame):
     def updateData(self):
         """Update data widgets"""
 
-        df = self.table.model.df
-        self.mplopts.update(df)
+        model = self.table.model
+        columns = model.getColumnLabels()
+        version = (model, model.getColumnSetVersion(),
+                   [model.getColumnVersion(c) for c in columns])
+        if version == getattr(self, 'dataversion', None):
+            return
+        self.dataversion = version
+        self.mplopts.update(model)
         return
 
     def savePlot(self):
@@ -1031,17 +1051,23 @@ class MPLBaseOptions(TkOptions):
         plt.rc('legend', fontsize=size-1)
         return
 
-    def update(self, df):
-        """Update data widget(s) when dataframe changes"""
-
-        if util.check_multiindex(df.columns) == 1:
-            cols = list(df.columns.get_level_values(0))
-        else:
-            cols = list(df.columns)
-        cols += ''
-        self.widgets['by']['values'] = cols
-        self.widgets['by2']['values'] = cols
-        self.widgets['c']['values'] = cols
+    def update(self, model):
+        """Update data widget(s) when the table model changes. Color
+           choices are limited to numeric columns, found from the column
+           types so no column data is read"""
+
+        columns = model.getColumnLabels()
+        if util.check_multiindex(columns) == 1:
+            cols = list(columns.get_level_values(0))
+            self.widgets['by']['values'] = cols + ['']
+            self.widgets['by2']['values'] = cols + ['']
+            self.widgets['c']['values'] = cols + ['']
+            return
+        types = [model.getColumnType(i) for i in range(len(columns))]
+        numeric = [c for c,t in zip(columns,types) if t.kind in 'iuf']
+        self.widgets['by']['values'] = [''] + list(columns)
+        self.widgets['by2']['values'] = [''] + list(columns)
+        self.widgets['c']['values'] = [''] + numeric
         return
 
 class MPL3DOptions(MPLBaseOptions):
@@ -27,7 +27,7 @@ try:
 except:
     from Tkinter import *
     from ttk import *
-import types
+import types, re
 import numpy as np
 import pandas as pd
 import pylab as plt
@@ -118,9 +118,9 @@ class StatsViewer(Frame):
     def guessFormula(self):
         """Suggest a start formula"""
 
-        df = self.table.model.df
-        df = df.convert_objects(convert_numeric='force')
-        cols = list(df.columns)
+        model = self.table.model
+        cols = [c for c in model.getColumnLabels()
+                if model.getColumnStats(c)['numeric'] == True]
         if len(cols)>1:
             formula = '%s ~ %s' %(cols[1], cols[0])
         else:
@@ -160,6 +160,14 @@ class StatsViewer(Frame):
             return
         self.formula = formula = self.formulavar.get()
         est = self.modelvar.get()
+        #refit only if the formula, selection or the data used changed
+        tm = self.table.model
+        names = set(re.findall(r'[A-Za-z_]\w*', formula))
+        version = (formula, est, list(self.table.multiplerowlist), tm.getIndexVersion(),
+                   [(c, tm.getColumnVersion(c)) for c in data.columns if c in names])
+        if self.fit is not None and version == getattr(self, 'fitversion', None):
+            self.summary()
+            return
         try:
             self.model = mod = self.getModel(formula, data, est)
         except Exception as e:
@@ -167,6 +175,7 @@ class StatsViewer(Frame):
             return
 
         self.fit = fit = mod.fit()
+        self.fitversion = version
         self.summary()
         self.updateData()
         return
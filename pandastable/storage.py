@@ -0,0 +1,1015 @@
+#!/usr/bin/env python
+"""
+    Out of core storage for large tables. Column data are kept in memory
+    mapped files and only the rows needed for display are read.
+
+    Created Oct 2016
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+from __future__ import absolute_import, division, print_function
+import os, re, shutil, tempfile, atexit
+import pickle, sqlite3
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from .data import TableModel
+from . import filtering
+from .formulae import getReferences
+
+try:
+    import pyarrow as pa
+except:
+    pa = None
+
+class NumpyStore(object):
+    """Column store using one raw numpy memory mapped file per column.
+       Strings and other objects are stored as integer codes."""
+
+    storetypes = {'f':'float64', 'i':'int64', 'b':'bool', 'M':'int64', 'O':'int32'}
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = []
+        self.kinds = []
+        self.categories = {}
+        self.nrows = 0
+        self._maps = {}
+        self._lookups = {}
+        if not os.path.exists(path):
+            os.makedirs(path)
+        if os.path.exists(self._metafile()):
+            self.loadMeta()
+        return
+
+    def _metafile(self):
+        return os.path.join(self.path, 'meta.pickle')
+
+    def _filename(self, i):
+        return os.path.join(self.path, 'c%s.dat' %i)
+
+    def loadMeta(self):
+        """Read column names and types"""
+
+        with open(self._metafile(), 'rb') as f:
+            meta = pickle.load(f)
+        self.columns = meta['columns']
+        self.kinds = meta['kinds']
+        self.categories = meta['categories']
+        self.nrows = meta['nrows']
+        return
+
+    def saveMeta(self):
+        """Write column names and types"""
+
+        meta = {'columns': self.columns, 'kinds': self.kinds,
+                'categories': self.categories, 'nrows': self.nrows}
+        with open(self._metafile(), 'wb') as f:
+            pickle.dump(meta, f)
+        return
+
+    def getKind(self, s):
+        """Storage kind for a series"""
+
+        k = s.dtype.kind
+        if k in 'iu':
+            return 'i'
+        if k in 'fb' or str(s.dtype) == 'datetime64[ns]':
+            return k
+        return 'O'
+
+    def getDtype(self, i):
+        """The dtype a column is returned as"""
+
+        kind = self.kinds[i]
+        if kind == 'O':
+            return np.dtype('O')
+        elif kind == 'M':
+            return np.dtype('datetime64[ns]')
+        return np.dtype(self.storetypes[kind])
+
+    def getMap(self, i):
+        """Read only memory map of a column"""
+
+        dtype = self.storetypes[self.kinds[i]]
+        if self.nrows == 0:
+            return np.empty(0, dtype=dtype)
+        if i not in self._maps:
+            self._maps[i] = np.memmap(self._filename(i), dtype=dtype,
+                                      mode='r', shape=(self.nrows,))
+        return self._maps[i]
+
+    def encode(self, i, s):
+        """Convert series values to the stored array for column i"""
+
+        kind = self.kinds[i]
+        if kind == 'O':
+            cats = self.categories[i]
+            if i not in self._lookups:
+                self._lookups[i] = dict(zip(cats, range(len(cats))))
+            lookup = self._lookups[i]
+            for v in pd.unique(s.dropna()):
+                if v not in lookup:
+                    lookup[v] = len(cats)
+                    cats.append(v)
+            return s.map(lookup).fillna(-1).values.astype('int32')
+        elif kind == 'M':
+            return s.values.view('int64')
+        return s.values.astype(self.storetypes[kind])
+
+    def decode(self, i, arr):
+        """Convert a stored array back to column values"""
+
+        kind = self.kinds[i]
+        if kind == 'O':
+            cats = self.categories[i]
+            values = np.empty(len(cats)+1, dtype='O')
+            values[:-1] = cats
+            values[-1] = np.nan
+            #code -1 picks the trailing nan
+            return values[arr]
+        elif kind == 'M':
+            return np.asarray(arr).view('datetime64[ns]')
+        return np.asarray(arr)
+
+    def append(self, df):
+        """Append a dataframe chunk to the store"""
+
+        df = df.reset_index(drop=True)
+        if len(self.columns) == 0:
+            self.columns = list(df.columns)
+            self.kinds = [self.getKind(df[c]) for c in df.columns]
+            for i,k in enumerate(self.kinds):
+                if k == 'O':
+                    self.categories[i] = []
+        elif list(df.columns) != self.columns:
+            raise ValueError('columns do not match the store')
+        for i,col in enumerate(self.columns):
+            s = df[col]
+            old = self.kinds[i]
+            new = self.getKind(s)
+            if new != old:
+                #promote the stored column if the new values need it
+                if old == 'i' and new == 'f':
+                    self.convert(i, 'f')
+                elif old == 'f' and new in 'ib':
+                    pass
+                elif old != 'O':
+                    self.convert(i, 'O')
+            arr = self.encode(i, s)
+            with open(self._filename(i), 'ab') as f:
+                f.write(np.ascontiguousarray(arr).tobytes())
+        self._maps = {}
+        self.nrows += len(df)
+        self.saveMeta()
+        return
+
+    def convert(self, i, kind, chunksize=1000000):
+        """Rewrite a stored column as another kind, in chunks"""
+
+        old = self.getMap(i)
+        oldkind = self.kinds[i]
+        tmp = self._filename(i)+'.tmp'
+        with open(tmp, 'wb') as f:
+            for start in range(0, self.nrows, chunksize):
+                self.kinds[i] = oldkind
+                s = pd.Series(self.decode(i, old[start:start+chunksize]))
+                self.kinds[i] = kind
+                if kind == 'O':
+                    self.categories.setdefault(i, [])
+                    s = s.astype('O')
+                f.write(np.ascontiguousarray(self.encode(i, s)).tobytes())
+        self.kinds[i] = kind
+        if kind == 'O':
+            self.categories.setdefault(i, [])
+        self._maps = {}
+        del old
+        os.remove(self._filename(i))
+        if os.path.exists(tmp):
+            os.rename(tmp, self._filename(i))
+        else:
+            open(self._filename(i), 'wb').close()
+        return
+
+    def take(self, rows, cols):
+        """Read the given row and column positions into a dataframe.
+           Only the pages holding those rows are touched."""
+
+        if isinstance(rows, slice):
+            index = np.arange(self.nrows)[rows]
+        else:
+            rows = index = np.asarray(rows, dtype='int64')
+        data = {}
+        for i in cols:
+            data[i] = self.decode(i, self.getMap(i)[rows])
+        df = pd.DataFrame(data, index=index, columns=cols)
+        df.columns = [self.columns[i] for i in cols]
+        return df
+
+    def remove(self):
+        """Delete the files"""
+
+        self._maps = {}
+        shutil.rmtree(self.path, ignore_errors=True)
+        return
+
+class ArrowStore(object):
+    """Store for a memory mapped Arrow IPC file. Requires pyarrow. The
+       file is never written, appended rows are held in memory"""
+
+    def __init__(self, filename):
+        if pa is None:
+            raise ImportError('pyarrow is needed for arrow files')
+        self.filename = filename
+        self.source = pa.memory_map(filename, 'r')
+        self.table = pa.ipc.open_file(self.source).read_all()
+        self.columns = list(self.table.column_names)
+        self.nrows = self.table.num_rows
+        return
+
+    @classmethod
+    def write(cls, df, filename):
+        """Write a dataframe to an arrow file"""
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(filename, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        return cls(filename)
+
+    def append(self, df):
+        """Add rows after those of the file. The file data is not copied,
+           ValueError if the columns don't fit"""
+
+        try:
+            new = pa.Table.from_pandas(df, schema=self.table.schema,
+                                       preserve_index=False)
+        except (pa.ArrowException, KeyError, TypeError) as e:
+            raise ValueError('rows do not fit the arrow columns: %s' %e)
+        self.table = pa.concat_tables([self.table, new])
+        self.nrows = self.table.num_rows
+        return
+
+    def getDtype(self, i):
+        """The dtype a column is returned as"""
+
+        try:
+            return np.dtype(self.table.schema.types[i].to_pandas_dtype())
+        except:
+            return np.dtype('O')
+
+    def take(self, rows, cols):
+        """Read the given row and column positions into a dataframe"""
+
+        table = self.table.select(cols)
+        if isinstance(rows, slice):
+            index = np.arange(self.nrows)[rows]
+            start = index[0] if len(index) else 0
+            if rows.step in (None, 1):
+                table = table.slice(start, len(index))
+            else:
+                table = table.take(pa.array(index))
+        else:
+            index = np.asarray(rows, dtype='int64')
+            table = table.take(pa.array(index))
+        df = table.to_pandas()
+        df.index = index
+        return df
+
+    def remove(self):
+        return
+
+class MemMapTableModel(TableModel):
+    """A table model that leaves its data on disk and reads only
+       the rows the table asks for. Cell edits are kept in memory.
+       Operations that need the whole dataframe will load it via the
+       df attribute, after which the model behaves as a normal one."""
+
+    def __init__(self, store, temporary=False):
+        """temporary stores are deleted when the model is closed"""
+
+        self.initialiseFields()
+        self.store = store
+        self.temporary = temporary
+        self._df = None
+        self.order = None
+        self.edits = {}
+        self.rowindex = None
+        self.filtered = False
+        self.unfilteredorder = None
+        return
+
+    @classmethod
+    def fromCSV(cls, filename, path=None, chunksize=100000, **kwargs):
+        """Stream a csv file into a new store"""
+
+        temporary = path is None
+        if temporary:
+            path = cls.makeTempPath()
+        store = NumpyStore(path)
+        for chunk in pd.read_csv(filename, chunksize=chunksize, **kwargs):
+            store.append(chunk)
+        return cls(store, temporary)
+
+    @classmethod
+    def fromDataFrame(cls, df, path=None):
+        """Write a dataframe to disk and return a model using it"""
+
+        if path is not None and os.path.splitext(path)[1] in ['.arrow','.feather']:
+            return cls(ArrowStore.write(df, path))
+        temporary = path is None
+        if temporary:
+            path = cls.makeTempPath()
+        store = NumpyStore(path)
+        store.append(df)
+        return cls(store, temporary)
+
+    @staticmethod
+    def makeTempPath():
+        """A folder for a store that only lasts while it is used, removed
+           at exit if the model was never closed"""
+
+        path = tempfile.mkdtemp(prefix='pandastable')
+        atexit.register(shutil.rmtree, path, True)
+        return path
+
+    def close(self):
+        """Delete the store files if they were made for this model"""
+
+        if self.temporary == True:
+            self.store.remove()
+            self.temporary = False
+        return
+
+    @classmethod
+    def open(cls, path):
+        """Open an existing store folder or arrow file"""
+
+        if os.path.isdir(path):
+            return cls(NumpyStore(path))
+        return cls(ArrowStore(path))
+
+    def _getdf(self):
+        if self._df is None:
+            self._df = self.getDataBlock(slice(None), None)
+            self.colorder = None
+        return TableModel._getdf(self)
+
+    def inMemory(self):
+        """Whether the data has been loaded"""
+        return self._df is not None
+
+    def getPhysicalRows(self, rows):
+        """Map display row positions to stored rows"""
+
+        if self.order is None:
+            return rows
+        return self.order[rows]
+
+    def getDataBlock(self, rows, cols):
+        """Get a block of data for the given row and column positions"""
+
+        if self.inMemory():
+            return TableModel.getDataBlock(self, rows, cols)
+        if cols is None:
+            cols = slice(None)
+        if isinstance(cols, slice):
+            cols = list(range(len(self.store.columns)))[cols]
+        cols = list(self.getPhysicalColumns(cols))
+        return self.readBlock(self.getPhysicalRows(rows), cols)
+
+    def readBlock(self, rows, cols):
+        """Read stored row and column positions, applying any edits"""
+
+        block = self.store.take(rows, cols)
+        for name in block.columns:
+            if name not in self.edits:
+                continue
+            e = self.edits[name]
+            mask = np.isin(block.index.values, list(e.keys()))
+            if not mask.any():
+                continue
+            values = [e[r] for r in block.index.values[mask]]
+            block[name] = putValues(block[name], mask, values)
+        return block
+
+    def appendData(self, df, flush=True):
+        """Append rows, written to the store if not loaded"""
+
+        if self.inMemory():
+            return TableModel.appendData(self, df, flush)
+        n = self.store.nrows
+        try:
+            self.store.append(df)
+        except (ValueError, TypeError):
+            #rows the store can't hold, load the data instead
+            self.df
+            return TableModel.appendData(self, df, flush)
+        self.rowindex = None
+        if self.order is not None:
+            self.order = np.concatenate([self.order, np.arange(n, self.store.nrows)])
+        return
+
+    def getColumn(self, colname):
+        """Read a single column"""
+
+        if self.inMemory():
+            return TableModel.getColumn(self, colname)
+        i = self.store.columns.index(colname)
+        return self.readBlock(self.getPhysicalRows(slice(None)), [i]).iloc[:,0]
+
+    def iterChunks(self, chunksize=100000, cols=None):
+        """Iterate over the rows in chunks, for streaming operations"""
+
+        for start in range(0, self.getRowCount(), chunksize):
+            yield self.getDataBlock(slice(start, start+chunksize), cols)
+
+    def setFilter(self, where=None):
+        """Only show rows matching a query such as a > 1, None for all.
+           The query is run on chunks of just the columns it uses and the
+           matching rows are kept as the row order"""
+
+        if self.inMemory():
+            raise ValueError('data is loaded, filter the dataframe instead')
+        if self.filtered == True:
+            self.order = self.unfilteredorder
+            self.filtered = False
+        if where is not None:
+            labels = list(self.getColumnLabels())
+            names = getReferences(where, [c for c in labels if isinstance(c, str)])
+            if len(names) == 0:
+                raise ValueError('the query uses none of the columns')
+            cols = [labels.index(c) for c in names]
+            masks = []
+            try:
+                for chunk in self.iterChunks(cols=cols):
+                    masks.append(filtering.evaluateQuery(chunk, where))
+            except Exception as e:
+                raise ValueError('could not filter: %s' %e)
+            mask = np.concatenate(masks) if len(masks) > 0 else np.zeros(0, dtype=bool)
+            rows = np.arange(self.store.nrows) if self.order is None else self.order
+            self.unfilteredorder = self.order
+            self.order = rows[mask]
+            self.filtered = True
+        self.rowindex = None
+        self.columnChanged()
+        return
+
+    def transpose(self):
+        """Transposing needs the data in memory"""
+
+        self.df
+        return TableModel.transpose(self)
+
+    def getRowCount(self):
+        if self.inMemory():
+            return len(self._df)
+        if self.order is not None:
+            return len(self.order)
+        return self.store.nrows
+
+    def getColumnCount(self):
+        if self.inMemory():
+            return len(self._df.columns)
+        return len(self.store.columns)
+
+    def getColumnName(self, columnIndex):
+        return str(self.getColumnLabels()[columnIndex])
+
+    def getColumnLabels(self):
+        if self.inMemory():
+            return TableModel.getColumnLabels(self)
+        labels = pd.Index(self.store.columns)
+        if self.colorder is None:
+            return labels
+        return labels[self.colorder]
+
+    def getColumnType(self, columnIndex):
+        if self.inMemory():
+            return TableModel.getColumnType(self, columnIndex)
+        return self.store.getDtype(self.getPhysicalColumns(columnIndex))
+
+    def getIndex(self):
+        if self.inMemory():
+            return self._df.index
+        #kept so the label lookup is only rebuilt when the order changes
+        if self.rowindex is None:
+            if self.order is None:
+                self.rowindex = pd.RangeIndex(self.store.nrows)
+            else:
+                self.rowindex = pd.Index(self.order)
+        return self.rowindex
+
+    def getIndexVersion(self):
+        if self.inMemory():
+            return TableModel.getIndexVersion(self)
+        return self.checkVersion('index', [self.getIndex()])
+
+    def getColumnSetVersion(self):
+        if self.inMemory():
+            return TableModel.getColumnSetVersion(self)
+        return self.checkVersion('columns', [self.colorder])
+
+    def sort(self, colindex=None, ascending=True, index=False):
+        """Sort by reading only the key columns. Sets a row order
+           rather than moving the data"""
+
+        if self.inMemory():
+            return TableModel.sort(self, colindex, ascending, index)
+        self.rowindex = None
+        if index == True:
+            #a filter keeps its rows
+            self.order = np.sort(self.order) if self.filtered else None
+            return
+        keys = self.getDataBlock(slice(None), colindex)
+        keys = keys.sort_values(by=list(keys.columns), ascending=ascending,
+                                kind='mergesort')
+        self.order = keys.index.values
+        return
+
+    def getValueAt(self, rowindex, colindex):
+        if self.inMemory():
+            return TableModel.getValueAt(self, rowindex, colindex)
+        value = self.getDataBlock([rowindex], [colindex]).iloc[0,0]
+        if isinstance(value, (float, np.floating)) and np.isnan(value):
+            return ''
+        return value
+
+    def setValueAt(self, value, rowindex, colindex):
+        """Store an edit for the cell"""
+
+        if self.inMemory():
+            return TableModel.setValueAt(self, value, rowindex, colindex)
+        colindex = self.getPhysicalColumns(colindex)
+        name = self.store.columns[colindex]
+        kind = self.store.getDtype(colindex).kind
+        if value == '':
+            value = pd.NaT if kind == 'M' else np.nan
+        else:
+            try:
+                if kind == 'f':
+                    value = float(value)
+                elif kind in 'iu':
+                    value = int(value)
+                elif kind == 'M':
+                    value = pd.to_datetime(value)
+            except ValueError:
+                pass
+        row = self.getPhysicalRows([rowindex])[0]
+        self.edits.setdefault(name, {})[row] = value
+        self.columnChanged([name])
+        return
+
+    def getlongestEntry(self, colindex, n=1000):
+        """Longest entry from the first n rows"""
+
+        if self.inMemory():
+            return TableModel.getlongestEntry(self, colindex)
+        c = self.getDataBlock(slice(0, n), [colindex]).iloc[:,0]
+        if c.dtype.kind == 'f':
+            c = c.round(3)
+        longest = c.astype('object').astype('str').str.len().max()
+        if np.isnan(longest):
+            return 1
+        return longest
+
+    def save(self, filename):
+        """Save, csv files are written in chunks"""
+
+        ftype = os.path.splitext(filename)[1]
+        if self.inMemory() or ftype != '.csv':
+            return TableModel.save(self, filename)
+        header = True
+        with open(filename, 'w') as f:
+            for chunk in self.iterChunks():
+                chunk.to_csv(f, header=header, index=False)
+                header = False
+        return
+
+    def __repr__(self):
+        return 'Table Model with %s rows on disk' %self.getRowCount()
+
+def putValues(s, mask, values):
+    """Series with values put at the masked rows. It keeps its dtype, or
+       one that holds both, and only becomes object if values need it"""
+
+    new = pd.Series(values, dtype=object).infer_objects()
+    if new.isnull().all() and isinstance(s.dtype, np.dtype):
+        #missing values have no type of their own
+        new = new.astype(s.dtype if s.dtype.kind in 'mM' else 'float64')
+    dtype = np.dtype('O')
+    if isinstance(s.dtype, np.dtype) and s.dtype != dtype and new.dtype != dtype:
+        try:
+            dtype = np.result_type(s.dtype, new.dtype)
+        except TypeError:
+            pass
+    out = s.values.astype(dtype)
+    if dtype == np.dtype('O'):
+        out[mask] = values
+    else:
+        out[mask] = new.values.astype(dtype)
+    return pd.Series(out, index=s.index, name=s.name)
+
+def quoteName(name):
+    """Quote a SQL identifier"""
+    return '"%s"' %str(name).replace('"', '""')
+
+def checkWhere(where):
+    """Refuse the pandas query operators &, | and ~ in a SQL where
+       clause, where they are bitwise operators and would silently
+       select other rows"""
+
+    s = re.sub(r"'[^']*'|\"[^\"]*\"", '', where)
+    if re.search(r'&|~|(?<!\|)\|(?!\|)', s):
+        raise ValueError('the filter is SQL, use AND, OR and NOT instead of &, | and ~')
+    return
+
+class SQLiteTableModel(TableModel):
+    """A table model reading from a SQLite table or query. Only the pages
+       of rows being shown are fetched. For tables a page is found from
+       the sort key of a nearby page (keyset pagination) rather than by
+       skipping all rows before it. Sorting and filtering are done by
+       the database. Edits are kept in memory, the df attribute loads
+       every row after which the model behaves as a normal one."""
+
+    pagesize = 1000
+    maxpages = 50
+
+    def __init__(self, filename, table=None, query=None):
+        self.initialiseFields()
+        self.filename = filename
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        if table is not None:
+            self.source = quoteName(table)
+        else:
+            self.source = '(%s)' %query
+        #only tables have a rowid to make sort keys unique
+        self.keyed = self.usekeys = table is not None
+        cur = self.conn.execute('SELECT * FROM %s LIMIT 0' %self.source)
+        self.columns = [d[0] for d in cur.description]
+        self._df = None
+        self.where = None
+        self.params = ()
+        self.orderby = []
+        self.ascending = True
+        self.edits = {}
+        self.reset()
+        return
+
+    @classmethod
+    def getTables(cls, filename):
+        """Names of the tables in a database file"""
+
+        conn = sqlite3.connect(filename)
+        cur = conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        names = [r[0] for r in cur.fetchall()]
+        conn.close()
+        return names
+
+    def reset(self):
+        """Clear fetched pages after the order or filter changed"""
+
+        self.pages = OrderedDict()
+        self.anchors = {0: None}
+        self.nrows = None
+        self.rowindex = None
+        return
+
+    def _getdf(self):
+        if self._df is None:
+            self._df = self.getDataBlock(slice(None), None)
+            self.colorder = None
+        return TableModel._getdf(self)
+
+    def inMemory(self):
+        """Whether the data has been loaded"""
+        return self._df is not None
+
+    def getKeyColumns(self):
+        keys = [quoteName(c) for c in self.orderby]
+        if self.keyed:
+            keys.append('_rowid_')
+        return keys
+
+    def getSQL(self, exprs, anchor=None, limit=None, offset=0, order=True):
+        """Build a select of the given expressions starting at a sort
+           key, with the filter and order applied"""
+
+        sql = 'SELECT %s FROM %s' %(', '.join(exprs), self.source)
+        keys = self.getKeyColumns()
+        where = []
+        params = []
+        if self.where is not None:
+            where.append('(%s)' %self.where)
+            params.extend(self.params)
+        if anchor is not None:
+            op = '>=' if self.ascending else '<='
+            where.append('(%s) %s (%s)' %(', '.join(keys), op,
+                                          ', '.join(['?']*len(keys))))
+            params.extend(anchor)
+        if len(where) > 0:
+            sql += ' WHERE ' + ' AND '.join(where)
+        if order and len(keys) > 0:
+            desc = '' if self.ascending else ' DESC'
+            sql += ' ORDER BY ' + ', '.join(k+desc for k in keys)
+        if limit is not None:
+            sql += ' LIMIT %d OFFSET %d' %(limit, offset)
+        return sql, params
+
+    def getAnchor(self, page):
+        """Sort key of the first row of a page, found by counting on from
+           the nearest page before it whose key is known. False if the
+           page can only be reached with an offset from the start"""
+
+        if page in self.anchors:
+            return self.anchors[page]
+        if not self.usekeys:
+            return False
+        known = max(p for p in self.anchors if p < page and self.anchors[p] is not False)
+        sql, params = self.getSQL(self.getKeyColumns(), self.anchors[known],
+                                  1, (page-known)*self.pagesize)
+        row = self.conn.execute(sql, params).fetchone()
+        self.anchors[page] = self.makeAnchor(row)
+        return self.anchors[page]
+
+    def makeAnchor(self, values):
+        if values is None:
+            return False
+        values = tuple(v.item() if hasattr(v, 'item') else v for v in values)
+        if any(pd.isnull(v) for v in values):
+            #null keys can't be compared
+            return False
+        return values
+
+    def getRowsSQL(self, exprs, start, n):
+        """Select n rows from a position, starting from the key of the
+           page holding it where known"""
+
+        page = start // self.pagesize
+        anchor = self.getAnchor(page)
+        if anchor is False:
+            return self.getSQL(exprs, None, n, start)
+        return self.getSQL(exprs, anchor, n, start-page*self.pagesize)
+
+    def fetchRows(self, start, n, cols):
+        """Read n rows from a position for the given column names, the
+           result is indexed by row position"""
+
+        exprs = [quoteName(c) for c in cols]
+        if self.keyed:
+            exprs = ['_rowid_'] + exprs
+        sql, params = self.getRowsSQL(exprs, start, n)
+        rows = self.conn.execute(sql, params).fetchall()
+        names = ['_rowid_']*self.keyed + list(cols)
+        df = pd.DataFrame.from_records(rows, columns=names)
+        df.index = pd.RangeIndex(start, start+len(df))
+        nextpage = start // self.pagesize + 1
+        if self.usekeys and nextpage not in self.anchors and \
+                set(self.orderby) <= set(cols) and len(df) > nextpage*self.pagesize-start:
+            #remember the next page key while we have it
+            key = df.iloc[nextpage*self.pagesize-start]
+            self.anchors[nextpage] = self.makeAnchor([key[c] for c in self.orderby]
+                                                     + [key['_rowid_']])
+        return self.applyEdits(df)
+
+    def applyEdits(self, df):
+        if self.keyed:
+            for name in df.columns:
+                if name not in self.edits:
+                    continue
+                e = self.edits[name]
+                mask = df['_rowid_'].isin(list(e.keys())).values
+                if not mask.any():
+                    continue
+                s = df[name].astype('O')
+                s[mask] = [e[r] for r in df['_rowid_'].values[mask]]
+                df[name] = s
+            del df['_rowid_']
+        return df
+
+    def getPage(self, page):
+        """A page of rows, kept for reuse while it is recently used"""
+
+        if page in self.pages:
+            self.pages.move_to_end(page)
+            return self.pages[page]
+        block = self.fetchRows(page*self.pagesize, self.pagesize, self.columns)
+        self.pages[page] = block
+        if len(self.pages) > self.maxpages:
+            self.pages.popitem(last=False)
+        return block
+
+    def getDataBlock(self, rows, cols):
+        """Fetch a block for the given row and column positions. Nearby
+           rows come from cached pages, long ranges are read in one query
+           for just the columns asked for"""
+
+        if self.inMemory():
+            return TableModel.getDataBlock(self, rows, cols)
+        if cols is None:
+            cols = slice(None)
+        if isinstance(cols, slice):
+            cols = list(range(len(self.columns)))[cols]
+        names = [self.columns[i] for i in self.getPhysicalColumns(cols)]
+        if isinstance(rows, slice):
+            positions = np.arange(self.getRowCount())[rows]
+        else:
+            positions = np.asarray(rows, dtype=int)
+        if len(positions) == 0:
+            return self.getPage(0)[names].iloc[:0]
+        pages = np.unique(positions // self.pagesize)
+        if len(pages) <= 4:
+            block = pd.concat([self.getPage(p) for p in pages])
+        else:
+            lo, hi = positions.min(), positions.max()+1
+            block = self.fetchRows(lo, hi-lo, list(OrderedDict.fromkeys(names)))
+        block = block.loc[positions]
+        return block.iloc[:, [block.columns.get_loc(n) for n in names]]
+
+    def getColumn(self, colname):
+        if self.inMemory():
+            return TableModel.getColumn(self, colname)
+        return self.fetchRows(0, self.getRowCount(), [colname])[colname]
+
+    def setFilter(self, where=None, params=()):
+        """Only show rows matching a SQL where clause, None for all. A
+           clause the database can't run raises ValueError and leaves the
+           previous filter in place"""
+
+        if self.inMemory():
+            raise ValueError('data is loaded, filter the dataframe instead')
+        if where is not None:
+            checkWhere(where)
+        last = (self.where, self.params)
+        self.where = where
+        self.params = params
+        self.reset()
+        try:
+            self.getRowCount()
+        except sqlite3.Error as e:
+            self.where, self.params = last
+            self.reset()
+            raise ValueError('could not filter: %s' %e)
+        self.columnChanged()
+        return
+
+    def close(self):
+        """Close the database connection"""
+
+        self.conn.close()
+        return
+
+    def iterChunks(self, chunksize=100000, cols=None):
+        """Iterate over the rows in chunks, for streaming operations"""
+
+        for start in range(0, self.getRowCount(), chunksize):
+            yield self.getDataBlock(slice(start, start+chunksize), cols)
+
+    def transpose(self):
+        """Transposing needs the data in memory"""
+
+        self.df
+        return TableModel.transpose(self)
+
+    def getRowCount(self):
+        if self.inMemory():
+            return TableModel.getRowCount(self)
+        if self.nrows is None:
+            sql, params = self.getSQL(['COUNT(*)'], order=False)
+            self.nrows = self.conn.execute(sql, params).fetchone()[0]
+        return self.nrows
+
+    def getColumnCount(self):
+        if self.inMemory():
+            return TableModel.getColumnCount(self)
+        return len(self.columns)
+
+    def getColumnName(self, columnIndex):
+        return str(self.getColumnLabels()[columnIndex])
+
+    def getColumnLabels(self):
+        if self.inMemory():
+            return TableModel.getColumnLabels(self)
+        labels = pd.Index(self.columns)
+        if self.colorder is None:
+            return labels
+        return labels[self.colorder]
+
+    def getColumnType(self, columnIndex):
+        if self.inMemory():
+            return TableModel.getColumnType(self, columnIndex)
+        return self.getDataBlock(slice(0, 1), [columnIndex]).dtypes.iloc[0]
+
+    def getIndex(self):
+        if self.inMemory():
+            return self._df.index
+        if self.rowindex is None:
+            self.rowindex = pd.RangeIndex(self.getRowCount())
+        return self.rowindex
+
+    def getIndexVersion(self):
+        if self.inMemory():
+            return TableModel.getIndexVersion(self)
+        return self.checkVersion('index', [self.getIndex()])
+
+    def getColumnSetVersion(self):
+        if self.inMemory():
+            return TableModel.getColumnSetVersion(self)
+        return self.checkVersion('columns', [self.colorder])
+
+    def sort(self, colindex=None, ascending=True, index=False):
+        """Sort using an ORDER BY on the database"""
+
+        if self.inMemory():
+            return TableModel.sort(self, colindex, ascending, index)
+        if index == True:
+            self.orderby = []
+        else:
+            cols = np.atleast_1d(self.getPhysicalColumns(colindex))
+            self.orderby = [self.columns[i] for i in cols]
+        self.ascending = ascending
+        #null sort keys don't compare, so use offsets if there are any
+        self.usekeys = self.keyed
+        if self.keyed and len(self.orderby) > 0:
+            cond = ' OR '.join('%s IS NULL' %quoteName(c) for c in self.orderby)
+            sql = 'SELECT 1 FROM %s WHERE %s LIMIT 1' %(self.source, cond)
+            self.usekeys = self.conn.execute(sql).fetchone() is None
+        self.reset()
+        return
+
+    def getValueAt(self, rowindex, colindex):
+        if self.inMemory():
+            return TableModel.getValueAt(self, rowindex, colindex)
+        value = self.getDataBlock([rowindex], [colindex]).iloc[0,0]
+        if value is None or (isinstance(value, (float, np.floating)) and np.isnan(value)):
+            return ''
+        return value
+
+    def setValueAt(self, value, rowindex, colindex):
+        """Store an edit for the cell, the database is not changed.
+           Rows of a query have no id so editing them loads the data"""
+
+        if self.inMemory() or not self.keyed:
+            self.df
+            return TableModel.setValueAt(self, value, rowindex, colindex)
+        name = self.columns[self.getPhysicalColumns(colindex)]
+        kind = self.getColumnType(colindex).kind
+        if value == '':
+            value = np.nan
+        else:
+            try:
+                if kind == 'f':
+                    value = float(value)
+                elif kind in 'iu':
+                    value = int(value)
+            except ValueError:
+                pass
+        sql, params = self.getRowsSQL(['_rowid_'], rowindex, 1)
+        rowid = self.conn.execute(sql, params).fetchone()[0]
+        self.edits.setdefault(name, {})[rowid] = value
+        self.pages = OrderedDict()
+        self.columnChanged([name])
+        return
+
+    def getlongestEntry(self, colindex, n=1000):
+        """Longest entry from the first n rows"""
+
+        if self.inMemory():
+            return TableModel.getlongestEntry(self, colindex)
+        c = self.getDataBlock(slice(0, min(n, self.getRowCount())), [colindex]).iloc[:,0]
+        if c.dtype.kind == 'f':
+            c = c.round(3)
+        longest = c.astype('object').astype('str').str.len().max()
+        if longest is None or np.isnan(longest):
+            return 1
+        return longest
+
+    def save(self, filename):
+        """Save, csv files are written in chunks"""
+
+        ftype = os.path.splitext(filename)[1]
+        if self.inMemory() or ftype != '.csv':
+            return TableModel.save(self, filename)
+        header = True
+        with open(filename, 'w') as f:
+            for chunk in self.iterChunks():
+                chunk.to_csv(f, header=header, index=False)
+                header = False
+        return
+
+    def __repr__(self):
+        return 'Table Model with %s rows in %s' %(self.getRowCount(), self.filename)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""
+    Chained string operations on table columns.
+
+    Created Oct 2016
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+from __future__ import absolute_import, division, print_function
+import ast
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow
+except:
+    pyarrow = None
+
+#operations and the .str method used, with default arguments
+operations = {'strip': ('strip', ()), 'lstrip': ('lstrip', ()),
+              'rstrip': ('rstrip', ()), 'lower': ('lower', ()),
+              'upper': ('upper', ()), 'title': ('title', ()),
+              'capitalize': ('capitalize', ()), 'swapcase': ('swapcase', ()),
+              'len': ('len', ()), 'slice': ('slice', (0, 1)),
+              'replace': ('replace', ('', '')), 'split': ('split', (', ',)),
+              'extract': ('extract', ('(.*)',)), 'pad': ('pad', (10,)),
+              'zfill': ('zfill', (10,)), 'center': ('center', (10,)),
+              'get': ('get', (0,)), 'repeat': ('repeat', (2,))}
+#operations that give several columns, only allowed at the end
+expanding = ['split', 'extract']
+
+def parseSteps(text):
+    """Convert a pipeline such as strip | lower | replace('-', '_') to a
+       list of (operation, args) steps"""
+
+    steps = []
+    for part in text.split('|'):
+        part = part.strip()
+        if part == '':
+            continue
+        try:
+            node = ast.parse(part, mode='eval').body
+        except SyntaxError:
+            raise ValueError('could not read step %s' %part)
+        if isinstance(node, ast.Name):
+            name, args = node.id, None
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            name = node.func.id
+            try:
+                args = tuple(ast.literal_eval(a) for a in node.args)
+            except ValueError:
+                raise ValueError('arguments of %s must be values' %name)
+        else:
+            raise ValueError('could not read step %s' %part)
+        steps.append(makeStep(name, args))
+    return steps
+
+def makeStep(name, args=None):
+    if name not in operations:
+        raise ValueError('unknown string operation %s' %name)
+    if args is None:
+        args = operations[name][1]
+    return (name, tuple(args))
+
+class StringPipeline(object):
+    """A list of string operations run one after another with the
+       vectorized .str methods, on arrow strings if pyarrow is installed.
+       A column with many repeated values is transformed through its
+       distinct values only. Results after each step can be kept in a
+       StringCache so changing the end of a pipeline does not redo the
+       start."""
+
+    def __init__(self, steps, usearrow=True):
+        for i, (name, args) in enumerate(steps):
+            if name in expanding and i < len(steps)-1:
+                raise ValueError('%s must be the last step' %name)
+        self.steps = [tuple(s) for s in steps]
+        self.usearrow = usearrow and pyarrow is not None
+        return
+
+    def expands(self):
+        return len(self.steps) > 0 and self.steps[-1][0] in expanding
+
+    def runStep(self, x, step):
+        name, args = step
+        method = operations[name][0]
+        if name == 'split':
+            return x.str.split(*args, expand=True)
+        if name == 'extract':
+            return x.str.extract(*args, expand=True)
+        if name == 'replace':
+            return x.str.replace(*args, regex=True)
+        return getattr(x.str, method)(*args)
+
+    def toArrow(self, s):
+        if self.usearrow and s.dtype == object:
+            try:
+                return s.astype('string[pyarrow]')
+            except (TypeError, ValueError, pyarrow.lib.ArrowException):
+                return s
+        return s
+
+    def fromArrow(self, x):
+        """Back to object or numpy types so the table behaves as before"""
+
+        if isinstance(x, pd.DataFrame):
+            return x.apply(self.fromArrow)
+        dtype = x.dtype
+        if isinstance(dtype, pd.StringDtype):
+            return x.astype(object).where(x.notna(), np.nan)
+        if isinstance(dtype, pd.api.extensions.ExtensionDtype) and dtype.kind in 'iub':
+            if x.isna().any():
+                return x.astype(float)
+            return x.astype(dtype.numpy_dtype)
+        return x
+
+    def apply(self, s, key=None, cache=None, uniqueratio=0.5):
+        """Transform a series. When most values repeat the steps only
+           run on the distinct values. key identifies the column data,
+           such as its name and version, for keeping the result of each
+           step in cache"""
+
+        start, entry = 0, None
+        if cache is not None and key is not None:
+            start, entry = cache.find(key, self.steps)
+        if entry is None:
+            x = self.toArrow(s)
+            codes, uniques = pd.factorize(x)
+            if len(uniques) <= len(s)*uniqueratio:
+                values = pd.Series(uniques)
+            else:
+                codes = None
+                values = x.reset_index(drop=True)
+        else:
+            codes, values = entry
+        for i in range(start, len(self.steps)):
+            values = self.runStep(values, self.steps[i])
+            if cache is not None and key is not None:
+                cache.add(key, self.steps[:i+1], (codes, values))
+        if codes is None:
+            x = values.copy(deep=False)
+        else:
+            #back to all rows, missing values have code -1
+            x = values.reindex(codes)
+        x.index = s.index
+        return self.fromArrow(x)
+
+    def preview(self, s, n=20, seed=1):
+        """Original and transformed values for a sample of rows"""
+
+        if len(s) > n:
+            s = s.sample(n, random_state=seed).sort_index()
+        x = self.apply(s, uniqueratio=0)
+        if isinstance(x, pd.Series):
+            x = x.to_frame('result')
+        return pd.concat([s.rename('value'), x], axis=1)
+
+class StringCache(object):
+    """Results of the first steps of a pipeline, stored by column key"""
+
+    def __init__(self, size=10):
+        self.size = size
+        self.results = OrderedDict()
+        return
+
+    def add(self, key, steps, x):
+        self.results[(key, tuple(steps))] = x
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+        return
+
+    def find(self, key, steps):
+        """Longest cached start of steps, as (number of steps, result)"""
+
+        for i in range(len(steps), 0, -1):
+            k = (key, tuple(steps[:i]))
+            if k in self.results:
+                self.results.move_to_end(k)
+                return i, self.results[k]
+        return 0, None
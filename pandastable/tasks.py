@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+"""
+    Running long table operations away from the Tk thread.
+
+    Created Oct 2016
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+from __future__ import absolute_import, division, print_function
+import threading
+import multiprocessing
+from collections import OrderedDict
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import numpy as np
+import pandas as pd
+from . import util, joins
+
+class TaskCancelled(Exception):
+    """Raised inside a task when it has been cancelled"""
+    pass
+
+class TaskState(object):
+    """Given to a task function so it can report progress and see if
+       it was cancelled. Chunked operations call setProgress after each
+       chunk and check, which raises TaskCancelled once cancelled."""
+
+    def __init__(self, q=None, stop=None):
+        self.q = q
+        self.stop = stop
+        return
+
+    def setProgress(self, fraction, message=None):
+        if self.q is not None:
+            self.q.put(('progress', fraction, message))
+        return
+
+    def cancelled(self):
+        return self.stop is not None and self.stop.is_set()
+
+    def check(self):
+        if self.cancelled():
+            raise TaskCancelled()
+        return
+
+def runTask(func, args, state, q):
+    """Call func(state, *args) and put the outcome on q"""
+
+    try:
+        result = func(state, *args)
+        q.put(('done', result, None))
+    except TaskCancelled:
+        q.put(('cancelled', None, None))
+    except Exception as e:
+        q.put(('error', None, e))
+    return
+
+class Task(object):
+    """A function run on a worker thread, or a process if process is
+       True, on data the caller no longer changes. The caller polls the
+       task from its own loop for progress and the result. Functions
+       run in a process must be module level so they can be pickled."""
+
+    def __init__(self, func, args=(), process=False):
+        self.func = func
+        self.args = tuple(args)
+        self.process = process
+        self.status = None
+        self.result = None
+        self.error = None
+        self.progress = None
+        self.message = None
+        self.worker = None
+        return
+
+    def start(self):
+        if self.process == True:
+            self.q = multiprocessing.Queue()
+            self.stop = multiprocessing.Event()
+            w = multiprocessing.Process
+        else:
+            self.q = queue.Queue()
+            self.stop = threading.Event()
+            w = threading.Thread
+        state = TaskState(self.q, self.stop)
+        self.worker = w(target=runTask, args=(self.func, self.args, state, self.q))
+        self.worker.daemon = True
+        self.status = 'running'
+        self.worker.start()
+        return
+
+    def run(self):
+        """Run here and return the result, for small data"""
+
+        self.status = 'running'
+        self.result = self.func(TaskState(), *self.args)
+        self.status = 'done'
+        return self.result
+
+    def cancel(self):
+        """Ask the task to stop. A process is ended straight away, a
+           thread stops at its next check and its result is dropped"""
+
+        if self.status != 'running':
+            return
+        self.stop.set()
+        if self.process == True:
+            self.worker.terminate()
+        self.status = 'cancelled'
+        return
+
+    def poll(self):
+        """Read what the worker reported, True once it has finished"""
+
+        if self.status != 'running':
+            return True
+        while True:
+            try:
+                kind, value, extra = self.q.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                self.progress = value
+                self.message = extra
+            else:
+                self.status = kind
+                self.result = value
+                self.error = extra
+                return True
+        if self.process == True and not self.worker.is_alive() and self.q.empty():
+            self.status = 'error'
+            self.error = RuntimeError('task process ended without a result')
+            return True
+        return False
+
+    def wait(self, interval=0.05):
+        """Block until finished, returns the result"""
+
+        import time
+        while not self.poll():
+            time.sleep(interval)
+        if self.status == 'error':
+            raise self.error
+        return self.result
+
+def sortPositions(state, df, colnames, ascending=True, index=False):
+    """Row positions giving the sorted order"""
+
+    if index == True:
+        order = pd.Series(np.arange(len(df)), index=df.index)
+        return order.sort_index(ascending=ascending).values
+    order = df[colnames].reset_index(drop=True)
+    order = order.sort_values(by=colnames, ascending=ascending, kind='mergesort')
+    return order.index.values
+
+def convertNumeric(state, df):
+    """Numeric versions of the object columns that can be converted,
+       as a dict of column name to series"""
+
+    cols = [c for c in df.columns if df[c].dtype.kind == 'O'
+                and util.check_categorical(df[c]) != 1]
+    new = {}
+    for i, c in enumerate(cols):
+        state.check()
+        s = pd.to_numeric(df[c], errors='coerce')
+        if not s.isnull().all():
+            new[c] = s
+        state.setProgress((i+1)/len(cols), c)
+    return new
+
+def cleanData(state, df, method, symbol, limit, dropcols, droprows, how,
+              dropdups):
+    """Fill and drop missing data, see Table.cleanData"""
+
+    steps = [method != '', dropcols == 1, droprows == 1, dropdups == 1]
+    total = max(sum(steps), 1)
+    done = 0
+    if method == 'fill scalar':
+        df = df.fillna(symbol)
+    elif method == 'interpolate':
+        df = df.interpolate()
+    elif method != '':
+        df = df.fillna(method=method, limit=limit)
+    if method != '':
+        done += 1
+        state.setProgress(done/total, 'fill')
+    for do, name in zip(steps[1:], ['dropcols', 'droprows', 'dropdups']):
+        if not do:
+            continue
+        state.check()
+        if name == 'dropcols':
+            df = df.dropna(axis=1, how=how)
+        elif name == 'droprows':
+            df = df.dropna(axis=0, how=how)
+        else:
+            df = df.drop_duplicates()
+        done += 1
+        state.setProgress(done/total, name)
+    return df
+
+def corrMatrix(state, df, chunksize=20):
+    """Pairwise correlation of the numeric columns, a block of columns
+       at a time so progress can be shown"""
+
+    df = df.select_dtypes(include=[np.number, 'bool'])
+    cols = list(df.columns)
+    x = df.values.astype(float)
+    mask = ~np.isnan(x)
+    if mask.all():
+        #no missing data so one matrix product per block
+        x = x - x.mean(0)
+        norm = np.sqrt((x*x).sum(0))
+        out = np.empty((len(cols), len(cols)))
+        for start in range(0, len(cols), chunksize):
+            state.check()
+            part = x[:, start:start+chunksize]
+            out[start:start+chunksize] = part.T.dot(x)/np.outer(norm[start:start+chunksize], norm)
+            state.setProgress(min(start+chunksize, len(cols))/len(cols))
+        return pd.DataFrame(out, index=cols, columns=cols)
+    #pairwise complete observations, as pandas does
+    corr = df.corr()
+    state.setProgress(1)
+    return corr
+
+def pivotEstimate(nrows, nindex, ncolumns, nvalues):
+    """Predicted shape and size of a pivot table of nrows with nindex
+       distinct index values and ncolumns distinct column values. fill
+       is the most of the cells that can have a value"""
+
+    shape = (nindex, ncolumns*nvalues)
+    cells = shape[0]*shape[1]
+    fill = min(1.0, nrows/max(nindex*ncolumns, 1))
+    return {'shape': shape, 'bytes': cells*8 + nindex*8, 'fill': fill,
+            'sparsebytes': int(cells*fill)*12 + nindex*8}
+
+def meltEstimate(nrows, idsizes, nvalues, valuesize=8):
+    """Predicted shape and size of melting nvalues columns, idsizes are
+       the bytes per row of the id columns"""
+
+    rows = nrows*nvalues
+    return {'shape': (rows, len(idsizes)+2),
+            'bytes': rows*(sum(idsizes)+valuesize+1)}
+
+def estimateText(est):
+    text = '%s x %s, about %s' %(est['shape'][0], est['shape'][1],
+                                 util.formatBytes(est['bytes']))
+    if 'fill' in est and est['fill'] < 1:
+        text += ', at most %.0f%% filled' %(est['fill']*100)
+    return text
+
+def pivot(state, df, index, columns, values, method='dense', chunksize=1000000):
+    """Pivot table of the mean values. chunked aggregates partitions of
+       the rows and combines them, sparse does the same and makes sparse
+       columns one at a time so the dense table is never made"""
+
+    if method == 'dense':
+        p = pd.pivot_table(df, index=index, columns=columns, values=values)
+        if type(p) is pd.Series:
+            p = pd.DataFrame(p)
+        return p
+    if values is None:
+        vals = [c for c in df.select_dtypes(include=[np.number]).columns
+                if c not in [index, columns]]
+    elif isinstance(values, list):
+        vals = values
+    else:
+        vals = [values]
+    sums = None
+    counts = None
+    for start in range(0, len(df), chunksize):
+        state.check()
+        g = df.iloc[start:start+chunksize].groupby([index, columns])[vals]
+        s, c = g.sum(), g.count()
+        if sums is None:
+            sums, counts = s, c
+        else:
+            sums = sums.add(s, fill_value=0)
+            counts = counts.add(c, fill_value=0)
+        state.setProgress(min(start+chunksize, len(df))/len(df)*0.5, 'aggregating')
+    mean = sums/counts.where(counts > 0)
+    if method == 'chunked':
+        p = mean.unstack(columns)
+        if not isinstance(values, list) and values is not None:
+            p = p[values]
+        return p.dropna(axis=1, how='all')
+
+    rows = mean.index.get_level_values(0)
+    rowlabels = pd.Index(rows.unique()).sort_values()
+    rowcodes = rowlabels.get_indexer(rows)
+    colcodes, collabels = pd.factorize(mean.index.get_level_values(1), sort=True)
+    order = np.argsort(colcodes, kind='mergesort')
+    bounds = np.searchsorted(colcodes[order], np.arange(len(collabels)+1))
+    data = OrderedDict()
+    total = len(vals)*len(collabels)
+    for v in vals:
+        x = mean[v].values
+        for i, c in enumerate(collabels):
+            state.check()
+            pos = order[bounds[i]:bounds[i+1]]
+            pos = pos[pd.notnull(x[pos])]
+            if len(pos) == 0:
+                continue
+            dense = np.full(len(rowlabels), np.nan)
+            dense[rowcodes[pos]] = x[pos]
+            key = c if len(vals) == 1 and not isinstance(values, list) else (v, c)
+            data[key] = pd.arrays.SparseArray(dense)
+        state.setProgress(0.5+0.5*len(data)/max(total, 1), 'making columns')
+    p = pd.DataFrame(data, index=rowlabels)
+    if len(data) > 0 and isinstance(list(data.keys())[0], tuple):
+        p.columns = pd.MultiIndex.from_tuples(p.columns, names=[None, columns])
+    else:
+        p.columns.name = columns
+    return p
+
+def melt(state, df, idvars, valuevars, varname, valuename='value',
+         method='dense'):
+    """Unpivot value columns. chunked fills the preallocated result one
+       value column at a time, with the variable names as a categorical"""
+
+    if method == 'dense':
+        return pd.melt(df, id_vars=idvars, value_vars=valuevars,
+                       var_name=varname, value_name=valuename)
+    if idvars is None:
+        idvars = []
+    elif not isinstance(idvars, list):
+        idvars = [idvars]
+    if valuevars is None:
+        valuevars = [c for c in df.columns if c not in idvars]
+    elif not isinstance(valuevars, list):
+        valuevars = [valuevars]
+    n = len(df)
+    k = len(valuevars)
+    dtype = np.result_type(*[df[v].values for v in valuevars])
+    out = OrderedDict()
+    for c in idvars:
+        out[c] = np.tile(df[c].values, k)
+    values = np.empty(n*k, dtype=dtype)
+    for i, v in enumerate(valuevars):
+        state.check()
+        values[i*n:(i+1)*n] = df[v].values
+        state.setProgress((i+1)/k, v)
+    codes = np.repeat(np.arange(k, dtype=np.min_scalar_type(max(k-1, 0))), n)
+    out[varname] = pd.Categorical.from_codes(codes, categories=valuevars)
+    out[valuename] = values
+    return pd.DataFrame(out)
+
+def makeGrouping(state, df, keys):
+    from .filtering import Grouping
+    return Grouping(df, keys)
+
+def aggregate(state, df, grp, aggdict, grouping=None):
+    if grouping is None:
+        return df.groupby(grp).agg(aggdict)
+    return grouping.aggregate(df, aggdict)
+
+def planMerge(state, df1, df2, kwds, lindex=None, rindex=None):
+    """Plan of a merge with its result size, see joins.planJoin"""
+
+    return joins.planJoin(df1, df2, kwds.get('left_on'), kwds.get('right_on'),
+                          kwds.get('how') or 'inner', lindex, rindex)
+
+def combine(state, df1, df2, method, kwds, plan=None):
+    """Merge or concat two frames, see CombineDialog"""
+
+    kwds = dict(kwds)
+    if method == 'merge':
+        s = (kwds.pop('suffix1', '_1'), kwds.pop('suffix2', '_2'))
+        if plan is None:
+            plan = planMerge(state, df1, df2, kwds)
+        return joins.merge(df1, df2, kwds.get('left_on'), kwds.get('right_on'),
+                           kwds.get('how') or 'inner', s, plan)
+    return pd.concat([df1, df2], **kwds)
@@ -20,16 +20,18 @@
 """
 
 from __future__ import absolute_import, print_function
-import sys, os
+import sys, os, time
 try:
     from tkinter import *
     from tkinter.ttk import *
 except:
     from Tkinter import *
     from ttk import *
+import numpy as np
 import pandas as pd
 from .core import Table
-from .data import TableModel
+from .data import TableModel, ViewTableModel
+from . import util, filtering
 from .app import DataExplore
 import unittest
 import threading
@@ -136,6 +138,494 @@ class TableTests(unittest.TestCase):
     def quit(self):
         self.app.quit()
 
+class TableModelTests(unittest.TestCase):
+    """Tests for the table model that do not need a table widget"""
+
+    def testOptimizeMemory(self):
+        """Memory optimizer should not change any values"""
+
+        df = TableModel.getSampleData(rows=500)
+        df['i'] = range(500)
+        model = TableModel(df.copy())
+        report = model.optimizeMemory(sparse=True)
+        self.assertTrue(report.loc['total','after'] < report.loc['total','before'])
+        self.assertEqual(str(model.df['i'].dtype), 'int16')
+        self.assertEqual(str(model.df['label'].dtype), 'category')
+        self.assertTrue((model.df['i'] == df['i']).all())
+        return
+
+    def testRecordIndex(self):
+        """Label lookups should follow sorts and relabelling"""
+
+        df = TableModel.getSampleData(rows=100)
+        model = TableModel(df)
+        self.assertEqual(model.getRecordIndex(10), 10)
+        model.sort([0])
+        self.assertEqual(model.getRecName(model.getRecordIndex(10)), 10)
+        self.assertEqual(model.findRecord('10'), model.getRecordIndex(10))
+        model.df = df.set_index(['label', df.index])
+        key = model.getRecName(5)
+        self.assertEqual(model.getRecordIndex(key), 5)
+        self.assertEqual(model.findRecord('%s,%s' %key), 5)
+        model = TableModel(pd.DataFrame({'a':range(4)}, index=['x','y','x','z']))
+        self.assertEqual(model.getRowPositions(['z','x','q']), [3, 0])
+        return
+
+    def testColumnStats(self):
+        """Cached stats should follow cell edits"""
+
+        df = TableModel.getSampleData(rows=100)
+        model = TableModel(df)
+        st = model.getColumnStats('a')
+        self.assertEqual(st['count'], 100)
+        #entry lengths are only found when asked for
+        self.assertEqual(st['maxlen'], None)
+        self.assertEqual(model.getlongestEntry(0), df.a.round(3).astype(str).str.len().max())
+        model.setValueAt(1000, 0, 0)
+        st = model.getColumnStats('a')
+        self.assertEqual(st['max'], 1000)
+        self.assertAlmostEqual(st['mean'], model.df.a.mean())
+        model.setValueAt('', 1, 0)
+        self.assertEqual(model.getColumnStats('a')['nulls'], 1)
+        self.assertEqual(model.describe().loc['count','a'], 99)
+        self.assertAlmostEqual(model.describe().loc['50%','a'], model.df.a.median())
+        #std of large values keeps its precision through edits
+        model = TableModel(pd.DataFrame({'x':1e9+np.array([.1,.2,.3,.5]),
+                                         'y':['x','y','z','w']}))
+        model.getColumnStats('x')
+        model.setValueAt(1e9+.4, 3, 0)
+        self.assertAlmostEqual(model.getColumnStats('x')['std'], model.df.x.std(), 6)
+        model.getColumnStats('y')
+        model.setValueAt('y', 0, 1)
+        self.assertEqual(model.getColumnStats('y')['distinct'], 3)
+        return
+
+    def testMoveColumn(self):
+        """Moving a column should only change the displayed order"""
+
+        df = TableModel.getSampleData(rows=50)
+        model = TableModel(df)
+        model.moveColumn(0, 3)
+        self.assertEqual(model.getColumnName(3), 'a')
+        self.assertEqual(model.getValueAt(0, 3), df.a[0])
+        self.assertTrue(model.getDataBlock(0, slice(None)).index[3] == 'a')
+        self.assertEqual(list(model.df.columns)[:4], ['b','c','d','a'])
+        self.assertEqual(model.colorder, None)
+        return
+
+    def testTransposeView(self):
+        """Transposed model should swap axes without copying"""
+
+        df = TableModel.getSampleData(rows=20)
+        model = TableModel(df)
+        model.transpose()
+        self.assertEqual(model.getRowCount(), len(df.columns))
+        self.assertEqual(model.getValueAt(0, 5), df.iloc[5,0])
+        self.assertTrue(model._df is df)
+        model.transpose()
+        self.assertEqual(model.getValueAt(5, 0), df.iloc[5,0])
+        model.transpose()
+        self.assertEqual(model.df.shape, (len(df.columns), len(df)))
+        return
+
+    def testCopyOnWrite(self):
+        """Copied models should share data until one is edited"""
+
+        df = TableModel.getSampleData(rows=100)
+        model = TableModel(df)
+        new = model.copy()
+        self.assertTrue(new.memoryUsage().shared.all())
+        old = model.getValueAt(0, 0)
+        new.setValueAt(99, 0, 0)
+        self.assertEqual(model.getValueAt(0, 0), old)
+        self.assertEqual(new.getValueAt(0, 0), 99)
+        self.assertFalse(new.memoryUsage().shared['a'])
+        return
+
+    def testMemMapModel(self):
+        """On disk model should give the same blocks as the dataframe"""
+
+        from .storage import MemMapTableModel
+        df = TableModel.getSampleData(rows=500)
+        model = MemMapTableModel.fromDataFrame(df)
+        block = model.getDataBlock([1,20,499], [0,4])
+        self.assertTrue((block.values == df.iloc[[1,20,499],[0,4]].values).all())
+        model.sort([0])
+        self.assertEqual(model.getValueAt(0,0), df.iloc[:,0].min())
+        model.setValueAt('1.5', 0, 1)
+        self.assertEqual(model.getDataBlock([0], [1]).dtypes.iloc[0].kind, 'f')
+        #filters are run in chunks and kept as the row order
+        model.setFilter('a > 0')
+        self.assertEqual(model.getRowCount(), (df.a > 0).sum())
+        model.setFilter(None)
+        self.assertEqual(model.getRowCount(), 500)
+        self.assertEqual(model.df.iloc[0,1], 1.5)
+        #stores made for the model go when it is closed
+        model.close()
+        self.assertFalse(os.path.exists(model.store.path))
+        #appended chunks are joined once enough are waiting
+        model = TableModel(df.iloc[:100])
+        for i in range(100, 500, 50):
+            model.appendData(df.iloc[i:i+50], flush=False)
+        self.assertEqual(len(model.appended), 2)
+        self.assertEqual(model.getRowCount(), 400)
+        model.flushAppended()
+        self.assertTrue(model.df.equals(df))
+        return
+
+    def testVersions(self):
+        """Versions change only with the data they cover"""
+
+        model = TableModel(pd.DataFrame({'a':[3,1,2],'b':['1','2','x']}))
+        iv = model.getIndexVersion()
+        va = model.getColumnVersion('a')
+        vb = model.getColumnVersion('b')
+        model.setValueAt(5, 0, 0)
+        self.assertGreater(model.getColumnVersion('a'), va)
+        self.assertEqual(model.getColumnVersion('b'), vb)
+        self.assertEqual(model.getIndexVersion(), iv)
+        model.sort(0)
+        self.assertGreater(model.getIndexVersion(), iv)
+        model.convertNumeric()
+        self.assertGreater(model.getColumnVersion('b'), vb)
+        return
+
+    def testBatch(self):
+        """Changes in a batch reach listeners once, merged"""
+
+        model = TableModel(pd.DataFrame({'a':[1,2],'b':[3,4],'c':[5,6]}))
+        calls = []
+        model.addListener(calls.append)
+        with model.batch():
+            model.setValueAt(7, 0, 0)
+            with model.batch():
+                model.setValueAt(8, 1, 1)
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [set(['a','b'])])
+        with model.batch():
+            model.setValueAt(9, 0, 0)
+            model.columnChanged()
+        self.assertEqual(calls[-1], None)
+        model.setValueAt(1, 0, 2)
+        self.assertEqual(calls[-1], set(['c']))
+        return
+
+    def testBlankTable(self):
+        """Blank tables are sparse until filled"""
+
+        model = TableModel(rows=100, columns=3)
+        self.assertTrue(util.check_sparse(model.df['a']))
+        model.setValueAt('2', 0, 0)
+        model.setValueAt('x', 0, 1)
+        self.assertEqual(model.getValueAt(0, 0), 2.0)
+        self.assertEqual(model.getValueAt(0, 1), 'x')
+        for i in range(1, 60):
+            model.setValueAt(str(i), i, 0)
+        self.assertFalse(util.check_sparse(model.df['a']))
+        self.assertEqual(model.df['a'].dtype, 'float64')
+        return
+
+    def testViewModel(self):
+        """Child views read from the parent until edited"""
+
+        parent = TableModel(pd.DataFrame({'a':[1,2,3,4],'b':list('wxyz')}))
+        view = ViewTableModel(parent, rows=[(1,3)], columns=['b'])
+        self.assertEqual(view.getRowCount(), 2)
+        self.assertEqual(view.getValueAt(0, 0), 'x')
+        parent.setValueAt('q', 1, 1)
+        self.assertTrue(view.dirty)
+        self.assertEqual(view.getValueAt(0, 0), 'q')
+        view.setValueAt('r', 0, 0)
+        self.assertTrue(view.inMemory())
+        self.assertEqual(parent.getValueAt(1, 1), 'q')
+        #rows hidden by filtering the parent come back with it
+        view = ViewTableModel(parent)
+        self.assertEqual(view.getRowCount(), 4)
+        full = parent.df
+        parent.df = full[full.a > 2]
+        self.assertEqual(view.getRowCount(), 2)
+        parent.df = full
+        self.assertEqual(view.getRowCount(), 4)
+        return
+
+    def testSelectionSummary(self):
+        """Numeric summary of selected cells"""
+
+        model = TableModel(pd.DataFrame({'a':[1,2,3,4],'b':['1','x',None,'2.5']}))
+        arrays = model.getColumnArrays([1,2,3], [0,1])
+        self.assertEqual(len(arrays[0]), 3)
+        st = util.summarizeArrays(arrays)
+        self.assertEqual(st['count'], 4)
+        self.assertEqual(st['sum'], 11.5)
+        self.assertEqual(st['max'], 4)
+        return
+
+    def testSQLiteModel(self):
+        """Pages read from SQLite should match the dataframe"""
+
+        import sqlite3, tempfile
+        from .storage import SQLiteTableModel
+        df = TableModel.getSampleData(rows=2500).drop('date', axis=1)
+        filename = os.path.join(tempfile.mkdtemp(), 'test.db')
+        conn = sqlite3.connect(filename)
+        df.to_sql('data', conn, index=False)
+        conn.close()
+        model = SQLiteTableModel(filename, table='data')
+        model.pagesize = 100
+        self.assertEqual(model.getRowCount(), 2500)
+        block = model.getDataBlock([1,20,2499], [0,4])
+        self.assertTrue((block.values == df.iloc[[1,20,2499],[0,4]].values).all())
+        model.sort([0])
+        expected = df.sort_values('a', kind='mergesort')
+        block = model.getDataBlock(slice(1500,1510), [0])
+        self.assertTrue((block.values[:,0] == expected.a.values[1500:1510]).all())
+        model.setFilter('a > 5')
+        self.assertEqual(model.getRowCount(), (df.a > 5).sum())
+        #a bad clause keeps the last filter
+        self.assertRaises(ValueError, model.setFilter, 'nosuchcolumn > 1')
+        self.assertRaises(ValueError, model.setFilter, 'a > 5 & b < 3')
+        self.assertEqual(model.getRowCount(), (df.a > 5).sum())
+        model.setFilter("label = 'a|b' or a > 9")
+        return
+
+    def testFilterBy(self):
+        """Indexed filters should match pandas"""
+
+        df = TableModel.getSampleData(rows=1000)
+        model = TableModel(df)
+        filters = [('a', 5, '>'), ('label', 'red', '=', 'AND'),
+                   ('b', 4, '<', 'NOT')]
+        rows = model.filterby(filters)
+        expected = np.nonzero(((df.a>5) & (df.label=='red') & ~(df.b<4)).values)[0]
+        self.assertTrue((rows == expected).all())
+        model.setValueAt('red', 0, 5)
+        self.assertTrue(0 in model.filterby([('label', 'red', '=')]))
+        filters = filtering.parseQuery("a > 5 or label == 'blue'")
+        self.assertEqual(len(model.filterby(filters)), len(df.query("a > 5 or label == 'blue'")))
+        #missing values are kept by !=
+        m = TableModel(pd.DataFrame({'b':['x', None, 'y']}))
+        self.assertEqual(list(m.filterby([('b', 'x', '!=')])), [1, 2])
+        #comparisons keep pandas types, text is not equal to a number
+        m = TableModel(pd.DataFrame({'b':['1', '2', 'x']}))
+        self.assertEqual(len(m.filterby([('b', 1, '=')])), 0)
+        self.assertRaises(ValueError, m.filterby, [('b', 1, '>')])
+        #putting back the same frame keeps the indexes
+        ix = model.getColumnIndex('a')
+        full = model.df
+        model.df = full[full.a > 5]
+        model.df = full
+        self.assertTrue(model.getColumnIndex('a') is ix)
+        return
+
+    def testFormulaEngine(self):
+        """Formulae are recalculated downstream in order, cycles refused"""
+
+        from .formulae import FormulaEngine, FormulaCycleError
+        engine = FormulaEngine()
+        cols = ['a','b','x','y','z']
+        engine.add('z', 'y+1', engine.check('z', 'y+1', cols))
+        engine.add('y', 'x*2', engine.check('y', 'x*2', cols))
+        engine.add('x', 'a+b', engine.check('x', 'a+b', cols))
+        self.assertEqual(engine.getOrder(['a']), ['x','y','z'])
+        self.assertEqual(engine.getOrder(['y']), ['z'])
+        self.assertEqual(engine.getOrder(['z']), [])
+        self.assertRaises(FormulaCycleError, engine.check, 'x', 'z-1', cols)
+        self.assertEqual(engine.check('a', 'a*2', cols), [])
+        other = FormulaEngine()
+        other.setMeta(engine.getMeta())
+        self.assertEqual(other.getOrder(), ['x','y','z'])
+        return
+
+    def testEvaluator(self):
+        """Chunked evaluation gives the same result as one pass"""
+
+        from .formulae import Evaluator
+        df = TableModel.getSampleData(rows=1000)
+        ev = Evaluator(chunksize=300)
+        result = ev.evaluate(df, 'a*2+b')
+        self.assertTrue(np.allclose(result, df.a*2+df.b))
+        ev.evaluate(df, 'a*2+b')
+        self.assertEqual(len(ev.compiled), 1)
+        self.assertAlmostEqual(float(ev.evaluate(df, 'sum(a*b)')), (df.a*df.b).sum(), 6)
+        df['i'] = np.arange(1000, dtype='int32')
+        self.assertTrue((ev.evaluate(df, 'i+1') == df.i.values+1).all())
+        return
+
+    def testQueryCache(self):
+        """Cached and refined query masks should match pandas"""
+
+        df = TableModel.getSampleData(rows=1000)
+        cache = filtering.QueryCache()
+        for q in ["a > 5", "a>5 and b < 4", "(a > 5) & (b < 4) & (label == 'red')"]:
+            mask = cache.getMask(df, q, 1)
+            self.assertTrue((mask == df.eval(q).values).all())
+        self.assertEqual(len(cache.masks), 3)
+        cache.getMask(df, "a > 5 and b<4", 1)
+        self.assertEqual(len(cache.masks), 3)
+        #terms holding an or keep their brackets
+        df = pd.DataFrame({'a':[1,10,1,10], 'b':[1,1,5,5], 'c':[5,5,5,0]})
+        q = "a > 5 and (b < 3 or c > 1)"
+        mask = filtering.QueryCache().getMask(df, q, 1)
+        self.assertEqual(list(mask), list(df.eval(q).values))
+        #models are told apart in tokens even once one is freed
+        uid = TableModel(df).uid
+        self.assertNotEqual(TableModel(df).uid, uid)
+        return
+
+    def testTasks(self):
+        """Background tasks report progress, results and cancelling"""
+
+        from . import tasks
+        df = TableModel.getSampleData(rows=500)
+        t = tasks.Task(tasks.corrMatrix, (df,))
+        t.start()
+        corr = t.wait()
+        self.assertTrue(np.allclose(corr.values, df.corr().values))
+        self.assertEqual(t.progress, 1)
+        order = tasks.Task(tasks.sortPositions, (df, ['a'], False)).run()
+        self.assertTrue((df.a.values[order] == df.sort_values('a', ascending=False).a.values).all())
+        def slow(state):
+            for i in range(1000):
+                state.check()
+                state.setProgress(i/1000)
+                time.sleep(0.01)
+        t = tasks.Task(slow)
+        t.start()
+        t.cancel()
+        self.assertTrue(t.poll())
+        self.assertEqual(t.status, 'cancelled')
+        return
+
+    def testApplyColumnWise(self):
+        """Vectorized column functions match the row wise results"""
+
+        #positive values so that log is defined
+        df = pd.DataFrame({'a': np.linspace(1, 10, 200), 'b': np.linspace(2, 5, 200),
+                           'c': np.arange(1, 201, dtype=float)})
+        df.loc[3, 'b'] = np.nan
+        model = TableModel(df)
+        names = model.applyColumnWise(['a', 'b'], 'mean')
+        self.assertTrue(np.allclose(df[names[0]], df[['a', 'b']].mean(1)))
+        names = model.applyColumnWise(['a', 'c'], 'subtract')
+        self.assertEqual(names, ['a subtract c'])
+        self.assertTrue(np.allclose(df[names[0]], df.a-df.c))
+        names = model.applyColumnWise(['a', 'c'], 'log')
+        self.assertEqual(names, ['a_x', 'c_x'])
+        self.assertTrue(np.allclose(df.c_x, np.log(df.c)))
+        model.applyColumnWise(['a'], 'sin', inplace=True)
+        self.assertTrue(np.allclose(df.a, np.sin(df.a_x.apply(np.exp))))
+        return
+
+    def testStringPipeline(self):
+        """Chained string operations and their cached steps"""
+
+        from . import strings
+        s = pd.Series([' A-b ', 'c-D', np.nan, 'x']*50)
+        steps = strings.parseSteps("strip | lower | replace('-', '_')")
+        p = strings.StringPipeline(steps)
+        expected = s.str.strip().str.lower().str.replace('-', '_')
+        self.assertTrue(p.apply(s).equals(expected))
+        cache = strings.StringCache()
+        p.apply(s, 'a', cache)
+        self.assertEqual(len(cache.results), 3)
+        p = strings.StringPipeline(strings.parseSteps("strip | lower | split('-')"))
+        x = p.apply(s, 'a', cache)
+        self.assertEqual(list(x.columns), [0, 1])
+        self.assertEqual(x.iloc[0, 1], 'b')
+        self.assertRaises(ValueError, strings.parseSteps, "strip | nosuchop")
+        self.assertRaises(ValueError, strings.StringPipeline,
+                          strings.parseSteps("split | lower"))
+        return
+
+    def testDateParsing(self):
+        """Inferred date formats, cached per column, and fields"""
+
+        from . import dates
+        s = pd.Series(['03/10/2016', '25/12/2015', None, '01/02/2016']*20)
+        parser = dates.DateParser()
+        d = parser.parse(s, key='a')
+        self.assertEqual(parser.formats['a'], '%d/%m/%Y')
+        self.assertTrue(d.equals(pd.to_datetime(s, format='%d/%m/%Y')))
+        self.assertEqual(dates.inferFormat(pd.Series(['2016-10-03 12:00'])),
+                         '%Y-%m-%d %H:%M')
+        #ambiguous dates are month first, as in pandas
+        us = pd.Series(['03/10/2016', '01/02/2016', '12/11/2015'])
+        self.assertEqual(dates.inferFormat(us), '%m/%d/%Y')
+        #values in another format are still read, what can't be is counted
+        mixed = pd.Series(['2016-01-%02d' %i for i in range(1, 29)]*100 + ['March 3 2015', 'junk'])
+        self.assertEqual(parser.parse(mixed).iloc[-2], pd.Timestamp('2015-03-03'))
+        self.assertEqual(parser.lost, 1)
+        f = dates.extractFields(d, ['year', 'month', 'quarter', 'day_name'])
+        self.assertEqual(list(f.iloc[0]), [2016, 10, 4, 'Monday'])
+        self.assertTrue(f.iloc[2].isnull().all())
+        return
+
+    def testGrouping(self):
+        """Cached group codes give the same results as groupby"""
+
+        df = TableModel.getSampleData(rows=500)
+        df.loc[4, 'label'] = np.nan
+        model = TableModel(df)
+        g = model.getGrouping(['label', 'd'])
+        self.assertIs(model.getGrouping(['label', 'd']), g)
+        result = g.aggregate(df, {'a': ['mean', 'max']})
+        expected = df.groupby(['label', 'd']).agg({'a': ['mean', 'max']})
+        self.assertTrue(result.equals(expected))
+        names = [n for n, x in g.frames(df)]
+        self.assertEqual(names, [n for n, x in df.groupby(['label', 'd'])])
+        sub = g.take(np.arange(50))
+        self.assertEqual(sum(len(p) for n, p in sub.groups()), df.label[:50].notnull().sum())
+        model.setValueAt('x', 0, 5)
+        self.assertIsNot(model.getGrouping(['label', 'd']), g)
+        return
+
+    def testReshape(self):
+        """Chunked and sparse pivots and melts match pandas"""
+
+        from . import tasks
+        state = tasks.TaskState()
+        df = TableModel.getSampleData(rows=1000)
+        df['i'] = np.arange(1000) % 40
+        expected = pd.pivot_table(df, index='i', columns='label', values=['a', 'b'])
+        p = tasks.pivot(state, df, 'i', 'label', ['a', 'b'], 'chunked', chunksize=300)
+        self.assertTrue(np.allclose(p.values, expected.values, equal_nan=True))
+        p = tasks.pivot(state, df, 'i', 'label', ['a', 'b'], 'sparse', chunksize=300)
+        self.assertTrue(p.columns.equals(expected.columns))
+        self.assertTrue(np.allclose(p.sparse.to_dense().values, expected.values, equal_nan=True))
+        est = tasks.pivotEstimate(1000, 40, df.label.nunique(), 2)
+        self.assertEqual(est['shape'], expected.shape)
+        m = tasks.melt(state, df, 'i', ['a', 'b'], 'var', method='chunked')
+        expected = pd.melt(df, id_vars='i', value_vars=['a', 'b'], var_name='var')
+        self.assertTrue((m.value == expected.value).all())
+        self.assertTrue((m['var'].astype(str) == expected['var']).all())
+        return
+
+    def testMergeEngine(self):
+        """Indexed and sorted merges match pandas and predict their size"""
+
+        from . import joins
+        df1 = pd.DataFrame({'k': np.arange(200) % 30, 'x': np.arange(200)})
+        df2 = pd.DataFrame({'k': np.arange(100) % 50, 'y': np.arange(100)})
+        for how in ['inner', 'left', 'right']:
+            expected = pd.merge(df1, df2, on='k', how=how)
+            plan = joins.planJoin(df1, df2, ['k'], ['k'], how)
+            self.assertEqual(plan['engine'], 'hash')
+            self.assertEqual(plan['rows'], len(expected))
+            self.assertTrue(plan['manytomany'])
+            result = joins.merge(df1, df2, ['k'], ['k'], how, plan=plan)
+            self.assertTrue(result.equals(expected))
+        #nothing to match on the right
+        result = joins.merge(df1, df2.iloc[:0], ['k'], ['k'], 'left')
+        self.assertEqual(len(result), 200)
+        s1 = df1.sort_values('k').reset_index(drop=True)
+        s2 = df2.drop_duplicates('k').sort_values('k').reset_index(drop=True)
+        plan = joins.planJoin(s1, s2, ['k'], ['k'], 'left')
+        self.assertEqual(plan['engine'], 'sorted')
+        self.assertFalse(plan['manytomany'])
+        result = joins.merge(s1, s2, ['k'], ['k'], 'left', plan=plan)
+        self.assertTrue(result.equals(pd.merge(s1, s2, on='k', how='left')))
+        return
+
 class DataExploreTests(unittest.TestCase):
     def setUp(self):
         return
@@ -54,11 +54,76 @@ def getTextLength(text, w, font=None):
 def check_multiindex(index):
     """Check if index is a multiindex"""
 
-    if isinstance(index, pd.core.index.MultiIndex):
+    if isinstance(index, pd.MultiIndex):
         return 1
     else:
         return 0
 
+def check_sparse(s):
+    """Check if a series is stored as a sparse array"""
+
+    if str(s.dtype).startswith('Sparse') or type(s).__name__ == 'SparseSeries':
+        return 1
+    else:
+        return 0
+
+def check_categorical(s):
+    """Check if a series is categorical"""
+
+    if str(s.dtype) == 'category':
+        return 1
+    else:
+        return 0
+
+def to_sparse(values, fill_value=np.nan):
+    """Make a sparse array from values, works across pandas versions"""
+
+    try:
+        from pandas.arrays import SparseArray
+    except ImportError:
+        SparseArray = pd.SparseArray
+    return SparseArray(values, fill_value=fill_value)
+
+def sparseColumn(n, positions, values):
+    """A column of length n holding values at the given row positions,
+       all other rows are empty and take no memory"""
+
+    try:
+        from pandas.arrays import SparseArray
+    except ImportError:
+        SparseArray = pd.SparseArray
+    from pandas._libs.sparse import IntIndex
+    index = IntIndex(n, np.asarray(positions, dtype=np.int32))
+    return SparseArray(values, sparse_index=index, fill_value=np.nan)
+
+def blankColumn(n, dtype='float64'):
+    """An empty sparse column of length n"""
+
+    return sparseColumn(n, [], np.empty(0, dtype=dtype))
+
+def denseBlock(df):
+    """Convert any sparse columns of a small frame, or a sparse series
+       such as a single row, to normal ones"""
+
+    if isinstance(df, pd.Series):
+        if check_sparse(df):
+            return to_dense(df)
+        return df
+    sparse = [c for c, d in df.dtypes.items() if str(d).startswith('Sparse')]
+    if len(sparse) == 0:
+        return df
+    df = df.copy()
+    for c in sparse:
+        df[c] = to_dense(df[c])
+    return df
+
+def to_dense(s):
+    """Convert a sparse series back to a normal one"""
+
+    if hasattr(s, 'sparse'):
+        return s.sparse.to_dense()
+    return s.to_dense()
+
 def getAttributes(obj):
     """Get non hidden and built-in type object attributes that can be persisted"""
 
@@ -119,3 +184,154 @@ def adjustColorMap(cmap, minval=0.0, maxval=1.0, n=100):
         'trunc({n},{a:.2f},{b:.2f})'.format(n=cmap.name, a=minval, b=maxval),
         cmap(np.linspace(minval, maxval, n)))
     return new_cmap
+
+def formatBytes(n):
+    """Human readable size string for a number of bytes"""
+
+    for unit in ['B','KB','MB','GB']:
+        if abs(n) < 1024.0:
+            return '%3.1f %s' %(n, unit)
+        n /= 1024.0
+    return '%.1f TB' %n
+
+def columnStats(s, exact=50000, k=1024):
+    """Summary values for a column used by the table model stats cache:
+       count, nulls, min, max, sum, mean, std and distinct. m2 is the sum
+       of squared differences from the mean, which std is found from and
+       cell edits update. maxlen is left as None, see longestEntry"""
+
+    n = len(s)
+    if check_sparse(s) and pd.isnull(s.sparse.fill_value):
+        #only the stored values need looking at
+        st = columnStats(pd.Series(s.array.sp_values), exact, k)
+        st['nulls'] = n - st['count']
+        return st
+    count = int(s.count())
+    kind = s.dtype.kind
+    numeric = kind in 'iuf' and check_categorical(s) == 0
+    st = {'count':count, 'nulls':n-count, 'numeric':numeric,
+          'min':None, 'max':None, 'sum':None, 'mean':None, 'm2':None,
+          'maxlen':None}
+    if count > 0:
+        try:
+            st['min'] = s.min()
+            st['max'] = s.max()
+        except TypeError:
+            #mixed types or unordered categories
+            pass
+    if numeric:
+        x = s.astype('float64')
+        st['sum'] = float(x.sum())
+        if count > 0:
+            st['mean'] = float(x.mean())
+            st['m2'] = float(((x - st['mean'])**2).sum())
+    updateMoments(st)
+    st['distinct'] = countDistinct(s, exact, k)
+    return st
+
+def longestEntry(s):
+    """Length of the longest formatted entry of a column"""
+
+    if check_sparse(s) and pd.isnull(s.sparse.fill_value):
+        longest = longestEntry(pd.Series(s.array.sp_values))
+        if s.sparse.npoints < len(s):
+            longest = max(longest, 3)
+        return longest
+    if s.dtype.kind == 'f':
+        s = s.round(3)
+    longest = s.astype('object').astype('str').str.len().max()
+    if longest is None or np.isnan(longest):
+        longest = 1
+    return int(longest)
+
+def countDistinct(s, exact=50000, k=1024):
+    """Number of distinct values, counted exactly up to exact rows and
+       above that estimated from the k smallest hashes"""
+
+    if check_sparse(s) and pd.isnull(s.sparse.fill_value):
+        s = pd.Series(s.array.sp_values)
+    if len(s) <= exact:
+        return int(s.nunique())
+    h = pd.util.hash_pandas_object(s.dropna(), index=False).values
+    low = np.unique(np.partition(h, min(len(h)-1, 8*k))[:8*k])
+    if len(low) < k:
+        return len(np.unique(h))
+    return int((k-1) * 2.0**64 / float(low[k-1]))
+
+def updateMoments(st):
+    """Set std of a column stats dict from its count and m2"""
+
+    st['std'] = None
+    if st['m2'] is None or st['count'] < 2:
+        return
+    st['std'] = np.sqrt(max(st['m2'], 0)/(st['count']-1))
+    return
+
+def addMoment(n, mean, m2, x):
+    """Count, mean and m2 after adding a value (Welford's method)"""
+
+    n += 1
+    d = x - mean
+    mean += d/n
+    return n, mean, m2 + d*(x - mean)
+
+def removeMoment(n, mean, m2, x):
+    """Count, mean and m2 after removing a value"""
+
+    if n <= 1:
+        return 0, 0.0, 0.0
+    n -= 1
+    last = mean
+    mean = last + (last - x)/n
+    return n, mean, max(m2 - (x - last)*(x - mean), 0.0)
+
+def positionsToSlice(rows):
+    """Use a slice for a list of consecutive positions, so that blocks
+       can be taken without indexing every row"""
+
+    if isinstance(rows, slice) or len(rows) == 0:
+        return rows
+    a = np.asarray(rows)
+    if len(a) == 1 or (np.diff(a) == 1).all():
+        return slice(int(a[0]), int(a[-1])+1)
+    return rows
+
+def summarizeArrays(arrays):
+    """Count, sum, mean, min and max of the numeric values in a list of
+       arrays. Numbers stored as text are included"""
+
+    st = {'count':0, 'sum':0.0, 'mean':None, 'min':None, 'max':None}
+    for a in arrays:
+        kind = a.dtype.kind
+        if kind in 'iuf':
+            x = a.astype('float64')
+        elif kind == 'O':
+            x = pd.to_numeric(pd.Series(np.asarray(a, dtype=object)),
+                              errors='coerce').values
+        else:
+            continue
+        x = x[~np.isnan(x)]
+        if len(x) == 0:
+            continue
+        st['count'] += len(x)
+        st['sum'] += float(x.sum())
+        lo, hi = float(x.min()), float(x.max())
+        if st['min'] is None:
+            st['min'], st['max'] = lo, hi
+        else:
+            st['min'], st['max'] = min(st['min'], lo), max(st['max'], hi)
+    if st['count'] > 0:
+        st['mean'] = st['sum']/st['count']
+    return st
+
+def getBuffer(s):
+    """The numpy array holding a series values, for memory checks"""
+
+    v = s.values
+    if hasattr(v, 'codes'):
+        v = v.codes
+    elif hasattr(v, 'sp_values'):
+        v = v.sp_values
+    elif hasattr(v, '_ndarray'):
+        v = v._ndarray
+    return np.asarray(v)